@@ -0,0 +1,52 @@
+""" Micro-benchmark of filtering rows by conditions: rows/sec of
+`ConditionList.match` (evaluating every cell) and of the predicate
+compiled by `ConditionList.compile`
+
+    python benchmarks/bench_conditions.py [rows]
+"""
+import random
+import sys
+import time
+
+from sdbms.core._parser import Column, Comparison, ConditionList, Literal
+
+SCHEMA = {'name': 'str', 'age': 'int', 'employed': 'bool'}
+
+CONDITIONS = {
+    'and': ConditionList('and', [Comparison(Column('name'), '!=', Literal('"John"')),
+                                 Comparison(Column('age'), '>', Literal('30')),
+                                 Comparison(Column('employed'), '=', Literal('True'))]),
+    'or': ConditionList('or', [Comparison(Column('name'), '=', Literal('"John"')),
+                               Comparison(Column('age'), '<', Literal('20')),
+                               Comparison(Column('employed'), '=', Literal('False'))]),
+}
+
+
+def make_rows(n):
+    names = ['"John"', '"Jane"', '"Alice"', '"Bob"', '"Zed"']
+    return [{'_rowid': rowid,
+             'name': random.choice(names),
+             'age': str(random.randint(0, 80)),
+             'employed': random.choice(('True', 'False'))}
+            for rowid in range(n)]
+
+
+def rows_per_sec(predicate, rows):
+    start = time.perf_counter()
+    matched = sum(1 for row in rows if predicate(row))
+    return matched, len(rows) / (time.perf_counter() - start)
+
+
+def main(n):
+    random.seed(0)
+    rows = make_rows(n)
+    for comp_type, conditions_list in CONDITIONS.items():
+        matched, before = rows_per_sec(conditions_list.match, rows)
+        compiled_matched, after = rows_per_sec(conditions_list.compile(SCHEMA), rows)
+        assert matched == compiled_matched
+        print(f'op:{comp_type} ({matched}/{n} rows): match {before:,.0f} rows/s, '
+              f'compiled {after:,.0f} rows/s ({after / before:.1f}x)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -9,6 +9,22 @@ class QueryBuilder(object):
     def __init__(self):
         pass
 
+    def _rowid_conditions(self, form):
+        """
+        Return the conditions selecting the row the user clicked
+        (by its '_rowid', read directly instead of scanning the table)
+
+        :param form: arguments send from front-end, with an optional 'Rowid'
+        :return: str or None if no row was clicked
+        :raises ValueError: if the rowid is not a non-negative integer
+        """
+        rowid = str(form.get('Rowid', '')).strip()
+        if not rowid:
+            return None
+        if not rowid.isdigit():
+            raise ValueError(f'Rowid must be a non-negative integer, not {rowid!r}')
+        return " where op:and conditions _rowid=" + rowid
+
     def build_select(self,*args):
         """
         Return query for select based on arguments
@@ -22,11 +38,18 @@ class QueryBuilder(object):
             2. Operator
             3. Value
 
+        'Limit' and 'Offset' are optional arguments too, restricting
+        the result to a page of rows
+
         :param args: list of arguments send from front-end.
         :return: str
+        :raises ValueError: if the limit or the offset
+            is not a non-negative integer
         """
         table_name = args[0]['TableName']
         condition_type = args[0]['conditionType']
+        limit = str(args[0].get('Limit', ''))
+        offset = str(args[0].get('Offset', ''))
         counter = 1
         labels = list()
         keys = list()
@@ -40,6 +63,8 @@ class QueryBuilder(object):
                 labels.append(args[0][element])
 
         for element in args[0]:
+            if element in ('Limit', 'Offset'):
+                continue
             if counter>4:
                 if counter %3 == 2:
                     keys.append(args[0][element])
@@ -68,6 +93,14 @@ class QueryBuilder(object):
             query+= " where op:"+condition_type+" conditions"
             for i in range(len(keys)):
                 query+= " "+keys[i] + operators[i] + values[i]
+        if limit:
+            if not limit.isdigit():
+                raise ValueError(f'Limit must be a non-negative integer, not {limit!r}')
+            query+= " limit " + limit
+        if offset:
+            if not offset.isdigit():
+                raise ValueError(f'Offset must be a non-negative integer, not {offset!r}')
+            query+= " offset " + offset
         query+= ";"
 
         assert query.__contains__("query")
@@ -104,13 +137,15 @@ class QueryBuilder(object):
 
     def build_delete(self, *args):
         table_name = args[0]['TableName']
-        condition_type = args[0]['conditionType']
+        condition_type = args[0].get('conditionType', '')
         counter = 1
         keys = list()
         operators = list()
         values = list()
         assert (table_name)
         for element in args[0]:
+            if element == 'Rowid':
+                continue
             if counter >= 4:
                 if counter % 3 == 1:
                     keys.append(args[0][element])
@@ -127,7 +162,10 @@ class QueryBuilder(object):
                     values.append(str(value))
             counter += 1
         query = "delete in " + table_name
-        if len(condition_type) > 0:
+        rowid_conditions = self._rowid_conditions(args[0])
+        if rowid_conditions:
+            query += rowid_conditions
+        elif len(condition_type) > 0:
             query += " where op:" + condition_type + " conditions"
             for i in range(len(keys)):
                 query += " " + keys[i] + operators[i] + values[i]
@@ -138,7 +176,7 @@ class QueryBuilder(object):
 
     def build_update(self, *args):
         table_name = args[0]['TableName']
-        condition_type = args[0]['conditionType']
+        condition_type = args[0].get('conditionType', '')
         labels = list()
         labelValues = list()
         keys = list()
@@ -149,6 +187,8 @@ class QueryBuilder(object):
         assert isinstance(condition_type, str)
         assert isinstance(table_name, str)
         for element in args[0]:
+            if element == 'Rowid':
+                continue
             if "myLabel" in element:
                 if counter % 2 == 1:
                     labels.append(args[0][element])
@@ -164,6 +204,8 @@ class QueryBuilder(object):
             counter+=1
         counter = 1
         for element in args[0]:
+            if element == 'Rowid':
+                continue
             if counter >= 6:
                 if counter % 3 == 0:
                     keys.append(args[0][element])
@@ -182,7 +224,10 @@ class QueryBuilder(object):
         query = "update "+ table_name + " set "
         for i in range(len(labels)):
             query+= labels[i]+"="+str(labelValues[i]) + " "
-        if len(condition_type) >0:
+        rowid_conditions = self._rowid_conditions(args[0])
+        if rowid_conditions:
+            query+= rowid_conditions
+        elif len(condition_type) >0:
             query+= " where op:"+condition_type+" conditions"
             for i in range(len(keys)):
                 query+= " "+keys[i] + operators[i] + values[i]
@@ -1,6 +1,6 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, jsonify
 from sdbms.app.service.builder import QueryBuilder
-from sdbms.core._manager import DbManager
+from sdbms.core._manager import DbManager, ResultCache, SchemaCache
 from sdbms.core._parser import QueryParser, CommandError
 
 """
@@ -21,9 +21,19 @@ As a result, you will receive a page witch contains the selected rows.
 
 5.'/update' page used for updating a row. You will need to fill the labels, conditions and values.
 As a response you will receive a successs message or an exception.
+
+On both pages a 'Rowid' can be given instead of the conditions, to change the row with that rowid;
+a rowid which is not a non-negative integer gets a 400 (Bad Request) response.
+
+A 'Limit' or an 'Offset' of the select page which is not a non-negative integer gets a 400 too.
+
+6.'/stats' returns (as json) the hit/miss counters of the schema cache and of the query result
+cache shared by all the requests.
 """
 
 root_path = "/Users/cernescustefan/Documents/Facultate/db"
+schema_cache = SchemaCache()
+result_cache = ResultCache()
 
 main_api = Blueprint('main', __name__,
                      template_folder='templates')
@@ -50,15 +60,24 @@ def update():
     return render_template('update.html')
 
 
+@main_api.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(schema_cache=schema_cache.info()._asdict(),
+                   result_cache=result_cache.info()._asdict())
+
+
 @main_api.route('/result', methods=['POST', 'GET'])
 def result():
     if request.method == 'POST':
         result = request.form
         queryBuilder = QueryBuilder()
         set_db = queryBuilder.use_db(result)
-        query = queryBuilder.build_select(result)
+        try:
+            query = queryBuilder.build_select(result)
+        except ValueError as error:
+            return str(error), 400
         print(result)
-        db_manager = DbManager(root_path)
+        db_manager = DbManager(root_path, schema_cache=schema_cache, result_cache=result_cache)
         parser = QueryParser()
         cmd = parser.parse(set_db)
         rv = cmd.execute(db_manager)
@@ -77,7 +96,7 @@ def insertResult():
         query = queryBuilder.build_insert(result)
         print(result)
         assert result
-        db_manager = DbManager(root_path)
+        db_manager = DbManager(root_path, schema_cache=schema_cache, result_cache=result_cache)
         parser = QueryParser()
         cmd = parser.parse(set_db)
         rv = cmd.execute(db_manager)
@@ -93,10 +112,13 @@ def deleteResult():
         result = request.form
         queryBuilder = QueryBuilder()
         set_db = queryBuilder.use_db(result)
-        query = queryBuilder.build_delete(result)
+        try:
+            query = queryBuilder.build_delete(result)
+        except ValueError as error:
+            return str(error), 400
         print(result)
         assert result
-        db_manager = DbManager(root_path)
+        db_manager = DbManager(root_path, schema_cache=schema_cache, result_cache=result_cache)
         parser = QueryParser()
         cmd = parser.parse(set_db)
         rv = cmd.execute(db_manager)
@@ -113,8 +135,11 @@ def updateResult():
         set_db = queryBuilder.use_db(result)
         print(result)
         assert result
-        query = queryBuilder.build_update(result)
-        db_manager = DbManager(root_path)
+        try:
+            query = queryBuilder.build_update(result)
+        except ValueError as error:
+            return str(error), 400
+        db_manager = DbManager(root_path, schema_cache=schema_cache, result_cache=result_cache)
         parser = QueryParser()
         cmd = parser.parse(set_db)
         rv = cmd.execute(db_manager)
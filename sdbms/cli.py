@@ -9,27 +9,30 @@ def sdb_shell(root_path):
 
     sdb = SimpleDb()
 
-    while True:
-        query = input('> ')
-        query = query.strip()
+    try:
+        while True:
+            query = input('> ')
+            query = query.strip()
 
-        try:
-            rv = sdb.execute(query)
-            printable_rv = None
-            if rv:
-                if isinstance(rv, dict) or isinstance(rv, str):
-                    printable_rv = rv
-                else:
-                    printable_rv = list(rv)
-            if printable_rv:
-                pprint(printable_rv)
-        except CommandError as ce:
-            print(str(ce))
-        except ValueError as ve:
-            print(str(ve))
-        except Exception as ve:
-            print(str(ve))
-        print('\n')
+            try:
+                rv = sdb.execute(query)
+                printable_rv = None
+                if rv:
+                    if isinstance(rv, dict) or isinstance(rv, str):
+                        printable_rv = rv
+                    else:
+                        printable_rv = list(rv)
+                if printable_rv:
+                    pprint(printable_rv)
+            except CommandError as ce:
+                print(str(ce))
+            except ValueError as ve:
+                print(str(ve))
+            except Exception as ve:
+                print(str(ve))
+            print('\n')
+    finally:
+        sdb.close()
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -0,0 +1,186 @@
+import operator
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from collections import namedtuple
+
+from ._sort import read_run
+
+SPILL_PREFIX = '.aggregate-'
+
+# spilled groups are partitioned again (by another hash) at most this
+# many times; past it, the groups of a partition are kept in memory
+MAX_SPILL_DEPTH = 4
+
+
+class AggregateFunc(namedtuple('AggregateFunc', 'start, merge, result, empty')):
+    """ How an aggregate function accumulates the values of a group:
+    `start` turns a value into a state, `merge` combines two states
+    (e.g. of the same group, spilled at different times) and `result`
+    turns the state into the value of the group; `empty` is the value
+    of no rows at all
+    """
+
+
+def _identity(value):
+    return value
+
+
+def _one(value):
+    return 1
+
+
+def _avg_start(value):
+    return (value, 1)
+
+
+def _avg_merge(state, other):
+    return (state[0] + other[0], state[1] + other[1])
+
+
+def _avg_result(state):
+    return state[0] / state[1]
+
+
+AGGREGATE_FUNCS = {
+    'count': AggregateFunc(_one, operator.add, _identity, 0),
+    'sum': AggregateFunc(_identity, operator.add, _identity, None),
+    'min': AggregateFunc(_identity, min, _identity, None),
+    'max': AggregateFunc(_identity, max, _identity, None),
+    'avg': AggregateFunc(_avg_start, _avg_merge, _avg_result, None),
+}
+
+
+def group_size(key, states):
+    """ Estimates the memory (in bytes) taken by a group
+
+    :param tuple key: The values of the group columns
+    :param list states: The states of the aggregates
+    :rtype: int
+    """
+    return (sys.getsizeof(key) + sum(sys.getsizeof(value) for value in key)
+            + sys.getsizeof(states) + sum(sys.getsizeof(state) for state in states))
+
+
+def _row_states(rows, group_by, aggregates):
+    """ Turns every row into its group key and the states of the
+    aggregates for the row alone
+    """
+    starts = [(AGGREGATE_FUNCS[aggregate.func].start, aggregate.col_name)
+              for aggregate in aggregates]
+    for row in rows:
+        yield (tuple(row[col_name] for col_name in group_by),
+               [start(None if col_name == '*' else row[col_name]) for start, col_name in starts])
+
+
+def _spill_groups(groups, partitions, depth):
+    """ Appends the groups to the partition files (by the hash of their key) """
+    for key, states in groups.items():
+        _, partition = partitions[hash((depth, key)) % len(partitions)]
+        pickle.dump((key, states), partition, pickle.HIGHEST_PROTOCOL)
+
+
+def _aggregate(pairs, merges, memory, spill_dir, fan_out, depth=0):
+    """ Merges the states of the pairs of the same group
+
+    Once the groups take `memory` bytes, they are spilled to `fan_out`
+    partition files and the merging starts over; the partitions are then
+    aggregated one after the other (so the groups of a partition, about
+    `1 / fan_out` of all of them, are in memory at once)
+
+    :param Iterable[tuple] pairs: The group keys and the states
+    :param list merges: The merge function of every aggregate
+    :param int memory: Memory budget (in bytes, roughly) of the groups
+    :param spill_dir: Returns the spill dir (created when first needed)
+    :param int fan_out: Number of partitions the groups are spilled to
+    :param int depth: How many times the groups were partitioned
+    :rtype: Iterator[tuple]
+    """
+    groups, size, partitions = {}, 0, None
+    for key, states in pairs:
+        group = groups.get(key)
+        if group is not None:
+            for i, merge in enumerate(merges):
+                group[i] = merge(group[i], states[i])
+            continue
+
+        groups[key] = states
+        size += group_size(key, states)
+        if size >= memory and depth < MAX_SPILL_DEPTH:
+            if partitions is None:
+                partitions = [_open_partition(spill_dir()) for _ in range(fan_out)]
+            _spill_groups(groups, partitions, depth)
+            groups, size = {}, 0
+
+    if partitions is None:
+        yield from groups.items()
+        return
+
+    _spill_groups(groups, partitions, depth)
+    del groups
+    for _, partition in partitions:
+        partition.close()
+    for path, _ in partitions:
+        yield from _aggregate(read_run(path), merges, memory, spill_dir, fan_out, depth + 1)
+        os.remove(path)
+
+
+def _open_partition(spill_dir):
+    """ Creates a partition file in the spill dir, opened for writing
+
+    :return: the path and the file
+    :rtype: tuple
+    """
+    fd, path = tempfile.mkstemp(dir=spill_dir)
+    return path, open(fd, 'wb')
+
+
+def hash_aggregate(rows, group_by, aggregates, memory=32 * 2 ** 20, spill_path=None,
+                   fan_out=16):
+    """ Groups rows by the values of columns and computes aggregates
+    (e.g. ``count(*)``, ``avg(age)``) of every group, streaming the rows
+    through a hash table of the groups
+
+    The groups which do not fit in `memory` bytes are spilled, as
+    partial states, to the partition files of a temporary dir under
+    `spill_path` and merged one partition at a time. The dir is removed
+    once the groups are consumed (or the iteration is stopped). Without
+    group columns, there is a single group, even of no rows
+
+    :param Iterable[Mapping] rows: The rows (with typed values)
+    :param list[str] group_by: Names of the group columns
+    :param list[Aggregate] aggregates: The aggregates
+    :param int memory: Memory budget (in bytes, roughly) of the groups
+    :param str spill_path: The dir where groups are spilled
+        (e.g. the database dir)
+    :param int fan_out: Number of partitions the groups are spilled to
+    :return: a row per group, with the group columns and the aggregates
+        (by name)
+    :rtype: Iterator[dict]
+    """
+    assert fan_out > 1
+    funcs = [AGGREGATE_FUNCS[aggregate.func] for aggregate in aggregates]
+
+    spill_dirs = []
+    def spill_dir():
+        if not spill_dirs:
+            spill_dirs.append(tempfile.mkdtemp(prefix=SPILL_PREFIX, dir=spill_path))
+        return spill_dirs[0]
+
+    try:
+        groups = _aggregate(_row_states(rows, group_by, aggregates),
+                            [func.merge for func in funcs], memory, spill_dir, fan_out)
+        empty = not group_by
+        for key, states in groups:
+            empty = False
+            row = dict(zip(group_by, key))
+            for aggregate, func, state in zip(aggregates, funcs, states):
+                row[aggregate.name] = func.result(state)
+            yield row
+        if empty:
+            yield {aggregate.name: func.empty for aggregate, func in zip(aggregates, funcs)}
+    finally:
+        for path in spill_dirs:
+            shutil.rmtree(path, ignore_errors=True)
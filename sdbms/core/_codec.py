@@ -0,0 +1,145 @@
+import ast
+from collections.abc import Mapping
+
+BOOLS = {'True': True, 'False': False}
+
+
+def decode_literal(cell):
+    """ Decodes a plaintext cell of any type (without eval)
+
+    :param str cell: The plaintext cell (e.g. ``'"John"'``, ``'0x17'``)
+    :rtype: str|int|bool
+    """
+    try:
+        return ast.literal_eval(cell)
+    except (ValueError, SyntaxError, TypeError):
+        raise ValueError(f'Paramater {cell} is not valid') from None
+
+
+def decode_int(cell):
+    """ Decodes the plaintext cell of an `int` column (e.g. ``'23'``)
+
+    :param str cell: The plaintext cell
+    :rtype: int
+    """
+    try:
+        return int(cell)
+    except ValueError:
+        return decode_literal(cell)
+
+
+def decode_bool(cell):
+    """ Decodes the plaintext cell of a `bool` column (e.g. ``'True'``)
+
+    :param str cell: The plaintext cell
+    :rtype: bool
+    """
+    try:
+        return BOOLS[cell]
+    except KeyError:
+        return decode_literal(cell)
+
+
+def decode_str(cell):
+    """ Decodes the plaintext cell of a `str` column (e.g. ``'"John"'``),
+    only parsing the ones holding escape sequences or inner quotes
+
+    :param str cell: The plaintext cell
+    :rtype: str
+    """
+    inner = cell[1:-1]
+    if len(cell) > 1 and cell[0] == cell[-1] == '"' and '\\' not in inner and '"' not in inner:
+        return inner
+    return decode_literal(cell)
+
+
+DECODERS = {
+    'int': decode_int,
+    'bool': decode_bool,
+    'str': decode_str,
+}
+
+
+def decode_cell(col_type, cell):
+    """ Decodes a plaintext cell into the value of its column type
+
+    An empty cell (e.g. of a column added after the row) has no value
+    and raises a `ValueError`
+
+    :param str col_type: Type of the cell's column
+    :param str cell: The plaintext cell
+    :rtype: str|int|bool
+    """
+    return DECODERS.get(col_type, decode_literal)(cell)
+
+
+class TypedRecord(Mapping):
+    """ Read-only record whose cells are decoded into the values of their
+    column types, once and only when they are accessed (e.g. the cells of
+    a row not matching the conditions are never decoded for the result)
+    """
+    __slots__ = ('_record', '_decoders', '_values')
+
+    def __init__(self, record, decoders):
+        """
+        :param Mapping[str,str] record: The record with plaintext cells
+        :param dict decoders: The decoder of every column (the other
+            keys, e.g. '_rowid', are already values)
+        """
+        self._record = record
+        self._decoders = decoders
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        value = self._record[key]
+        decoder = self._decoders.get(key)
+        if decoder is not None:
+            value = decoder(value)
+        self._values[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self._record
+
+    def __iter__(self):
+        return iter(self._record)
+
+    def __len__(self):
+        return len(self._record)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self)})'
+
+
+def schema_decoders(schema):
+    """ Returns the decoder of every column of a schema
+
+    :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+    :rtype: dict[str,Callable[[str],str|int|bool]]
+    """
+    return {col_name: DECODERS.get(col_type, decode_literal)
+            for col_name, col_type in schema.items()}
+
+
+def decode_records(schema, records, lazy=True):
+    """ Decodes the cells of records into the values of their column types
+
+    :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+    :param Iterable[Mapping[str,str]] records: Records with plaintext cells
+    :param bool lazy: Whether to yield :class:`TypedRecord` mappings
+        decoding the cells when they are accessed, or decoded dicts
+    :rtype: Iterator[Mapping]
+    """
+    decoders = schema_decoders(schema)
+    if lazy:
+        for record in records:
+            yield TypedRecord(record, decoders)
+        return
+
+    for record in records:
+        yield {key: decoders[key](cell) if key in decoders else cell
+               for key, cell in record.items()}
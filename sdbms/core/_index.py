@@ -0,0 +1,509 @@
+import bisect
+import fcntl
+import json
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+from ._codec import decode_cell
+
+INDEXES = '.indexes'
+INDEX_PREFIX = '.index.'
+LOG_EXT = '.log'
+
+
+def cell_key(col_type, cell):
+    """ Decodes a plaintext cell into the key it is indexed by
+
+    :param str col_type: Type of the cell's column
+    :param str cell: The plaintext cell (e.g. ``'"John"'``, ``'23'``)
+    :return: the value of the cell (None for an empty cell)
+    :rtype: str|int|bool|None
+    """
+    if cell == '':
+        return None
+    return decode_cell(col_type, cell)
+
+
+def bitmap_rowids(bitmap):
+    """ Returns the rowids of a bitmap (the positions of its set bits)
+
+    :param int bitmap: The bitmap
+    :rtype: set[int]
+    """
+    return {rowid for rowid, bit in enumerate(bin(bitmap)[:1:-1]) if bit == '1'}
+
+
+class IndexInfo(namedtuple('IndexInfo', 'column, kind')):
+    """ Definition of an index: the indexed column and the kind of index """
+
+
+class TableIndex(object):
+    """ Base class for the indexes of a table's column
+
+    An index is kept in memory and persisted in the table dir as a
+    snapshot file (`.index.<name>`) and an append-only delta log
+    (`.index.<name>.log`) with one JSON entry per line:
+    ``[rowid, key]`` sets the key of a rowid and ``[rowid]`` removes it
+
+    Changes are only appended to the log (under an exclusive `flock`)
+    and are read back, like the changes made by other managers or
+    processes, by :meth:`catch_up`; once the log outgrows the snapshot
+    it is folded into a new snapshot (checkpoint)
+    """
+    kind = None
+    col_types = {'str', 'int', 'bool'}
+    ops = ()
+    ordered = False
+    bitwise = False
+
+    CHECKPOINT_SIZE = 64 * 1024
+
+    def __init__(self, path, col_name, col_type):
+        """
+        :param str path: Path of the snapshot file
+        :param str col_name: Name of the indexed column
+        :param str col_type: Type of the indexed column
+        """
+        self.path = path
+        self.log_path = path + LOG_EXT
+        self.col_name = col_name
+        self.col_type = col_type
+        self._snapshot_id = None
+        self._log_offset = 0
+        self._reset()
+
+    def _reset(self):
+        """ Empties the in-memory index """
+        raise NotImplementedError
+
+    def _load(self, data):
+        """ Loads the in-memory index from a snapshot
+
+        :param bytes data: The snapshot
+        """
+        raise NotImplementedError
+
+    def _dump(self):
+        """ Returns the snapshot of the in-memory index
+
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+    def _set(self, rowid, key):
+        """ Sets the key of a rowid in the in-memory index """
+        raise NotImplementedError
+
+    def _remove(self, rowid):
+        """ Removes a rowid (if present) from the in-memory index """
+        raise NotImplementedError
+
+    def _set_many(self, items):
+        """ Sets the keys of many rowids in the emptied in-memory index
+
+        :param Iterable[tuple[int,object]] items: rowid and key pairs
+        """
+        for rowid, key in items:
+            self._set(rowid, key)
+
+    def lookup(self, op, key):
+        """ Returns the rowids whose key compares (by op) to a key
+
+        :param str op: The comparison operator (one of `ops`)
+        :param key: The key compared to
+        :rtype: set[int]
+        """
+        raise NotImplementedError
+
+    def lookup_many(self, conditions):
+        """ Returns the rowids whose key satisfies all the conditions
+
+        :param list[tuple[str,object]] conditions: op and key pairs
+        :rtype: set[int]
+        """
+        return set.intersection(*[self.lookup(op, key) for op, key in conditions])
+
+    @staticmethod
+    def _file_id(file_stat):
+        return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+    def catch_up(self):
+        """ Reloads the snapshot if it was replaced and applies the log
+        entries appended since the last call """
+        try:
+            with open(self.path, 'rb') as fd:
+                snapshot_id = self._file_id(os.fstat(fd.fileno()))
+                if snapshot_id != self._snapshot_id:
+                    self._reset()
+                    self._load(fd.read())
+                    self._snapshot_id = snapshot_id
+                    self._log_offset = 0
+        except FileNotFoundError:
+            if self._snapshot_id is not None:
+                self._reset()
+                self._snapshot_id = None
+                self._log_offset = 0
+
+        try:
+            log_size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            log_size = 0
+        if log_size < self._log_offset:
+            # the log was folded into a snapshot meanwhile
+            self._reset()
+            self._snapshot_id = None
+            self._log_offset = 0
+            return self.catch_up()
+        if log_size == self._log_offset:
+            return
+
+        with open(self.log_path, 'rb') as fd:
+            fd.seek(self._log_offset)
+            data = fd.read(log_size - self._log_offset)
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line torn by a crash
+                continue
+            if len(entry) == 2:
+                self._set(*entry)
+            else:
+                self._remove(entry[0])
+        self._log_offset += end
+
+    def _write_snapshot(self):
+        """ Atomically replaces the snapshot with the in-memory index """
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as fd:
+            fd.write(self._dump())
+        os.replace(tmp_path, self.path)
+        self._snapshot_id = self._file_id(os.stat(self.path))
+
+    def build(self, records):
+        """ (Re)builds the index in bulk from the records of the table
+
+        :param Iterable[dict[str,str]] records: Records with the '_rowid'
+            key and the indexed column
+        """
+        self._reset()
+        self._set_many((record['_rowid'], cell_key(self.col_type, record[self.col_name]))
+                       for record in records)
+        with open(self.log_path, 'ab') as log_fd:
+            fcntl.flock(log_fd, fcntl.LOCK_EX)
+            self._write_snapshot()
+            log_fd.truncate(0)
+            self._log_offset = 0
+
+    def _log(self, entries):
+        """ Appends entries to the delta log, folding it into a new
+        snapshot once it is larger than the snapshot """
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries)
+        with open(self.log_path, 'ab') as log_fd:
+            fcntl.flock(log_fd, fcntl.LOCK_EX)
+            log_fd.write(data.encode('utf-8'))
+            log_fd.flush()
+
+            snapshot_size = self._snapshot_id[1] if self._snapshot_id else 0
+            if log_fd.tell() > max(self.CHECKPOINT_SIZE, snapshot_size):
+                self.catch_up()
+                self._write_snapshot()
+                log_fd.truncate(0)
+                self._log_offset = 0
+
+    def put(self, records):
+        """ Sets the keys of (inserted or updated) rows
+
+        :param Iterable[dict[str,str]] records: Records with the '_rowid'
+            key and the indexed column
+        """
+        self._log([record['_rowid'], cell_key(self.col_type, record[self.col_name])]
+                  for record in records)
+
+    def delete(self, rowids):
+        """ Removes (deleted) rows from the index
+
+        :param Iterable[int] rowids: Unique identifiers of the rows
+        """
+        self._log([rowid] for rowid in rowids)
+
+    def drop(self):
+        """ Deletes the files of the index """
+        for path in (self.path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class HashIndex(TableIndex):
+    """ Hash index: maps every key to the set of rowids having it,
+    so `=` comparisons are answered with a dict lookup
+    """
+    kind = 'hash'
+    ops = ('=', )
+
+    def _reset(self):
+        self._rowids = {}
+        self._keys = {}
+
+    def _load(self, data):
+        for key, rowids in json.loads(data or b'[]'):
+            for rowid in rowids:
+                self._set(rowid, key)
+
+    def _dump(self):
+        return json.dumps([[key, sorted(rowids)]
+                           for key, rowids in self._rowids.items()]).encode('utf-8')
+
+    def _set(self, rowid, key):
+        self._remove(rowid)
+        self._keys[rowid] = key
+        self._rowids.setdefault(key, set()).add(rowid)
+
+    def _remove(self, rowid):
+        if rowid not in self._keys:
+            return
+        key = self._keys.pop(rowid)
+        self._rowids[key].discard(rowid)
+        if not self._rowids[key]:
+            del self._rowids[key]
+
+    def lookup(self, op, key):
+        assert op in self.ops
+        self.catch_up()
+        return set(self._rowids.get(key, ()))
+
+
+class BtreeIndex(TableIndex):
+    """ Ordered index of an `int` column: a B+-tree of ``(key, rowid)``
+    entries with two levels, sorted leaf pages of at most `PAGE_SIZE`
+    entries and a root holding the first entry of every page. It is
+    bisected to answer `=`, `<`, `<=`, `>` and `>=` comparisons and can
+    be iterated in key order; setting or removing a key only bisects the
+    root and changes a single page (split in two once it is full)
+
+    The snapshot is the entries in key order (``<key:i64><rowid:u64>``
+    entries), so it is loaded into pages without sorting and rebuilding
+    the index is a single sort; empty cells are not indexed (they match
+    nothing)
+    """
+    kind = 'btree'
+    col_types = {'int'}
+    ops = ('=', '<', '<=', '>', '>=')
+    ordered = True
+
+    entry = struct.Struct('<qQ')
+    PAGE_SIZE = 512
+
+    def _reset(self):
+        self._pages = []
+        self._firsts = []
+        self._keys = {}
+
+    def _paginate(self, entries):
+        """ Fills the pages with sorted entries """
+        self._pages = [entries[start:start + self.PAGE_SIZE]
+                       for start in range(0, len(entries), self.PAGE_SIZE)]
+        self._firsts = [page[0] for page in self._pages]
+
+    def _load(self, data):
+        entries = list(self.entry.iter_unpack(data))
+        self._keys = {rowid: key for key, rowid in entries}
+        self._paginate(entries)
+
+    def _dump(self):
+        return b''.join(self.entry.pack(*entry) for page in self._pages for entry in page)
+
+    def _page(self, entry):
+        """ Returns the number of the page an entry belongs to """
+        return max(bisect.bisect_right(self._firsts, entry) - 1, 0)
+
+    def _set(self, rowid, key):
+        self._remove(rowid)
+        if key is None:
+            return
+        self._keys[rowid] = key
+        entry = (key, rowid)
+        if not self._pages:
+            self._pages.append([entry])
+            self._firsts.append(entry)
+            return
+
+        number = self._page(entry)
+        page = self._pages[number]
+        bisect.insort(page, entry)
+        self._firsts[number] = page[0]
+        if len(page) > self.PAGE_SIZE:
+            half = len(page) // 2
+            self._pages[number:number + 1] = [page[:half], page[half:]]
+            self._firsts[number:number + 1] = [page[0], page[half]]
+
+    def _remove(self, rowid):
+        key = self._keys.pop(rowid, None)
+        if key is None:
+            return
+        entry = (key, rowid)
+        number = self._page(entry)
+        page = self._pages[number]
+        del page[bisect.bisect_left(page, entry)]
+        if page:
+            self._firsts[number] = page[0]
+        else:
+            del self._pages[number]
+            del self._firsts[number]
+
+    def _set_many(self, items):
+        self._keys = {rowid: key for rowid, key in items if key is not None}
+        self._paginate(sorted((key, rowid) for rowid, key in self._keys.items()))
+
+    def _position(self, entry):
+        """ Returns the position (page and offset) of the first entry
+        not lower than an entry
+
+        :rtype: tuple[int,int]
+        """
+        if not self._pages:
+            return (0, 0)
+        number = self._page(entry)
+        offset = bisect.bisect_left(self._pages[number], entry)
+        if offset == len(self._pages[number]):
+            return (number + 1, 0)
+        return (number, offset)
+
+    def _bounds(self, op, key):
+        """ Returns the positions of the first entry whose key compares
+        (by op) to a key and of the entry after the last one
+
+        :rtype: tuple[tuple[int,int],tuple[int,int]]
+        """
+        # (key, ) sorts before every (key, rowid) entry
+        first = self._position((key, ))
+        after = self._position((key + 1, ))
+        start, end = (0, 0), (len(self._pages), 0)
+        return {
+            '=': (first, after),
+            '<': (start, first),
+            '<=': (start, after),
+            '>': (after, end),
+            '>=': (first, end),
+        }[op]
+
+    def _entries(self, start, stop):
+        """ Iterates over the entries between two positions """
+        number, offset = start
+        while (number, offset) < stop:
+            page = self._pages[number]
+            yield from page[offset:stop[1] if number == stop[0] else len(page)]
+            number, offset = number + 1, 0
+
+    def lookup(self, op, key):
+        return self.lookup_many([(op, key)])
+
+    def lookup_many(self, conditions):
+        # the ranges of the conditions are intersected before
+        # any rowid is collected
+        self.catch_up()
+        start, stop = (0, 0), (len(self._pages), 0)
+        for op, key in conditions:
+            assert op in self.ops
+            first, after = self._bounds(op, key)
+            start, stop = max(start, first), min(stop, after)
+        return {rowid for _, rowid in self._entries(start, stop)}
+
+    def iter_rowids(self, reverse=False):
+        """ Iterates over the indexed rowids in key order
+
+        :param bool reverse: Whether to iterate in descending key order
+        :rtype: Iterator[int]
+        """
+        self.catch_up()
+        entries = [entry for page in self._pages for entry in page]
+        for _, rowid in reversed(entries) if reverse else entries:
+            yield rowid
+
+
+class BitmapIndex(TableIndex):
+    """ Bitmap index of a `bool` column: one bitmap per key (an int whose
+    bit `rowid` is set for the rows having the key), so the `=`
+    comparisons of several columns are combined with bitwise `&` and `|`
+    before any rowid is collected
+
+    The snapshot holds the lengths of the two bitmaps followed by their
+    (little-endian) bytes, all zlib-compressed
+    """
+    kind = 'bitmap'
+    col_types = {'bool'}
+    ops = ('=', )
+    bitwise = True
+
+    header = struct.Struct('<II')
+
+    def _reset(self):
+        self._bitmaps = {True: 0, False: 0}
+        self._keys = {}
+
+    def _load(self, data):
+        if not data:
+            return
+        data = zlib.decompress(data)
+        true_size, false_size = self.header.unpack_from(data)
+        start = self.header.size
+        self._bitmaps[True] = int.from_bytes(data[start:start + true_size], 'little')
+        start += true_size
+        self._bitmaps[False] = int.from_bytes(data[start:start + false_size], 'little')
+        self._keys = {rowid: key for key in (True, False)
+                      for rowid in bitmap_rowids(self._bitmaps[key])}
+
+    def _dump(self):
+        true, false = (self._bitmaps[key].to_bytes((self._bitmaps[key].bit_length() + 7) // 8,
+                                                    'little')
+                       for key in (True, False))
+        return zlib.compress(self.header.pack(len(true), len(false)) + true + false)
+
+    def _set(self, rowid, key):
+        # only the bitmaps of the old and the new key are changed
+        if self._keys.get(rowid) == key:
+            return
+        self._remove(rowid)
+        if key is not None:
+            self._keys[rowid] = key
+            self._bitmaps[key] |= 1 << rowid
+
+    def _remove(self, rowid):
+        key = self._keys.pop(rowid, None)
+        if key is not None:
+            self._bitmaps[key] &= ~(1 << rowid)
+
+    def _set_many(self, items):
+        # the bits are set in bytearrays (setting them in the ints
+        # would copy a whole bitmap per rowid)
+        self._keys = {rowid: key for rowid, key in items if key is not None}
+        size = max(self._keys, default=-1) // 8 + 1
+        bits = {True: bytearray(size), False: bytearray(size)}
+        for rowid, key in self._keys.items():
+            bits[key][rowid >> 3] |= 1 << (rowid & 7)
+        self._bitmaps = {key: int.from_bytes(bits[key], 'little') for key in bits}
+
+    def bitmap(self, op, key):
+        """ Returns the bitmap of the rows whose key compares (by op)
+        to a key
+
+        :param str op: The comparison operator (one of `ops`)
+        :param bool key: The key compared to
+        :rtype: int
+        """
+        assert op in self.ops
+        self.catch_up()
+        return self._bitmaps.get(key, 0)
+
+    def lookup(self, op, key):
+        return bitmap_rowids(self.bitmap(op, key))
+
+
+INDEX_KINDS = {
+    HashIndex.kind: HashIndex,
+    BtreeIndex.kind: BtreeIndex,
+    BitmapIndex.kind: BitmapIndex,
+}
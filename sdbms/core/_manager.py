@@ -1,7 +1,267 @@
+import itertools
 import os
 import shutil
+import stat
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from ._codec import TypedRecord, decode_records, schema_decoders
+from ._index import INDEXES, INDEX_PREFIX, INDEX_KINDS, IndexInfo
+from ._sort import row_size
+from ._storage import STORAGE, DEFAULT_STORAGE, STORAGES, DirStorage, RowFilter, fsync_path
+from ._wal import WAL, WalLockedError, WriteAheadLog
 
 SCHEMA = '.schema'
+META = '.meta'
+COMPACT_EXT = '.compact'
+OLD_EXT = '.old'
+
+
+class TableMeta(namedtuple('TableMeta', 'next_rowid, count, version, lsn',
+                           defaults=(0, ))):
+    """ Metadata maintained for each table
+
+    * `next_rowid`: the rowid the next inserted row gets (never reused)
+    * `count`: the number of live rows
+    * `version`: increased by every change of the table's rows or schema,
+      starting from the creation time (in ns) of the table so a table
+      created again does not get the versions of the deleted one
+    * `lsn`: the last mutation of the write-ahead log applied to the table
+    """
+
+
+class CompactResult(namedtuple('CompactResult', 'rows, storage, bytes_before, bytes_after, '
+                                                'inodes_before, inodes_after, rowids')):
+    """ Outcome of the compaction of a table
+
+    * `rows`: number of rows of the compacted table
+    * `storage`: storage of the compacted table
+    * `bytes_before`, `bytes_after`: disk space used by the table dir
+    * `inodes_before`, `inodes_after`: files and dirs of the table dir
+    * `rowids`: old rowid -> new rowid of the renumbered rows
+      (None if the rows kept their rowids)
+    """
+    @property
+    def bytes_reclaimed(self):
+        return self.bytes_before - self.bytes_after
+
+    @property
+    def inodes_reclaimed(self):
+        return self.inodes_before - self.inodes_after
+
+
+class TableLock(object):
+    """ Lock of a table held (shared) while its rows are read or changed
+    and (exclusively) while its dir is swapped for a rewritten one
+
+    Shared holders do not wait for each other, so a thread can take it
+    again while holding it (e.g. to update the rows it is scanning).
+    A scan holds it until it is consumed (or closed), so a thread cannot
+    take it exclusively while one of its scans is open
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        # thread ident -> number of shared holds
+        self._holders = Counter()
+
+    @contextmanager
+    def shared(self):
+        thread = threading.get_ident()
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            self._shared += 1
+            self._holders[thread] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                self._holders[thread] -= 1
+                if not self._holders[thread]:
+                    del self._holders[thread]
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self, timeout=None):
+        """
+        :param float timeout: How many seconds to wait for the shared
+            holders (forever if None)
+        :raises ValueError: if the calling thread holds the lock shared
+            or the lock is not released in time
+        """
+        with self._cond:
+            if self._holders[threading.get_ident()]:
+                raise ValueError('The table is being read (or changed) by this thread')
+            if not self._cond.wait_for(lambda: not self._exclusive and not self._shared,
+                                       timeout):
+                raise ValueError('The table is being read (or changed), try again later')
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+class CacheInfo(namedtuple('CacheInfo', 'hits, misses, currsize')):
+    """ Statistics of a cache (like :func:`functools.lru_cache`'s) """
+
+
+class SchemaCache(object):
+    """ In-process cache of parsed '.schema' files
+
+    Entries are keyed by the schema file path and are only used while the
+    file's inode, size and mtime are the ones seen when it was parsed, so
+    changes made by other processes are picked up as well.
+    A cache can be shared by several :class:`DbManager` objects
+    (e.g. the ones created for each request of the web app)
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _file_key(file_stat):
+        return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+    def get(self, schema_path, file_stat):
+        """ Returns the cached schema of a path or None if it is missing
+        or stale
+
+        :param str schema_path: Path to the schema file
+        :param os.stat_result file_stat: Current stat of the schema file
+        :rtype: dict[str,str]|None
+        """
+        with self._lock:
+            entry = self._entries.get(schema_path)
+            if entry is not None and entry[0] == self._file_key(file_stat):
+                self._hits += 1
+                return dict(entry[1])
+            self._misses += 1
+
+    def put(self, schema_path, file_stat, schema):
+        """ Caches the schema parsed from a path
+
+        :param str schema_path: Path to the schema file
+        :param os.stat_result file_stat: Stat of the schema file when parsed
+        :param dict[str,str] schema: Key-value schema
+        """
+        with self._lock:
+            self._entries[schema_path] = (self._file_key(file_stat), dict(schema))
+
+    def invalidate(self, path):
+        """ Drops the cached schema of a path and of the paths under it
+
+        :param str path: Path to a schema file or to a dir containing some
+        """
+        prefix = os.path.join(path, '')
+        with self._lock:
+            for schema_path in list(self._entries):
+                if schema_path == path or schema_path.startswith(prefix):
+                    del self._entries[schema_path]
+
+    def info(self):
+        """ Returns the hit/miss counters of the cache
+
+        :rtype: CacheInfo
+        """
+        with self._lock:
+            return CacheInfo(hits=self._hits, misses=self._misses,
+                             currsize=len(self._entries))
+
+
+class ResultCache(object):
+    """ In-process LRU cache of query results
+
+    Entries are keyed by the (normalized) query and are only used while
+    the tables it reads are at the versions (see :class:`TableMeta`) they
+    had when it was executed, so any change of their rows or schemas,
+    even by another :class:`DbManager` sharing the cache, is picked up.
+    The least recently used entries are evicted to keep the (estimated)
+    size of the cached rows within `max_bytes`
+    """
+    def __init__(self, max_bytes=16 * 2 ** 20):
+        """
+        :param int max_bytes: Memory budget (in bytes, roughly) of the
+            cached rows
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, versions):
+        """ Returns the cached rows of a query or None if they are missing
+        or stale
+
+        :param key: The query (e.g. the database and the parsed command)
+        :param tuple versions: The current versions of the tables read
+        :rtype: list[dict]|None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return [dict(row) for row in entry[1]]
+            if entry is not None:
+                self._drop(key)
+            self._misses += 1
+
+    def put(self, key, versions, rows):
+        """ Caches the rows of a query, evicting the least recently used
+        entries beyond the memory budget
+
+        :param key: The query (e.g. the database and the parsed command)
+        :param tuple versions: The versions of the tables read
+        :param list[dict] rows: The result rows
+        """
+        size = sum(map(row_size, rows))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (versions, [dict(row) for row in rows], size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, path):
+        """ Drops the cached results reading the tables under a path
+
+        :param str path: Path to a table dir or to a database dir
+        """
+        prefix = os.path.join(path, '')
+        with self._lock:
+            for key, (versions, _, _) in list(self._entries.items()):
+                if any(table_path == path or table_path.startswith(prefix)
+                       for table_path, _ in versions):
+                    self._drop(key)
+
+    def info(self):
+        """ Returns the hit/miss counters of the cache
+
+        :rtype: CacheInfo
+        """
+        with self._lock:
+            return CacheInfo(hits=self._hits, misses=self._misses,
+                             currsize=len(self._entries))
 
 
 class DbManager(object):
@@ -44,16 +304,97 @@ class DbManager(object):
 
     4. Each value for a cell is saved in a plaintext column file
     with the extension being the type of the data contained
+
+    5. Each table also has a '.meta' file holding the next rowid,
+    the live row count and the version of the table::
+
+        # .meta
+        next_rowid,2
+        count,2
+        version,3
+        lsn,0
+
+    This is the default ('dirs') storage of a table; a table can also
+    be created with another storage (e.g. 'packed' append-only segments
+    or 'columns' with one file per column)
+    which is recorded in a '.storage' file next to the '.schema' and
+    the rows are then managed by the matching :class:`TableStorage`
+
+    6. A table can have indexes on its columns, listed in an '.indexes'
+    file (lines of `name,column,kind`) and persisted in '.index.<name>'
+    files next to the '.schema' (see :class:`TableIndex`)
+
+    7. Optionally, rows are inserted, updated and deleted through a
+    write-ahead log: a '.wal' file in the database dir where the mutations
+    are made durable (sharing fsyncs between concurrent writers) before
+    being applied to the tables by a background thread
+    (see :class:`WriteAheadLog`)
     
     """
-    def __init__(self, root_path=None):
+    INSERT_BATCH_SIZE = 10000
+    PARTITIONS_PER_PROCESS = 4
+    # seconds a change of a table's dir waits for its scans to be done
+    LOCK_TIMEOUT = 30
+
+    def __init__(self, root_path=None, schema_cache=None,
+                 scan_workers=0, scan_ordered=True, scan_readahead=None,
+                 query_processes=0, query_ordered=True,
+                 wal=False, wal_commit_delay=0, sort_memory=32 * 2 ** 20,
+                 aggregate_memory=32 * 2 ** 20, result_cache=None, wal_recovery=True):
         """
         :param str root_path: The root dir where the database will be managed
+        :param SchemaCache schema_cache: Cache of the parsed schemas
+            (a new one is used if not given)
+        :param int scan_workers: Default number of threads used by
+            :meth:`scan_rows` to read rows ('dirs' storage); 0 is a serial scan
+        :param bool scan_ordered: Default ordering of parallel scans
+        :param int scan_readahead: Default number of rows read ahead
+            by parallel scans
+        :param int query_processes: Number of processes queries are
+            executed by, each on a partition of the table's rowids;
+            0 or 1 executes queries in the current process
+        :param bool query_ordered: Whether the results of a partitioned
+            query are returned in rowid order or as partitions finish
+        :param bool wal: Whether rows are changed through the write-ahead
+            log of the current database
+        :param float wal_commit_delay: How many seconds a writer syncing the
+            write-ahead log waits for other writers to join its group commit
+        :param int sort_memory: Memory budget (in bytes, roughly) of the rows
+            sorted in memory by `order by`; beyond it, sorted runs are
+            spilled to temporary files in the database dir
+        :param int aggregate_memory: Memory budget (in bytes, roughly) of
+            the groups of an aggregate query; beyond it, groups are
+            spilled to temporary files in the database dir
+        :param ResultCache result_cache: Cache of the query results
+            (the results are not cached if not given)
+        :param bool wal_recovery: Whether :meth:`use_db` applies the mutations
+            left in the write-ahead log of a database when not using the log
+            (off for the processes executing partitioned queries)
         """
         
         self.root_path = root_path or '.'
         self._db_name = None
         self._db_path = None
+        self._storages = {}
+        self._schema_cache = schema_cache or SchemaCache()
+        self.scan_workers = scan_workers
+        self.scan_ordered = scan_ordered
+        self.scan_readahead = scan_readahead
+        self.query_processes = query_processes
+        self.query_ordered = query_ordered
+        self._process_pool = None
+        self.wal = wal
+        self.wal_commit_delay = wal_commit_delay
+        self.wal_recovery = wal_recovery
+        self.sort_memory = sort_memory
+        self.aggregate_memory = aggregate_memory
+        self._result_cache = result_cache
+        self._wal = None
+        self._wal_lock = threading.Lock()
+        self._wal_tables = set()
+        self._next_rowids = {}
+        self._table_locks = {}
+        self._indexes = {}
 
     @property
     def db_path(self):
@@ -90,11 +431,18 @@ class DbManager(object):
     def _get_schema(self, schema_path):
         """ Gets schema from the specified path
 
+        The parsed schema is cached until the file changes
+
         :param str schema_path: Path to the schema file
         :return: schema key-value maps `[column_name, column_type]`
         :rtype: dict[str,str]
         """
-        assert os.path.isfile(schema_path) #precondition check if the file exists
+        file_stat = os.stat(schema_path)
+        assert stat.S_ISREG(file_stat.st_mode) #precondition check if the file exists
+        schema = self._schema_cache.get(schema_path, file_stat)
+        if schema is not None:
+            return schema
+
         schema = {}
         with open(schema_path) as fd:
             cols = fd.read().split('\n')
@@ -105,8 +453,134 @@ class DbManager(object):
                 schema[col_name] = col_type
 
         assert schema #precondition  check if schema is not empty
+        self._schema_cache.put(schema_path, file_stat, schema)
         return schema
 
+    def schema_cache_info(self):
+        """ Returns the hit/miss counters of the schema cache
+
+        :rtype: CacheInfo
+        """
+        return self._schema_cache.info()
+
+    def cached_rows(self, key, tables, execute):
+        """ Iterates over the rows of a query, from the result cache if
+        they were cached at the current versions of the tables it reads
+
+        Otherwise the query is executed and its rows are cached once
+        they are all consumed
+
+        :param key: The normalized query (e.g. the parsed command)
+        :param list[str] tables: Names of the tables the query reads
+        :param execute: Returns an iterator over the rows of the query
+        :rtype: Iterator[dict]
+        """
+        if self._result_cache is None:
+            yield from execute()
+            return
+
+        key = (self.db_path, key)
+        versions = tuple((os.path.join(self.db_path, table), self.get_table_meta(table).version)
+                         for table in tables)
+        rows = self._result_cache.get(key, versions)
+        if rows is not None:
+            yield from rows
+            return
+
+        rows = []
+        for row in execute():
+            rows.append(row)
+            yield row
+        self._result_cache.put(key, versions, rows)
+
+    def result_cache_info(self):
+        """ Returns the hit/miss counters of the result cache (None if
+        the results are not cached)
+
+        :rtype: CacheInfo|None
+        """
+        if self._result_cache is not None:
+            return self._result_cache.info()
+
+    def _put_meta(self, table_path, meta):
+        """ Atomically writes the metadata of a table dir
+
+        The metadata is written to a temporary file which then
+        replaces the '.meta' file
+
+        :param str table_path: Absolute path of a table dir
+        :param TableMeta meta: The new metadata
+        """
+        meta_path = os.path.join(table_path, META)
+        tmp_meta_path = f'{meta_path}.tmp'
+        with open(tmp_meta_path, 'w') as fd:
+            for key, value in meta._asdict().items():
+                fd.write(f'{key},{value}\n')
+        os.replace(tmp_meta_path, meta_path)
+
+        assert os.path.isfile(meta_path)
+
+    def _get_meta(self, table_path):
+        """ Gets the metadata of a table dir
+
+        Tables created before the '.meta' file existed get it
+        built (once) from their rows
+
+        :param str table_path: Absolute path of a table dir
+        :rtype: TableMeta
+        """
+        meta_path = os.path.join(table_path, META)
+        if not os.path.isfile(meta_path):
+            schema = self._get_schema(os.path.join(table_path, SCHEMA))
+            storage = self._table_storage(table_path)
+            count = sum(1 for _ in storage.scan(schema, columns=[]))
+            meta = TableMeta(next_rowid=storage.next_rowid(), count=count,
+                             version=time.time_ns())
+            self._put_meta(table_path, meta)
+            return meta
+
+        values = {}
+        with open(meta_path) as fd:
+            for line in fd.read().split('\n'):
+                if line != '':
+                    key, value = line.split(',')
+                    values[key] = int(value)
+        return TableMeta(**values)
+
+    def _change_meta(self, table_path, rowids=0, count=0, meta=None, lsn=None):
+        """ Updates the metadata of a table dir after a change,
+        increasing its version
+
+        :param str table_path: Absolute path of a table dir
+        :param int rowids: How many rowids were allocated
+        :param int count: How much the row count changed
+        :param TableMeta meta: The metadata before the change
+            (read from the table dir if not given)
+        :param int lsn: The write-ahead log mutation which was applied
+        :return: the metadata after the change
+        :rtype: TableMeta
+        """
+        meta = meta or self._get_meta(table_path)
+        new_meta = TableMeta(next_rowid=meta.next_rowid + rowids,
+                             count=meta.count + count,
+                             version=meta.version + 1,
+                             lsn=meta.lsn if lsn is None else lsn)
+        self._put_meta(table_path, new_meta)
+        return new_meta
+
+    def get_table_meta(self, table_name):
+        """ Gets the metadata (next rowid, row count and version)
+        of a table identified by name
+
+        :param str table_name: Name of the table
+        :rtype: TableMeta
+        """
+        assert table_name
+
+        self._wal_drain()
+        table_path = os.path.join(self.db_path, table_name)
+        return self._get_meta(table_path)
+
     def get_table_schema(self, table_name):
         """ Gets schema for a table identified by name
         
@@ -135,10 +609,276 @@ class DbManager(object):
         :return: row directory absolute path
         :rtype: Iterator[str]
         """
-        for row_dirname in os.listdir(table_path):
-            row_dir = os.path.join(table_path, row_dirname)
-            if os.path.isdir(row_dir):
-                yield row_dir
+        yield from DirStorage.row_dirs(table_path)
+
+    def _table_storage(self, table_path):
+        """ Returns the storage object managing the rows of a table dir
+
+        The storage name is read from the '.storage' file of the table
+        (tables without one use the 'dirs' storage); storage objects are
+        kept for the lifetime of the manager since some of them cache
+        in-memory state about the table
+
+        :param str table_path: Absolute path of a table dir
+        :rtype: TableStorage
+        """
+        storage = self._storages.get(table_path)
+        if storage is None:
+            storage_name = DEFAULT_STORAGE
+            storage_path = os.path.join(table_path, STORAGE)
+            if os.path.isfile(storage_path):
+                with open(storage_path) as fd:
+                    storage_name = fd.read().strip()
+            storage = STORAGES[storage_name](table_path)
+            self._storages[table_path] = storage
+        return storage
+
+    def _table_lock(self, table_path):
+        """ Returns the lock of a table dir
+
+        :param str table_path: Absolute path of a table dir
+        :rtype: TableLock
+        """
+        return self._table_locks.setdefault(table_path, TableLock())
+
+    def get_table_storage(self, table_name):
+        """ Gets the storage name of a table identified by name
+
+        :param str table_name: Name of the table
+        :return: storage name (e.g. 'dirs' or 'packed')
+        :rtype: str
+        """
+        assert table_name
+
+        table_path = os.path.join(self.db_path, table_name)
+        return self._table_storage(table_path).name
+
+    def _get_indexes(self, table_path):
+        """ Reads the definitions of the indexes of a table dir
+        from its '.indexes' file (lines of `name,column,kind`)
+
+        :param str table_path: Absolute path of a table dir
+        :return: index name -> definition
+        :rtype: dict[str,IndexInfo]
+        """
+        indexes_path = os.path.join(table_path, INDEXES)
+        if not os.path.isfile(indexes_path):
+            return {}
+
+        indexes = {}
+        with open(indexes_path) as fd:
+            for line in fd.read().split('\n'):
+                if line != '':
+                    name, column, kind = line.split(',')
+                    indexes[name] = IndexInfo(column=column, kind=kind)
+        return indexes
+
+    def _put_indexes(self, table_path, indexes):
+        """ Atomically writes the definitions of the indexes of a table dir
+
+        :param str table_path: Absolute path of a table dir
+        :param dict[str,IndexInfo] indexes: index name -> definition
+        """
+        indexes_path = os.path.join(table_path, INDEXES)
+        tmp_indexes_path = f'{indexes_path}.tmp'
+        with open(tmp_indexes_path, 'w') as fd:
+            for name, info in indexes.items():
+                fd.write(f'{name},{info.column},{info.kind}\n')
+        os.replace(tmp_indexes_path, indexes_path)
+
+    def _table_indexes(self, table_path, indexes=None):
+        """ Returns the index objects of a table dir
+
+        The objects are kept (with their in-memory index) while the
+        '.indexes' file is unchanged
+
+        :param str table_path: Absolute path of a table dir
+        :param dict[str,IndexInfo] indexes: The definitions to build
+            the objects from (read from the table dir if not given)
+        :return: index name -> index
+        :rtype: dict[str,TableIndex]
+        """
+        try:
+            file_stat = os.stat(os.path.join(table_path, INDEXES))
+        except FileNotFoundError:
+            return {}
+        file_key = SchemaCache._file_key(file_stat)
+
+        cached = self._indexes.get(table_path)
+        if cached is not None and cached[0] == file_key:
+            return cached[1]
+
+        schema = self._get_schema(os.path.join(table_path, SCHEMA))
+        indexes = self._get_indexes(table_path)
+        objects = {name: INDEX_KINDS[info.kind](os.path.join(table_path, INDEX_PREFIX + name),
+                                                info.column, schema[info.column])
+                   for name, info in indexes.items()}
+        self._indexes[table_path] = (file_key, objects)
+        return objects
+
+    def _index_put(self, table_path, records):
+        """ Sets the keys of inserted or updated rows in the indexes
+        of a table dir (an index is left as is for the rows whose
+        indexed column did not change)
+
+        :param str table_path: Absolute path of a table dir
+        :param list[dict[str,str]] records: The new cells of the rows
+            (with the '_rowid' key)
+        """
+        for index in self._table_indexes(table_path).values():
+            changed = [record for record in records if index.col_name in record]
+            if changed:
+                index.put(changed)
+
+    def _index_delete(self, table_path, rowids):
+        """ Removes deleted rows from the indexes of a table dir
+
+        :param str table_path: Absolute path of a table dir
+        :param list[int] rowids: Unique identifiers of the rows
+        """
+        for index in self._table_indexes(table_path).values():
+            index.delete(rowids)
+
+    def get_table_indexes(self, table_name):
+        """ Gets the indexes of a table identified by name
+
+        :param str table_name: Name of the table
+        :return: index name -> definition (column and kind)
+        :rtype: dict[str,IndexInfo]
+        """
+        assert table_name
+
+        table_path = os.path.join(self.db_path, table_name)
+        return self._get_indexes(table_path)
+
+    def create_index(self, table, name, col_name, kind='hash'):
+        """ Creates an index on a column of a table
+
+        The index is built from the table's rows (which are not changed
+        meanwhile) and then maintained by every insert, update and delete
+
+        :param str table: Name of the table
+        :param str name: Name of the index (unique in the table)
+        :param str col_name: Name of the indexed column
+        :param str kind: Kind of the index ('hash', 'btree' or 'bitmap')
+        :raises ValueError: if the table already has an index named so
+        """
+        assert table
+        assert name
+        assert kind in INDEX_KINDS
+
+        self._wal_barrier()
+        table_path = os.path.join(self.db_path, table)
+        schema = self._get_schema(os.path.join(table_path, SCHEMA))
+        assert col_name in schema
+        assert schema[col_name] in INDEX_KINDS[kind].col_types
+
+        with self._table_lock(table_path).exclusive(self.LOCK_TIMEOUT):
+            indexes = self._get_indexes(table_path)
+            if name in indexes:
+                raise ValueError(f'Index {name} already exists on {table}')
+
+            index = INDEX_KINDS[kind](os.path.join(table_path, INDEX_PREFIX + name),
+                                      col_name, schema[col_name])
+            index.build(self._table_storage(table_path).scan(schema, columns=[col_name]))
+            indexes[name] = IndexInfo(column=col_name, kind=kind)
+            self._put_indexes(table_path, indexes)
+
+    def drop_index(self, table, name):
+        """ Deletes an index of a table
+
+        :param str table: Name of the table
+        :param str name: Name of the index
+        :raises ValueError: if the table has no index named so
+        """
+        assert table
+        assert name
+
+        table_path = os.path.join(self.db_path, table)
+        with self._table_lock(table_path).shared():
+            index = self._table_indexes(table_path).get(name)
+            if index is None:
+                raise ValueError(f'Index {name} does not exist on {table}')
+
+            indexes = self._get_indexes(table_path)
+            del indexes[name]
+            self._put_indexes(table_path, indexes)
+            index.drop()
+
+    def index_lookup(self, table, col_name, conditions):
+        """ Finds with an index the rows whose column compares to values
+
+        The conditions are ANDed, so an ordered index intersects their
+        ranges before collecting any rowid
+
+        :param str table: Name of the table
+        :param str col_name: Name of the column
+        :param list[tuple[str,object]] conditions: The comparison operators
+            (e.g. '=', '<') and the (decoded) values compared to
+        :return: the rowids of the matching rows or None if no index
+            of the column supports all the comparisons
+        :rtype: set[int]|None
+        """
+        assert table
+        assert conditions
+
+        self._wal_drain()
+        table_path = os.path.join(self.db_path, table)
+        with self._table_lock(table_path).shared():
+            for index in self._table_indexes(table_path).values():
+                if (index.col_name == col_name
+                        and all(op in index.ops for op, _ in conditions)):
+                    return index.lookup_many(conditions)
+        return None
+
+    def index_bitmap(self, table, col_name, op, value):
+        """ Finds with a bitmap index the rows whose column compares
+        (by op) to a value
+
+        :param str table: Name of the table
+        :param str col_name: Name of the column
+        :param str op: The comparison operator (e.g. '=')
+        :param value: The (decoded) value compared to
+        :return: the bitmap of the matching rows (bit `rowid` is set for
+            every one) or None if no bitmap index of the column supports
+            the comparison
+        :rtype: int|None
+        """
+        assert table
+
+        self._wal_drain()
+        table_path = os.path.join(self.db_path, table)
+        with self._table_lock(table_path).shared():
+            for index in self._table_indexes(table_path).values():
+                if index.col_name == col_name and index.bitwise and op in index.ops:
+                    return index.bitmap(op, value)
+        return None
+
+    def index_order(self, table, col_name, reverse=False):
+        """ Lists with an ordered index the rowids of a table sorted
+        by a column
+
+        Empty cells are not indexed, so the index is not used if some
+        rows have one (the rows are then sorted like without an index)
+
+        :param str table: Name of the table
+        :param str col_name: Name of the column
+        :param bool reverse: Whether to sort in descending order
+        :return: the sorted rowids of all the rows or None if no index
+            of the column is ordered or some rows are not indexed
+        :rtype: list[int]|None
+        """
+        assert table
+
+        self._wal_drain()
+        table_path = os.path.join(self.db_path, table)
+        with self._table_lock(table_path).shared():
+            for index in self._table_indexes(table_path).values():
+                if index.col_name == col_name and index.ordered:
+                    rowids = list(index.iter_rowids(reverse=reverse))
+                    if len(rowids) == self._get_meta(table_path).count:
+                        return rowids
+        return None
 
     def create_db(self, name):
         """ Creates a database dir identified by name
@@ -153,7 +893,8 @@ class DbManager(object):
         """ Sets a database identified by name as 'current'
 
         :param str name: Name of the database
-        :raises ValueError: if the database dir does not exist
+        :raises ValueError: if the database dir does not exist, or if its
+            write-ahead log is used by another manager (with `wal`)
         """
         assert name
 
@@ -161,8 +902,165 @@ class DbManager(object):
         if not os.path.exists(path) or not os.path.isdir(path):
             raise ValueError(f'SDB {name}/ does not exist or is not a dir!')
 
+        self._close_wal()
+        self._recover_compactions(path)
         self._db_name = name
         self._db_path = path
+        if self.wal:
+            try:
+                self._open_wal()
+            except WalLockedError:
+                self._db_name = self._db_path = None
+                raise
+        elif self.wal_recovery and self._has_wal_records(path):
+            # mutations logged while the database was used with the log
+            # are applied before the tables are changed directly,
+            # unless the log is still used by its owner
+            try:
+                self._open_wal()
+            except WalLockedError:
+                return
+            self._close_wal()
+
+    @staticmethod
+    def _has_wal_records(db_path):
+        """ Checks whether the write-ahead log of a database dir
+        holds mutations (e.g. left by a crash)
+
+        :param str db_path: Absolute path of a database dir
+        :rtype: bool
+        """
+        wal_path = os.path.join(db_path, WAL)
+        return os.path.isfile(wal_path) and os.path.getsize(wal_path) > WriteAheadLog.header.size
+
+    def _recover_compactions(self, db_path):
+        """ Finishes or rolls back the table swaps of compactions
+        interrupted (e.g. by a crash) in a database dir
+
+        :param str db_path: Absolute path of a database dir
+        """
+        for dirname in os.listdir(db_path):
+            path = os.path.join(db_path, dirname)
+            if dirname.startswith('.') and dirname.endswith(COMPACT_EXT):
+                shutil.rmtree(path)
+            elif dirname.startswith('.') and dirname.endswith(OLD_EXT):
+                table_path = os.path.join(db_path, dirname[1:-len(OLD_EXT)])
+                if os.path.isdir(table_path):
+                    shutil.rmtree(path)
+                else:
+                    os.rename(path, table_path)
+
+    def _open_wal(self):
+        """ Opens the write-ahead log of the current database, applying
+        the mutations left in it (e.g. by a crash) """
+        db_path = self.db_path
+        table_paths = [os.path.join(db_path, table)
+                       for table in self.get_tables(self._db_name)]
+        last_lsn = max([self._get_meta(table_path).lsn for table_path in table_paths],
+                       default=0)
+
+        self._wal = WriteAheadLog(
+            db_path, apply=lambda record: self._apply_wal_record(db_path, record),
+            checkpoint=self._checkpoint_wal, first_lsn=last_lsn + 1,
+            commit_delay=self.wal_commit_delay)
+
+    def _close_wal(self):
+        """ Applies the logged mutations and closes the write-ahead
+        log of the current database (if it is open) """
+        if self._wal is not None:
+            wal, self._wal = self._wal, None
+            self._next_rowids.clear()
+            wal.close()
+
+    def _apply_wal_record(self, db_path, record):
+        """ Applies a mutation of the write-ahead log to its table
+
+        Mutations already applied (according to the table's metadata)
+        are skipped, and the row is looked up first so a mutation which
+        reached the storage but not the metadata before a crash is not
+        applied twice
+
+        :param str db_path: Absolute path of the database dir
+        :param WalRecord record: The logged mutation
+        """
+        table_path = os.path.join(db_path, record.table)
+        self._wal_tables.add(table_path)
+        with self._table_lock(table_path).shared():
+            self._apply_wal_change(table_path, record)
+
+    def _checkpoint_wal(self):
+        """ Flushes to disk the rows and metadata of the tables changed
+        by the mutations applied from the write-ahead log (before the
+        log is emptied) """
+        table_paths, self._wal_tables = self._wal_tables, set()
+        for table_path in sorted(table_paths):
+            # a table deleted since is skipped (and a compacted one
+            # was synced by the compaction)
+            if not os.path.isdir(table_path):
+                continue
+            try:
+                self._table_storage(table_path).sync()
+                fsync_path(os.path.join(table_path, META))
+                fsync_path(table_path)
+            except FileNotFoundError:
+                continue
+
+    def _apply_wal_change(self, table_path, record):
+        schema = self._get_schema(os.path.join(table_path, SCHEMA))
+        storage = self._table_storage(table_path)
+        meta = self._get_meta(table_path)
+        if record.lsn <= meta.lsn:
+            return
+
+        exists = storage.exists(schema, record.rowid)
+        rowids, count = 0, 0
+        if record.op == 'insert':
+            if exists:
+                storage.update(schema, record.rowid, record.row)
+            else:
+                storage.insert(schema, record.rowid, record.row)
+            self._index_put(table_path, [dict(record.row, _rowid=record.rowid)])
+            rowids, count = max(record.rowid + 1 - meta.next_rowid, 0), 1
+        elif record.op == 'update' and exists:
+            storage.update(schema, record.rowid, record.row)
+            self._index_put(table_path, [dict(record.row, _rowid=record.rowid)])
+        elif record.op == 'delete' and exists:
+            storage.delete(record.rowid)
+            self._index_delete(table_path, [record.rowid])
+            count = -1
+        self._change_meta(table_path, rowids=rowids, count=count, meta=meta,
+                          lsn=record.lsn)
+
+    def _wal_drain(self):
+        """ Waits for the logged mutations to be applied to the tables
+        (before reading them) """
+        if self._wal is not None:
+            self._wal.drain()
+
+    def _wal_barrier(self):
+        """ Waits for the logged mutations to be applied before a change
+        made directly to the tables (e.g. of a schema), forgetting the
+        rowids reserved for logged inserts """
+        if self._wal is not None:
+            self._wal.drain()
+            self._next_rowids.clear()
+
+    def wal_info(self):
+        """ Returns the statistics of the write-ahead log of the
+        current database
+
+        :return: the statistics (None if the log is not used)
+        :rtype: WalInfo
+        """
+        return self._wal.info() if self._wal is not None else None
+
+    def close(self):
+        """ Applies the logged mutations and closes the write-ahead
+        log and the pool of processes """
+        self._close_wal()
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
 
     def delete_db(self, name):
         """ Deletes a database dir identified by name (and all its contents)
@@ -171,23 +1069,44 @@ class DbManager(object):
         """
         assert name
         path = os.path.join(self.root_path, name)
+        if path == self._db_path:
+            self._close_wal()
         shutil.rmtree(path)
-
-    def create_table(self, name, schema={}):
+        self._schema_cache.invalidate(path)
+        if self._result_cache is not None:
+            self._result_cache.invalidate(path)
+        for table_path in list(self._storages):
+            if os.path.dirname(table_path) == path:
+                del self._storages[table_path]
+
+    def create_table(self, name, schema={}, storage=None):
         """ Creates a table dir identified by name and its related .schema file
 
         :param str name: Name of the table
         :param dict[str, str] schema: Key-value schema `[column_name, column_type]`
+        :param str storage: Name of the storage used for the rows
+            (defaults to 'dirs')
         """
         assert name
         assert schema 
+        storage = storage or DEFAULT_STORAGE
+        assert storage in STORAGES
 
+        self._wal_barrier()
         table_path = os.path.join(self.db_path, name)
         os.mkdir(table_path)
+        self._storages.pop(table_path, None)
+        self._schema_cache.invalidate(table_path)
 
         schema_path = os.path.join(table_path, SCHEMA)
         self._put_schema(schema_path, schema)
 
+        storage_path = os.path.join(table_path, STORAGE)
+        with open(storage_path, 'w') as fd:
+            fd.write(storage)
+        self._table_storage(table_path).create(schema)
+        self._put_meta(table_path, TableMeta(next_rowid=0, count=0, version=time.time_ns()))
+
         assert os.path.isdir(table_path)
         assert os.path.isfile(schema_path)
 
@@ -197,8 +1116,15 @@ class DbManager(object):
         :param str name: Name of the table
         """
         assert name
+        self._wal_barrier()
         table_path = os.path.join(self.db_path, name)
-        shutil.rmtree(table_path)
+        with self._table_lock(table_path).exclusive(self.LOCK_TIMEOUT):
+            shutil.rmtree(table_path)
+            self._storages.pop(table_path, None)
+            self._indexes.pop(table_path, None)
+            self._schema_cache.invalidate(table_path)
+            if self._result_cache is not None:
+                self._result_cache.invalidate(table_path)
         assert not os.path.exists(table_path)
 
     def add_column(self, name, col_name, col_type):
@@ -206,7 +1132,8 @@ class DbManager(object):
 
         This function modifies the schema adding the new column and its type
         It also creates empty files named `<col_name>.<col_type>`
-        for each row dirs of the table
+        for each row dirs of the table (or the equivalent empty cells
+        for other storages)
 
         :param str name: Name of the table
         :param str col_name: Name of the column to be added
@@ -216,19 +1143,18 @@ class DbManager(object):
         assert col_name
         assert col_type
 
+        self._wal_barrier()
         table_path = os.path.join(self.db_path, name)
         schema_path = os.path.join(table_path, SCHEMA)
 
-        schema = self._get_schema(schema_path)
-        schema[col_name] = col_type
-        self._put_schema(schema_path, schema)
-
-        col_filename = f'{col_name}.{col_type}'
-        for row_dir in self._row_dirs(table_path):
-            col_file = os.path.join(row_dir, col_filename)
-            open(col_file, 'w').close()
-            assert os.path.exists(col_file)
+        with self._table_lock(table_path).shared():
+            schema = self._get_schema(schema_path)
+            self._table_storage(table_path).add_column(schema, col_name, col_type)
 
+            schema[col_name] = col_type
+            self._put_schema(schema_path, schema)
+            self._schema_cache.invalidate(schema_path)
+            self._change_meta(table_path)
 
     def del_column(self, name, col_name):
         """ Deletes a columns from the table identified by name
@@ -243,58 +1169,244 @@ class DbManager(object):
         assert name
         assert col_name
 
+        self._wal_barrier()
         table_path = os.path.join(self.db_path, name)
         schema_path = os.path.join(table_path, SCHEMA)
-        schema = self._get_schema(schema_path)
+        with self._table_lock(table_path).shared():
+            schema = self._get_schema(schema_path)
+            self._table_storage(table_path).del_column(schema, col_name)
+
+            # the indexes of the column are dropped with it
+            indexes = self._get_indexes(table_path)
+            dropped = {name: index for name, index in self._table_indexes(table_path).items()
+                       if index.col_name == col_name}
+            if dropped:
+                self._put_indexes(table_path, {name: info for name, info in indexes.items()
+                                               if name not in dropped})
+                for index in dropped.values():
+                    index.drop()
+
+            del schema[col_name]
+            self._put_schema(schema_path, schema)
+            self._schema_cache.invalidate(schema_path)
+            self._change_meta(table_path)
+        assert os.path.isfile(schema_path)
 
-        col_type = schema[col_name]
-        col_filename = f'{col_name}.{col_type}'
-        for row_dir in self._row_dirs(table_path):
-            col_file = os.path.join(row_dir, col_filename)
-            os.remove(col_file)
-            assert not os.path.exists(col_file)
+    @staticmethod
+    def _disk_usage(path):
+        """ Returns the disk space (in bytes) and the number of inodes
+        used by a dir and its contents
 
-        del schema[col_name]
-        self._put_schema(schema_path, schema)
-        assert os.path.isfile(schema_path)
+        :param str path: Path of the dir
+        :rtype: tuple[int,int]
+        """
+        usage, inodes = os.lstat(path).st_blocks * 512, 1
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in dirnames + filenames:
+                usage += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+                inodes += 1
+        return usage, inodes
+
+    def _write_compacted(self, table_path, compact_path, storage, renumber):
+        """ Writes the live rows of a table dir into a new table dir
+
+        :param str table_path: Absolute path of the table dir
+        :param str compact_path: Absolute path of the new table dir
+        :param str storage: Name of the storage of the new table dir
+        :param bool renumber: Whether the rows get new consecutive rowids
+        :return: number of rows and old rowid -> new rowid
+            (None if not renumbered)
+        :rtype: tuple[int,dict[int,int]]
+        """
+        if os.path.exists(compact_path):
+            shutil.rmtree(compact_path)
+        os.mkdir(compact_path)
+
+        schema = self._get_schema(os.path.join(table_path, SCHEMA))
+        meta = self._get_meta(table_path)
+        self._put_schema(os.path.join(compact_path, SCHEMA), schema)
+        with open(os.path.join(compact_path, STORAGE), 'w') as fd:
+            fd.write(storage)
+
+        records = sorted(self._table_storage(table_path).scan(schema),
+                         key=lambda record: record['_rowid'])
+        rowids = None
+        if renumber:
+            rowids = {record['_rowid']: rowid for rowid, record in enumerate(records)}
+            for record in records:
+                record['_rowid'] = rowids[record['_rowid']]
+
+        new_storage = STORAGES[storage](compact_path)
+        new_storage.create(schema)
+        new_storage.load(schema, records)
+        new_storage.sync()
+
+        # the indexes are rebuilt since rows may have been renumbered
+        indexes = self._get_indexes(table_path)
+        for name, info in indexes.items():
+            index = INDEX_KINDS[info.kind](os.path.join(compact_path, INDEX_PREFIX + name),
+                                           info.column, schema[info.column])
+            index.build(records)
+        if indexes:
+            self._put_indexes(compact_path, indexes)
+        self._put_meta(compact_path, TableMeta(
+            next_rowid=len(records) if renumber else meta.next_rowid,
+            count=len(records), version=meta.version + 1, lsn=meta.lsn))
+        return len(records), rowids
+
+    def compact_table(self, name, storage=None, renumber=False):
+        """ Rewrites a table into a compact layout (vacuum)
+
+        The live rows are written into a new hidden table dir (in rowid
+        order, e.g. as consecutive row dirs or segments without the dead
+        records) which then atomically replaces the table dir.
+        The table can be read and changed meanwhile: the dir is swapped
+        once the running scans are done and, if the table changed during
+        the rewrite, it is rewritten again before the swap (blocking
+        the other readers and writers). The swap waits `LOCK_TIMEOUT`
+        seconds at most for the scans, and fails at once for the scans
+        opened (and not consumed) by the calling thread
+
+        :param str name: Name of the table
+        :param str storage: Name of the storage of the compacted table
+            (defaults to the current one)
+        :param bool renumber: Whether the rows get new consecutive rowids
+            (from 0, so the rowids read before are not valid anymore)
+        :return: the rows, disk space and inodes before and after
+        :rtype: CompactResult
+        :raises ValueError: if the table is still being read
+        """
+        assert name
+
+        self._wal_barrier()
+        table_path = os.path.join(self.db_path, name)
+        compact_path = os.path.join(self.db_path, f'.{name}{COMPACT_EXT}')
+        old_path = os.path.join(self.db_path, f'.{name}{OLD_EXT}')
+        lock = self._table_lock(table_path)
+        storage = storage or self._table_storage(table_path).name
+        assert storage in STORAGES
+
+        while True:
+            with lock.shared():
+                version = self._get_meta(table_path).version
+                bytes_before, inodes_before = self._disk_usage(table_path)
+                count, rowids = self._write_compacted(table_path, compact_path,
+                                                      storage, renumber)
+
+            self._wal_drain()
+            try:
+                with lock.exclusive(self.LOCK_TIMEOUT):
+                    if self._wal is not None and not self._wal.is_applied():
+                        # changes were logged meanwhile; apply them first
+                        continue
+                    if self._get_meta(table_path).version != version:
+                        bytes_before, inodes_before = self._disk_usage(table_path)
+                        count, rowids = self._write_compacted(table_path, compact_path,
+                                                              storage, renumber)
+
+                    os.rename(table_path, old_path)
+                    os.rename(compact_path, table_path)
+                    shutil.rmtree(old_path)
+                    self._storages.pop(table_path, None)
+                    self._indexes.pop(table_path, None)
+                    self._schema_cache.invalidate(table_path)
+                    self._next_rowids.pop(table_path, None)
+                    break
+            except ValueError:
+                shutil.rmtree(compact_path, ignore_errors=True)
+                raise
+
+        bytes_after, inodes_after = self._disk_usage(table_path)
+        return CompactResult(rows=count, storage=storage,
+                             bytes_before=bytes_before, bytes_after=bytes_after,
+                             inodes_before=inodes_before, inodes_after=inodes_after,
+                             rowids=rowids)
 
     def insert_row(self, table, row={}):
         """ Inserts a row into the table identified by name
 
-        This function autoincrements the rowid or defaults to 0
-        when inserting a new row;
+        This function takes the next rowid from the table's metadata
+        (starting from 0) when inserting a new row;
         Upon inserting a new row, each column file named `<col_name>.<col_type>`
         is created and the data from the row dict is added for each column
 
+        With the write-ahead log, the row is logged (and durable) when this
+        returns and it is inserted into the table in the background
+
         :param str table: Name of the table
         :param dict[str,str] row: Row to be inserted
+        :return: rowid of the inserted row
+        :rtype: int
         """
         assert table
         assert row
 
         row = row.copy()
         table_path = os.path.join(self.db_path, table)
+        if self._wal is not None:
+            with self._wal_lock:
+                rowid = self._next_rowids.get(table_path)
+                if rowid is None:
+                    self._wal.drain()
+                    rowid = self._get_meta(table_path).next_rowid
+                self._next_rowids[table_path] = rowid + 1
+                # rowids are logged in increasing order
+                lsn = self._wal.append('insert', table, rowid, row)
+            self._wal.wait(lsn)
+            return rowid
+
         schema_path = os.path.join(table_path, SCHEMA)
         schema = self._get_schema(schema_path)
-        
-        row_dirs = list(self._row_dirs(table_path)) 
-        try:
-            new_rowid = max([int(os.path.basename(row_dir))
-                             for row_dir in row_dirs]) + 1
-        except Exception:
-            new_rowid = 0
-        new_row_dir = os.path.join(table_path, str(new_rowid))
-        os.mkdir(new_row_dir)
-
-        for col_name, col_type in schema.items():
-            col_filename = f'{col_name}.{col_type}'
-            col_file = os.path.join(new_row_dir, col_filename)
-            with open(col_file, 'w') as fd:
-                fd.write(row[col_name])
-
-        assert os.path.isdir(new_row_dir)
-
-    def scan_rows(self, table):
+
+        with self._table_lock(table_path).shared():
+            meta = self._get_meta(table_path)
+            self._table_storage(table_path).insert(schema, meta.next_rowid, row)
+            self._index_put(table_path, [dict(row, _rowid=meta.next_rowid)])
+            self._change_meta(table_path, rowids=1, count=1, meta=meta)
+        return meta.next_rowid
+
+    def insert_rows(self, table, rows=()):
+        """ Inserts many rows into the table identified by name
+
+        The rows get a contiguous range of rowids and are written in batches
+        of `INSERT_BATCH_SIZE` rows (with as few syscalls as the table's
+        storage allows); the inserted rows are flushed to disk once,
+        after the last batch (they are not written to the write-ahead log)
+
+        :param str table: Name of the table
+        :param Iterable[dict[str,str]] rows: Rows to be inserted
+        :return: rowids of the inserted rows
+        :rtype: range
+        """
+        assert table
+
+        self._wal_barrier()
+        table_path = os.path.join(self.db_path, table)
+        schema_path = os.path.join(table_path, SCHEMA)
+        schema = self._get_schema(schema_path)
+
+        with self._table_lock(table_path).shared():
+            storage = self._table_storage(table_path)
+            meta = self._get_meta(table_path)
+            first_rowid = meta.next_rowid
+            rows = iter(rows)
+            while True:
+                batch = list(itertools.islice(rows, self.INSERT_BATCH_SIZE))
+                if not batch:
+                    break
+                storage.insert_many(schema, meta.next_rowid, batch)
+                if self._table_indexes(table_path):
+                    self._index_put(table_path, [dict(row, _rowid=rowid) for rowid, row
+                                                 in enumerate(batch, meta.next_rowid)])
+                meta = self._change_meta(table_path, rowids=len(batch),
+                                         count=len(batch), meta=meta)
+
+            storage.sync()
+        return range(first_rowid, meta.next_rowid)
+
+    def scan_rows(self, table, columns=None, lazy=False, rowid_range=None,
+                  workers=None, ordered=None, readahead=None, rowids=None, typed=False,
+                  predicate=None, predicate_columns=None):
         """ Iterates over all the records of a table
 
         This function also adds '_rowid' to the record which is
@@ -302,27 +1414,118 @@ class DbManager(object):
         Example of a yielded record:
         ``{'_rowid': 1, 'name': 'a', age: 1}``
 
+        If columns are given only those cells are read (for the
+        'columns' storage only the files of those columns are opened)
+
+        In lazy mode the 'packed' and 'columns' storages memory-map their
+        files and yield read-only :class:`LazyRecord` mappings whose `str`
+        cells are only decoded when they are accessed
+
+        In typed mode the cells are decoded by the schema into `int`,
+        `bool` and `str` values (see :mod:`sdbms.core._codec`), lazily
+        for lazy records
+
+        With a predicate only the matching records are yielded: the
+        predicate columns of a row are read first and, for the storages
+        reading the cells of a row separately ('dirs' and 'columns'),
+        the other columns only if the row matches. The predicate gets
+        the records as they are yielded (e.g. typed)
+
         :param str table: Name of the table
+        :param list[str] columns: Names of the columns to be read
+            (defaults to all the columns)
+        :param bool lazy: Whether to yield lazily decoded records
+        :param range rowid_range: Only the rows whose rowid is in this
+            range are read (defaults to all of them)
+        :param int workers: Number of threads reading the row dirs of a
+            'dirs' table in parallel (defaults to `scan_workers`)
+        :param bool ordered: Whether a parallel scan keeps the order of a
+            serial scan (defaults to `scan_ordered`)
+        :param int readahead: Maximum number of rows read ahead by a
+            parallel scan (defaults to `scan_readahead`)
+        :param Iterable[int] rowids: Only the rows with these rowids
+            (e.g. found with an index) are read, one by one
+        :param bool typed: Whether to decode the cells into values
+        :param predicate: Function matching the records to be yielded
+        :param list[str] predicate_columns: Names of the columns read by
+            the predicate (defaults to all the columns)
         :return: record of a table
         :rtype: Iterator[dict[str, str]]
         """
         assert table
 
+        self._wal_drain()
         table_path = os.path.join(self.db_path, table)
         schema_path = os.path.join(table_path, SCHEMA)
         current_schema = self._get_schema(schema_path)
+        assert columns is None or not set(columns) - set(current_schema)
+
+        row_filter = None
+        if predicate is not None:
+            predicate_columns = list(current_schema if predicate_columns is None
+                                     else predicate_columns)
+            assert not set(predicate_columns) - set(current_schema)
+            match = predicate
+            if typed:
+                decoders = schema_decoders(current_schema)
+
+                def match(record):
+                    return predicate(TypedRecord(record, decoders))
+            row_filter = RowFilter(predicate_columns, match)
+
+        workers = self.scan_workers if workers is None else workers
+        with self._table_lock(table_path).shared():
+            storage = self._table_storage(table_path)
+            if rowids is not None:
+                records = storage.fetch(current_schema, rowids, columns, lazy, row_filter)
+            elif not workers:
+                records = storage.scan(current_schema, columns, lazy, rowid_range, row_filter)
+            else:
+                records = storage.scan_parallel(
+                    current_schema, columns, lazy, rowid_range, workers=workers,
+                    ordered=self.scan_ordered if ordered is None else ordered,
+                    readahead=self.scan_readahead if readahead is None else readahead,
+                    row_filter=row_filter)
 
-        for row_dir in self._row_dirs(table_path):
-            record = {}
-            for col_name, col_type in current_schema.items():
-                col_filename = f'{col_name}.{col_type}'
-                col_file = os.path.join(row_dir, col_filename)
-                with open(col_file) as fd:
-                    record[col_name] = fd.read()
-            record['_rowid'] = int(os.path.basename(row_dir))
+            if typed:
+                records = decode_records(current_schema, records, lazy)
+            yield from records
 
-            yield record
+    def get_scan_partitions(self, table):
+        """ Splits the rowids of a table into the ranges scanned by the
+        processes of a partitioned query
 
+        There are a few more partitions than processes so results start
+        streaming back before the slowest partition is done
+
+        :param str table: Name of the table
+        :return: consecutive rowid ranges covering the table (an empty
+            list if queries are not executed by several processes)
+        :rtype: list[range]
+        """
+        assert table
+
+        if self.query_processes <= 1:
+            return []
+
+        next_rowid = self.get_table_meta(table).next_rowid
+        count = self.query_processes * self.PARTITIONS_PER_PROCESS
+        size = max(-(-next_rowid // count), 1)
+        return [range(start, min(start + size, next_rowid))
+                for start in range(0, next_rowid, size)]
+
+    def get_process_pool(self):
+        """ Returns the pool of processes partitioned queries are
+        executed by (created on first use); each process keeps a manager
+        of the same root dir for all its partitions (see :func:`worker_manager`)
+
+        :rtype: concurrent.futures.ProcessPoolExecutor
+        """
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.query_processes,
+                                                     initializer=_init_worker_manager,
+                                                     initargs=(self.root_path,))
+        return self._process_pool
 
     def delete_row(self, table, rowid):
         """ Deletes a row - identified by its rowid - from a table
@@ -332,11 +1535,15 @@ class DbManager(object):
         """
         assert table
 
-        table_path = os.path.join(self.db_path, table)
-        row_dir = os.path.join(table_path, str(rowid))
+        if self._wal is not None:
+            self._wal.commit('delete', table, int(rowid))
+            return
 
-        shutil.rmtree(row_dir)
-        assert not os.path.exists(row_dir)
+        table_path = os.path.join(self.db_path, table)
+        with self._table_lock(table_path).shared():
+            self._table_storage(table_path).delete(int(rowid))
+            self._index_delete(table_path, [int(rowid)])
+            self._change_meta(table_path, count=-1)
 
     def update_row(self, table, rowid, new_row={}):
         """ Updates a row - identified by its row id - in a table
@@ -348,21 +1555,18 @@ class DbManager(object):
         assert table
         assert bool
 
+        if self._wal is not None:
+            self._wal.commit('update', table, int(rowid), new_row)
+            return
+
         table_path = os.path.join(self.db_path, table)
         schema_path = os.path.join(table_path, SCHEMA)
         schema = self._get_schema(schema_path)
 
-        row_dir = os.path.join(table_path, str(rowid))
-
-        for col_name, col_value in new_row.items():
-            col_type = schema[col_name]
-            col_filename = f'{col_name}.{col_type}'
-            col_file = os.path.join(row_dir, col_filename)
-
-            with open(col_file, 'w') as fd:
-                fd.write(col_value)
-
-        assert os.path.isfile(col_file)
+        with self._table_lock(table_path).shared():
+            self._table_storage(table_path).update(schema, int(rowid), new_row)
+            self._index_put(table_path, [dict(new_row, _rowid=int(rowid))])
+            self._change_meta(table_path)
 
     def get_tables(self, db_name):
         """ Returns tables from a database
@@ -371,7 +1575,25 @@ class DbManager(object):
         """
         assert db_name
         db_path = os.path.join(self.root_path, db_name)
-        yield from os.listdir(db_path)
+        for table in os.listdir(db_path):
+            # hidden dirs are tables being compacted
+            if not table.startswith('.') and os.path.isdir(os.path.join(db_path, table)):
+                yield table
+
+    def get_table_counts(self, db_name):
+        """ Returns tables from a database with their number of rows,
+        kept in their metadata (no row is read)
+
+        :param str db_name: Name of the database
+        :return: the name and the number of rows of every table
+        :rtype: Iterator[tuple[str,int]]
+        """
+        assert db_name
+        if db_name == self._db_name:
+            self._wal_drain()
+        db_path = os.path.join(self.root_path, db_name)
+        for table in self.get_tables(db_name):
+            yield table, self._get_meta(os.path.join(db_path, table)).count
     
     def to_csv(self, csv_path):
         """ Export database in csv format
@@ -379,23 +1601,18 @@ class DbManager(object):
         """
         fd = open(csv_path,'w+')
 
-        for table_dir in os.listdir(self._db_path):
-        	current_table_path = os.path.join(self._db_path,table_dir)
+        for table_dir in self.get_tables(self._db_name):
         	current_schema = self.get_table_schema(table_dir)
 
         	fd.write(table_dir)                  # show schema
         	for col_name,col_type in current_schema.items():
         		fd.write(f',{col_name}:{col_type}')
 
-        	for row_dir in os.listdir(current_table_path):
-        		path_to_dir = os.path.join(current_table_path,row_dir)
-        		if os.path.isdir(path_to_dir):
-        			for column in os.listdir(path_to_dir):
-        				name_column = column.split('.')[0]
-        				fd.write(f'\n{table_dir},{row_dir},{name_column}')
-        				with open(os.path.join(path_to_dir,column),'r') as fr:
-        					value = fr.read()
-        					fd.write(f',{value}')
+        	for record in self.scan_rows(table_dir):
+        		row_dir = record.pop('_rowid')
+        		for name_column, value in record.items():
+        			fd.write(f'\n{table_dir},{row_dir},{name_column}')
+        			fd.write(f',{value}')
         	fd.write("\n\n")
         fd.close()
 
@@ -413,6 +1630,7 @@ class DbManager(object):
 
         new_schema = True
         new_row = dict()
+        table_rows = []
         current_table = ""
         current_row = -1
 
@@ -420,7 +1638,9 @@ class DbManager(object):
         for line in fd:
             if line == "\n":
                 new_schema = True
-                self.insert_row(current_table,new_row)
+                table_rows.append(new_row)
+                self.insert_rows(current_table,table_rows)
+                table_rows = []
                 current_row = -1
                 new_row = dict()
             else:
@@ -438,8 +1658,49 @@ class DbManager(object):
                     elements = line.split(',')
                     if current_row != int(elements[1]):
                         if new_row:
-                            self.insert_row(current_table,new_row)
+                            table_rows.append(new_row)
                         new_row = dict()
                         current_row = int(elements[1])
                     new_row[elements[2]] = elements[3]
         fd.close()
+
+
+# the manager of a process of the pool executing partitioned queries
+# (see DbManager.get_process_pool) and the ids of the tables it read
+_worker_manager = None
+_worker_tables = {}
+
+
+def _init_worker_manager(root_path):
+    """ Creates the manager of a process of the pool executing
+    partitioned queries
+
+    :param str root_path: The root dir of the databases
+    """
+    global _worker_manager
+    # the write-ahead log is applied by the manager owning the pool
+    _worker_manager = DbManager(root_path, wal_recovery=False)
+
+
+def worker_manager(db_name, table):
+    """ Returns the manager of the current process of the pool, using
+    a database
+
+    The state kept about a table (e.g. by its storage) is dropped when
+    the table was replaced (e.g. compacted or deleted and created again)
+    since the previous partition the process executed
+
+    :param str db_name: Name of the database
+    :param str table: Name of the table read by the partition
+    :rtype: DbManager
+    """
+    if _worker_manager._db_name != db_name:
+        _worker_manager.use_db(db_name)
+    table_path = os.path.join(_worker_manager.db_path, table)
+    table_id = (os.stat(table_path).st_ino,
+                SchemaCache._file_key(os.stat(os.path.join(table_path, SCHEMA))))
+    if _worker_tables.get(table_path) != table_id:
+        _worker_manager._storages.pop(table_path, None)
+        _worker_manager._indexes.pop(table_path, None)
+        _worker_tables[table_path] = table_id
+    return _worker_manager
@@ -1,7 +1,15 @@
 import re
 import operator
 from collections import namedtuple
+from concurrent.futures import as_completed
 
+from ._manager import worker_manager
+from ._index import INDEX_KINDS, bitmap_rowids
+from ._planner import (Count, Delete, Gather, HashAggregate, Limit, MetaCount, Project, Scan,
+                       SeqScan, Sort, TopK, Update, comparison_selectivity, plan_join,
+                       plan_scan)
+from ._codec import BOOLS, decode_str
+from ._storage import STORAGES
 
 SCHEMA_TYPES = {'str', 'int', 'bool'}
 ROWID_KEY = '_rowid'
@@ -31,9 +39,19 @@ class Literal(namedtuple('Literal', 'value')):
         evaled_value = cls.eval_value(value)
         return super().__new__(cls, evaled_value)
 
+    def __reduce__(self):
+        # the value is already evaluated, so unpickling must not eval it again
+        return self._make, (tuple(self), )
+
 class Column(namedtuple('Column', 'name')):
     pass
 
+class Aggregate(namedtuple('Aggregate', 'func, col_name')):
+    @property
+    def name(self):
+        """ Name of the aggregate in the results (e.g. ``avg(age)``) """
+        return f'{self.func}({self.col_name})'
+
 class Comparison(namedtuple('Comparison', 'left, op, right')):
     ops = {
         '=': operator.eq,
@@ -45,7 +63,9 @@ class Comparison(namedtuple('Comparison', 'left, op, right')):
     }
 
     def match(self, row):
-        if type(self.left) is Column:
+        if type(self.left) is Column and self.left.name == ROWID_KEY:
+            left = row[ROWID_KEY]
+        elif type(self.left) is Column:
             left = Literal(row[self.left.name]).value
         elif type(self.left) is Literal:
             left = self.left.value
@@ -61,6 +81,9 @@ class Comparison(namedtuple('Comparison', 'left, op, right')):
 
         return self.ops[self.op](left, right)
 
+# relative costs of decoding a cell of a column type for a comparison
+DECODE_COSTS = {'bool': 1, 'int': 2, 'str': 3}
+
 class ConditionList(namedtuple('ConditionList', 'comp_type, comparisons')):
     types = {'or': any, 'and': all}
     
@@ -70,6 +93,71 @@ class ConditionList(namedtuple('ConditionList', 'comp_type, comparisons')):
         return self.types[self.comp_type](comp.match(row) 
                                           for comp in self.comparisons)
 
+    def compile(self, schema, typed=False):
+        """ Compiles the conditions into a predicate function equivalent
+        to :meth:`match`
+
+        The generated function decodes the cells as typed by the schema
+        (the literals are already decoded) and evaluates the comparisons
+        with short-circuiting `and`/`or`, cheapest and most decisive ones
+        first: by decoding cost over the chance of ending the evaluation.
+        A cell which cannot be decoded (e.g. an empty one) falls back
+        to :meth:`match`, so the errors are the same
+
+        :param dict[str,str] schema: The schema of the table
+        :param bool typed: Whether the predicate is called with records
+            whose cells are already decoded (see :class:`TypedRecord`)
+        :return: the predicate, called with a row
+        :rtype: Callable[[dict[str,str]],bool]
+        """
+        if not self.comp_type:
+            return lambda row: True
+
+        namespace = {'match': self.match, 'bools': BOOLS,
+                     'decode_str': decode_str, 'decode': Literal.eval_value}
+        decoders = {'int': 'int({})', 'bool': 'bools[{}]', 'str': 'decode_str({})'}
+
+        def operand(value, left=False):
+            if type(value) is Column and left and value.name == ROWID_KEY:
+                return f'row[{ROWID_KEY!r}]', 0
+            if type(value) is Column and typed:
+                return (f'row[{value.name!r}]',
+                        DECODE_COSTS.get(schema.get(value.name), DECODE_COSTS['str']))
+            if type(value) is Column:
+                col_type = schema.get(value.name)
+                decoder = decoders.get(col_type, 'decode({})')
+                return (decoder.format(f'row[{value.name!r}]'),
+                        DECODE_COSTS.get(col_type, DECODE_COSTS['str']))
+            name = f'v{len(namespace)}'
+            namespace[name] = value.value
+            return name, 0
+
+        terms = []
+        for comparison in self.comparisons:
+            (left, left_cost), (right, right_cost) = (operand(comparison.left, left=True),
+                                                       operand(comparison.right))
+            op = '==' if comparison.op == '=' else comparison.op
+            # `and` ends on a false comparison and `or` on a true one
+            selectivity = comparison_selectivity(schema, comparison)
+            decisive = 1 - selectivity if self.comp_type == 'and' else selectivity
+            terms.append(((left_cost + right_cost + 1) / decisive, f'{left} {op} {right}'))
+        terms.sort(key=lambda term: term[0])
+        expression = f' {self.comp_type} '.join(term for _, term in terms)
+
+        if typed:
+            # a cell which cannot be decoded fails when it is accessed
+            source = f'def predicate(row):\n    return {expression}\n'
+            exec(compile(source, '<conditions>', 'exec'), namespace)
+            return namespace['predicate']
+
+        source = (f'def predicate(row):\n'
+                  f'    try:\n'
+                  f'        return {expression}\n'
+                  f'    except (ValueError, KeyError, TypeError, SyntaxError):\n'
+                  f'        return match(row)\n')
+        exec(compile(source, '<conditions>', 'exec'), namespace)
+        return namespace['predicate']
+
 
 
 class CreateDbCmd(namedtuple('CreateDbCmd', 'name')):
@@ -84,14 +172,18 @@ class DeleteDbCmd(namedtuple('DeleteDbCmd', 'name')):
     def execute(self, db_manager):
         db_manager.delete_db(self.name)
 
-class CreateTableCmd(namedtuple('CreateTableCmd', 'name, schema')):
+class CreateTableCmd(namedtuple('CreateTableCmd', 'name, schema, storage',
+                                defaults=(None, ))):
     def validate(self):
         if set(self.schema.values()) - SCHEMA_TYPES:
             raise CommandError(f'Only schema accepted types are {SCHEMA_TYPES}')
+        if self.storage is not None and self.storage not in STORAGES:
+            raise CommandError(f'Only accepted storages are {set(STORAGES)}')
 
     def execute(self, db_manager):
         self.validate()
-        db_manager.create_table(name=self.name, schema=self.schema)
+        db_manager.create_table(name=self.name, schema=self.schema,
+                                storage=self.storage)
 
 class DeleteTableCmd(namedtuple('DeleteTableCmd', 'name')):
     def execute(self, db_manager):
@@ -140,56 +232,489 @@ class InsertCmd(namedtuple('InsertCmd', 'table, row')):
         self.validate(db_manager)
         db_manager.insert_row(table=self.table, row=self.row)
 
+class InsertRowsCmd(namedtuple('InsertRowsCmd', 'table, rows')):
+    def validate(self, db_manager):
+        schema = db_manager.get_table_schema(table_name=self.table)
+        for row in self.rows:
+            if row.keys() != schema.keys():
+                raise CommandError(f'Schema {schema.keys()} is mandatory')
+
+            validate_cmd_row_values(schema=schema, row=row)
+
+    def execute(self, db_manager):
+        self.validate(db_manager)
+        db_manager.insert_rows(table=self.table, rows=self.rows)
+
 def validate_cmd_conditions_list(schema={}, conditions_list=[]):
     for comparison in conditions_list.comparisons:
         col = comparison.left
         lit = comparison.right
-        needed_col_type = eval(schema[col.name])
+        if col.name == ROWID_KEY:
+            if type(lit.value) is not int:
+                raise CommandError(f'Col\'s {col.name} value {lit.value} has to be int')
+            continue
         if col.name not in schema:
             raise CommandError(f'Col {col.name} in conditions does not exist in schema')
+        needed_col_type = eval(schema[col.name])
         if not isinstance(lit.value, needed_col_type):
             raise CommandError(f'Col\'s {col.name} value {lit.value} has to be {schema[col.name]}')
 
-class QueryCmd(namedtuple('QueryCmd', 'table, projection, conditions_list')):
+def rowid_bounds(op, value):
+    """ Returns the rowids which compare (by op) to a value
+
+    :param str op: The comparison operator (e.g. '<')
+    :param int value: The rowid compared to
+    :return: the first rowid and the one after the last (None if
+        unbounded) or None if they are not a range (`!=`)
+    :rtype: tuple[int,int|None]|None
+    """
+    return {
+        '=': (value, value + 1),
+        '<': (0, value),
+        '<=': (0, value + 1),
+        '>': (value + 1, None),
+        '>=': (value, None),
+    }.get(op)
+
+def lookup_rowids(db_manager, table, conditions_list):
+    """ Finds with the rowid comparisons and the indexes of a table
+    the rows which may match the conditions, so only those rows are read
+
+    The `_rowid` comparisons are turned into ranges of rowids (which are
+    intersected for `op:and`) and the rows in them are read directly.
+    The comparisons of the columns with a bitmap index are combined
+    bitwise (`&` for `op:and`, `|` for `op:or`) into a single bitmap.
+    With `op:and` the other comparisons of an indexed column are looked
+    up together (so an ordered index intersects their ranges) and the
+    rowids found for the indexed columns are intersected; with `op:or`
+    every comparison needs an index
+
+    :param DbManager db_manager: The manager of the current database
+    :param str table: Name of the table
+    :param ConditionList conditions_list: The conditions
+    :return: the sorted rowids or None if the table has to be scanned
+    :rtype: list[int]|range|None
+    """
+    if not conditions_list.comp_type:
+        return None
+
+    indexes = db_manager.get_table_indexes(table).values()
+    indexed = {info.column for info in indexes}
+    bitwise = {info.column for info in indexes if INDEX_KINDS[info.kind].bitwise}
+    combine = operator.and_ if conditions_list.comp_type == 'and' else operator.or_
+    bitmap = None
+    found = []
+    by_column = {}
+    ranges = []
+    for comparison in conditions_list.comparisons:
+        col_name = comparison.left.name
+        if col_name == ROWID_KEY:
+            bounds = rowid_bounds(comparison.op, comparison.right.value)
+            if bounds is not None:
+                ranges.append(bounds)
+                continue
+        if col_name in bitwise:
+            bits = db_manager.index_bitmap(table, col_name, comparison.op,
+                                           comparison.right.value)
+            if bits is not None:
+                bitmap = bits if bitmap is None else combine(bitmap, bits)
+                continue
+        if col_name in indexed:
+            by_column.setdefault(col_name, []).append((comparison.op, comparison.right.value))
+        elif conditions_list.comp_type == 'or':
+            return None
+
+    if conditions_list.comp_type == 'and':
+        for col_name, conditions in by_column.items():
+            rowids = db_manager.index_lookup(table, col_name, conditions)
+            if rowids is None:
+                # no single index supports all of them
+                rowids = [db_manager.index_lookup(table, col_name, [condition])
+                          for condition in conditions]
+                found.extend(rowids_ for rowids_ in rowids if rowids_ is not None)
+            else:
+                found.append(rowids)
+    else:
+        for col_name, conditions in by_column.items():
+            for condition in conditions:
+                rowids = db_manager.index_lookup(table, col_name, [condition])
+                if rowids is None:
+                    return None
+                found.append(rowids)
+
+    if bitmap is not None:
+        found.append(bitmap_rowids(bitmap))
+
+    if ranges:
+        next_rowid = db_manager.get_table_meta(table).next_rowid
+        ranges = [range(max(start, 0), next_rowid if stop is None else min(stop, next_rowid))
+                  for start, stop in ranges]
+        if conditions_list.comp_type == 'and':
+            rowids = range(max(r.start for r in ranges), min(r.stop for r in ranges))
+            if not found:
+                return rowids
+            return sorted(rowid for rowid in set.intersection(*found) if rowid in rowids)
+        else:
+            found.extend(set(r) for r in ranges)
+
+    if not found:
+        return None
+    if conditions_list.comp_type == 'and':
+        return sorted(set.intersection(*found))
+    return sorted(set.union(*found))
+
+def plan_rows(db_manager, table, columns, conditions_list, lazy=True, typed=False,
+              order=None):
+    """ Plans how the rows matching the conditions are read from a table,
+    probing the `_rowid` comparisons and the indexes for candidate rows
+    (see :func:`plan_scan`)
+
+    If the rows have to be sorted by a column having an ordered index
+    (and no row has an empty cell, which is not indexed), they are
+    fetched in the order of the index, so the scan node gets the `order`
+
+    :param DbManager db_manager: The manager of the current database
+    :param str table: Name of the table
+    :param list[str] columns: Names of the columns read (None for all)
+    :param ConditionList conditions_list: The conditions
+    :param bool lazy: Whether to read lazily decoded records
+    :param bool typed: Whether to read records decoded into values
+    :param tuple order: The column and the direction (whether descending)
+        the rows have to be sorted by
+    :rtype: PlanNode
+    """
+    candidates = lookup_rowids(db_manager, table, conditions_list)
+    using = []
+    if candidates is not None:
+        col_names = {comparison.left.name for comparison in conditions_list.comparisons}
+        using = sorted(name for name, info in db_manager.get_table_indexes(table).items()
+                       if info.column in col_names)
+
+    if order is not None:
+        col_name, descending = order
+        rowids = db_manager.index_order(table, col_name, reverse=descending)
+        if rowids is not None:
+            if candidates is not None:
+                candidates = set(candidates)
+                rowids = [rowid for rowid in rowids if rowid in candidates]
+            using = sorted(set(using) | {name for name, info in db_manager.get_table_indexes(table).items()
+                                         if info.column == col_name and INDEX_KINDS[info.kind].ordered})
+            return plan_scan(db_manager, table, columns, conditions_list, rowids, using, lazy,
+                             typed=typed, order=order)
+
+    return plan_scan(db_manager, table, columns, conditions_list, candidates, using, lazy,
+                     typed=typed)
+
+class ExplainCmd(namedtuple('ExplainCmd', 'cmd, analyze')):
+    def execute(self, db_manager):
+        self.cmd.validate(db_manager)
+        plan = self.cmd.plan(db_manager)
+        if self.analyze:
+            plan.analyze()
+            for _ in plan.execute(db_manager):
+                pass
+        return plan.explain()
+
+class QueryCmd(namedtuple('QueryCmd', 'table, projection, conditions_list, limit, offset, '
+                                      'order_by, descending, group_by, aggregates',
+                          defaults=(None, None, None, False, None, None))):
     def validate(self, db_manager):
         schema = db_manager.get_table_schema(table_name=self.table)
         
-        if self.projection[0] != '*':
-            if set(self.projection) - set(schema.keys()):
-                raise CommandError(f'Query projection is enforced by schema; Only {schema.keys()} or * are allowed')
+        if self._grouped():
+            self._validate_groups(schema)
+        else:
+            if self.projection[0] != '*':
+                if set(self.projection) - set(schema.keys()):
+                    raise CommandError(f'Query projection is enforced by schema; Only {schema.keys()} or * are allowed')
+            if self.order_by is not None and self.order_by not in schema and self.order_by != ROWID_KEY:
+                raise CommandError(f'Query can only be ordered by {schema.keys()} or {ROWID_KEY}')
         validate_cmd_conditions_list(schema=schema, 
                                      conditions_list=self.conditions_list)
 
+    def _grouped(self):
+        """ Whether the query returns groups of rows (with aggregates) """
+        return self.group_by is not None or self.aggregates is not None
+
+    def _counts_rows(self):
+        """ Whether the query only counts the rows (``count(*)``) """
+        return (self.group_by is None and self.aggregates is not None
+                and all(aggregate == ('count', '*') for aggregate in self.aggregates))
+
+    def _validate_groups(self, schema):
+        group_by = self.group_by or []
+        if set(group_by) - set(schema.keys()):
+            raise CommandError(f'Query groups are enforced by schema; Only {schema.keys()} are allowed')
+        aggregate_names = {aggregate.name for aggregate in self.aggregates or []}
+        if set(self.projection) - aggregate_names - set(group_by):
+            raise CommandError('Query projection of groups can only have the group columns and aggregates')
+        for aggregate in self.aggregates or []:
+            if aggregate.col_name == '*':
+                continue
+            if aggregate.col_name not in schema:
+                raise CommandError(f'Col {aggregate.col_name} in {aggregate.name} does not exist in schema')
+            if aggregate.func in ('sum', 'avg') and schema[aggregate.col_name] != 'int':
+                raise CommandError(f'Col {aggregate.col_name} in {aggregate.name} has to be int')
+        if self.order_by is not None and self.order_by not in group_by:
+            raise CommandError(f'Query of groups can only be ordered by {group_by}')
+
+    def _scan_columns(self):
+        """ Returns the columns which need to be read for the query
+        (the projected ones, the ones used in conditions and the one
+        the rows are sorted by) or None if all of them are needed
+        """
+        if self._grouped():
+            columns = list(self.group_by or [])
+            col_names = [aggregate.col_name for aggregate in self.aggregates or []
+                         if aggregate.col_name != '*']
+        elif self.projection[0] == '*':
+            return None
+        else:
+            columns = list(self.projection)
+            col_names = []
+        col_names += [comparison.left.name for comparison in self.conditions_list.comparisons]
+        if self.order_by is not None:
+            col_names.append(self.order_by)
+        for col_name in col_names:
+            if col_name not in columns and col_name != ROWID_KEY:
+                columns.append(col_name)
+        return columns
+
+    def plan(self, db_manager):
+        """ Plans the query: reads the candidate rows (see :func:`plan_rows`),
+        filters and projects them, with a pool of processes if the whole
+        table is scanned and split into partitions
+
+        Aggregates are computed by streaming the rows through a hash
+        table of their groups (see :class:`HashAggregate`); the rows of
+        a table are counted from its metadata or, with conditions, by
+        only reading the cells they need (see :class:`Count`). Ordered rows
+        are read in the order of an ordered index of the column or else
+        sorted (see :class:`Sort`), only keeping the rows up to the limit
+        if there is one (see :class:`TopK`). With a limit (or offset) the
+        rows are read by a single scan which stops as soon as the limit
+        is reached
+
+        :rtype: PlanNode
+        """
+        grouped = self._grouped()
+        order = None
+        if self.order_by is not None and not grouped:
+            order = (self.order_by, self.descending)
+
+        if self._counts_rows():
+            names = [aggregate.name for aggregate in self.aggregates]
+            if not self.conditions_list.comp_type:
+                rows = MetaCount(self.table, names)
+            else:
+                rows = Count(names, plan_rows(db_manager, self.table, [],
+                                              self.conditions_list, typed=True))
+        else:
+            rows = plan_rows(db_manager, self.table, self._scan_columns(),
+                             self.conditions_list, typed=True, order=order)
+            if grouped:
+                rows = HashAggregate(self.group_by or [], self.aggregates or [], rows)
+        offset = self.offset or 0
+        if self.order_by is not None and rows.scan().order is None:
+            if self.limit is not None:
+                rows = TopK(self.order_by, self.descending, offset + self.limit, rows)
+            else:
+                rows = Sort(self.order_by, self.descending, rows)
+        plan = Project(self.projection, rows,
+                       self._project_group if grouped else self._project)
+
+        if self.limit is not None or offset:
+            if self.limit is not None and isinstance(rows, Scan):
+                # a parallel scan does not read ahead past the limit
+                needed = offset + self.limit
+                plan.scan().readahead = max(min(needed, db_manager.scan_readahead or needed), 1)
+            return Limit(self.limit, offset, plan)
+
+        if isinstance(rows, SeqScan):
+            partitions = db_manager.get_scan_partitions(self.table)
+            if len(partitions) > 1:
+                plan = Gather(partitions, db_manager.query_processes, plan,
+                              self._execute_partitioned)
+        return plan
+
     def execute(self, db_manager):
         self.validate(db_manager)
+        yield from db_manager.cached_rows(repr(self), [self.table],
+                                          lambda: self.plan(db_manager).execute(db_manager))
+
+    def _execute_partitioned(self, db_manager, partitions):
+        """ Executes the query with a pool of processes, each one scanning
+        and filtering a partition (range of rowids) of the table
+
+        The results of a partition are streamed back as soon as it is done
+        (or, for ordered results, once the partitions before it are done)
+        """
+        ordered = db_manager.query_ordered
+        pool = db_manager.get_process_pool()
+        futures = [pool.submit(execute_query_partition, db_manager.get_current_db(),
+                               self, rowid_range, ordered)
+                   for rowid_range in partitions]
+        try:
+            for future in futures if ordered else as_completed(futures):
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _project(self, row):
+        """ Turns a matching row into a result with the projected columns """
         star_proj = len(self.projection) == 1 and self.projection[0] == '*'
+        result_row = {ROWID_KEY: row[ROWID_KEY]}
+
+        # records are lazily decoded (into typed values): only the cells
+        # used by conditions are decoded for the rows which do not match
+        for key in row:
+            if key == ROWID_KEY:
+                continue
+            if not star_proj:
+                if key in self.projection:
+                    result_row[key] = row[key]
+            else:
+                result_row[key] = row[key]
+
+        return result_row
+
+    def _project_group(self, row):
+        """ Turns a group into a result with the projected group columns
+        and aggregates
+        """
+        return {name: row[name] for name in self.projection}
+
+
+
+def execute_query_partition(db_name, cmd, rowid_range, ordered):
+    """ Executes a query on a partition of a table (in a worker process,
+    with the manager it keeps for all its partitions)
+
+    :param str db_name: Name of the database
+    :param QueryCmd cmd: The (validated) query
+    :param range rowid_range: The rowids of the partition
+    :param bool ordered: Whether the results are sorted by rowid
+    :return: the result rows of the partition
+    :rtype: list[dict]
+    """
+    db_manager = worker_manager(db_name, cmd.table)
+    plan = Project(cmd.projection,
+                   plan_scan(db_manager, cmd.table, cmd._scan_columns(), cmd.conditions_list,
+                             rowid_range=rowid_range, typed=True),
+                   cmd._project)
+    rows = list(plan.execute(db_manager))
+    if ordered:
+        rows.sort(key=lambda row: row[ROWID_KEY])
+    return rows
+
+class JoinCmd(namedtuple('JoinCmd', 'projection, left, right, left_col, right_col, '
+                                    'conditions_list, limit, offset',
+                         defaults=(None, None))):
+    def validate(self, db_manager):
+        if self.left == self.right:
+            raise CommandError('A table can not be joined with itself')
+        schemas = {table: db_manager.get_table_schema(table_name=table)
+                   for table in (self.left, self.right)}
+        col_types = {f'{table}.{col_name}': col_type for table, schema in schemas.items()
+                     for col_name, col_type in [(ROWID_KEY, 'int'), *schema.items()]}
+
+        left_type = col_types.get(f'{self.left}.{self.left_col}')
+        right_type = col_types.get(f'{self.right}.{self.right_col}')
+        if left_type is None or right_type is None:
+            raise CommandError('Join columns do not exist in schema')
+        if left_type != right_type:
+            raise CommandError(f'Join columns have to be of the same type; {left_type} != {right_type}')
+        if self.projection[0] != '*':
+            if set(self.projection) - set(col_types):
+                raise CommandError(f'Query projection is enforced by schema; Only {list(col_types)} or * are allowed')
+        for table, conditions_list in self._table_conditions().items():
+            validate_cmd_conditions_list(schema=schemas[table], conditions_list=conditions_list)
+
+    def _table_conditions(self):
+        """ Splits the conditions (of qualified columns, e.g. ``users.age``)
+        into the conditions of each table, which are pushed down into
+        the reads of its rows
+
+        :rtype: dict[str,ConditionList]
+        """
+        comparisons = {self.left: [], self.right: []}
+        for comparison in self.conditions_list.comparisons:
+            table, _, col_name = comparison.left.name.partition('.')
+            if table not in comparisons:
+                raise CommandError(f'Col {comparison.left.name} in conditions is not of a joined table')
+            comparisons[table].append(comparison._replace(left=Column(col_name)))
+        if self.conditions_list.comp_type == 'or' and all(comparisons.values()):
+            raise CommandError('Conditions of both joined tables can only be combined with op:and')
+        return {table: ConditionList(self.conditions_list.comp_type if table_comparisons else '',
+                                     table_comparisons)
+                for table, table_comparisons in comparisons.items()}
+
+    def _projection(self, db_manager):
+        """ Returns the projected (qualified) columns, all of them for * """
+        if self.projection[0] != '*':
+            return self.projection
+        return [f'{table}.{col_name}' for table in (self.left, self.right)
+                for col_name in [ROWID_KEY, *db_manager.get_table_schema(table_name=table)]]
+
+    def _scan_columns(self, table, col_name):
+        """ Returns the columns of a table which need to be read for the
+        join (the projected ones and the joined one) or None if all of
+        them are needed
+        """
+        if self.projection[0] == '*':
+            return None
+        columns = []
+        for name in [*self.projection, f'{table}.{col_name}']:
+            name_table, _, name = name.partition('.')
+            if name_table == table and name not in columns and name != ROWID_KEY:
+                columns.append(name)
+        return columns
+
+    def plan(self, db_manager):
+        """ Plans the join: the conditions of each table filter the reads of
+        its rows, which are joined by a hash join or, with an index of
+        the column of the larger table, by looking up its rows (see
+        :func:`plan_join`)
+
+        :rtype: PlanNode
+        """
+        conditions = self._table_conditions()
+        left = plan_rows(db_manager, self.left, self._scan_columns(self.left, self.left_col),
+                         conditions[self.left], typed=True)
+        right = plan_rows(db_manager, self.right, self._scan_columns(self.right, self.right_col),
+                          conditions[self.right], typed=True)
+        projection = self._projection(db_manager)
+
+        def project(row):
+            return {name: row[name] for name in projection}
+
+        plan = Project(projection, plan_join(db_manager, left, self.left_col,
+                                             right, self.right_col), project)
+        offset = self.offset or 0
+        if self.limit is not None or offset:
+            return Limit(self.limit, offset, plan)
+        return plan
 
-        for row in db_manager.scan_rows(table=self.table):
-            if self.conditions_list.match(row):
-                result_row = {ROWID_KEY: row[ROWID_KEY]}
-                del row[ROWID_KEY]
-
-                for key, val in row.items():
-                    if not star_proj:
-                        if key in self.projection:
-                            result_row[key] = Literal(val).value
-                    else:
-                        result_row[key] = Literal(val).value
-
-                yield result_row
-
-
+    def execute(self, db_manager):
+        self.validate(db_manager)
+        yield from db_manager.cached_rows(repr(self), [self.left, self.right],
+                                          lambda: self.plan(db_manager).execute(db_manager))
 
 class DeleteCmd(namedtuple('DeleteCmd', 'table, conditions_list')):
     def validate(self, db_manager):
         schema = db_manager.get_table_schema(table_name=self.table)
         validate_cmd_conditions_list(schema, self.conditions_list)
 
+    def plan(self, db_manager):
+        # only the rowids of the matching rows are needed
+        return Delete(self.table, plan_rows(db_manager, self.table, [],
+                                            self.conditions_list, lazy=False))
+
     def execute(self, db_manager):
         self.validate(db_manager)
-        for row in db_manager.scan_rows(table=self.table):
-            if self.conditions_list.match(row):
-                db_manager.delete_row(table=self.table, rowid=row['_rowid'])
+        for _ in self.plan(db_manager).execute(db_manager):
+            pass
 
 class UpdateCmd(namedtuple('UpdateCmd', 'table, values, conditions_list')):
     def validate(self, db_manager):
@@ -198,12 +723,58 @@ class UpdateCmd(namedtuple('UpdateCmd', 'table, values, conditions_list')):
         validate_cmd_conditions_list(schema=schema,
                                      conditions_list=self.conditions_list)
 
+    def plan(self, db_manager):
+        return Update(self.table, self.values,
+                      plan_rows(db_manager, self.table, [], self.conditions_list,
+                                lazy=False))
+
+    def execute(self, db_manager):
+        self.validate(db_manager)
+        for _ in self.plan(db_manager).execute(db_manager):
+            pass
+
+class VacuumCmd(namedtuple('VacuumCmd', 'table, storage, renumber')):
+    def validate(self):
+        if self.storage is not None and self.storage not in STORAGES:
+            raise CommandError(f'Only accepted storages are {set(STORAGES)}')
+
+    def execute(self, db_manager):
+        self.validate()
+        result = db_manager.compact_table(name=self.table, storage=self.storage,
+                                          renumber=self.renumber)
+        return {
+            'rows': result.rows,
+            'storage': result.storage,
+            'bytes_reclaimed': result.bytes_reclaimed,
+            'inodes_reclaimed': result.inodes_reclaimed,
+        }
+
+class CreateIndexCmd(namedtuple('CreateIndexCmd', 'name, table, col_name, kind')):
+    def validate(self, db_manager):
+        if self.kind not in INDEX_KINDS:
+            raise CommandError(f'Only accepted index kinds are {set(INDEX_KINDS)}')
+        schema = db_manager.get_table_schema(table_name=self.table)
+        if self.col_name not in schema:
+            raise CommandError(f'Col {self.col_name} does not exist')
+        col_types = INDEX_KINDS[self.kind].col_types
+        if schema[self.col_name] not in col_types:
+            raise CommandError(f'A {self.kind} index only accepts cols of types {col_types}')
+        if self.name in db_manager.get_table_indexes(table_name=self.table):
+            raise CommandError(f'Index {self.name} is already existing')
+
     def execute(self, db_manager):
         self.validate(db_manager)
-        for row in db_manager.scan_rows(table=self.table):
-            if self.conditions_list.match(row):
-                db_manager.update_row(table=self.table,
-                                      rowid=row['_rowid'], new_row=self.values)
+        db_manager.create_index(table=self.table, name=self.name,
+                                col_name=self.col_name, kind=self.kind)
+
+class DropIndexCmd(namedtuple('DropIndexCmd', 'name, table')):
+    def validate(self, db_manager):
+        if self.name not in db_manager.get_table_indexes(table_name=self.table):
+            raise CommandError(f'Index {self.name} does not exist')
+
+    def execute(self, db_manager):
+        self.validate(db_manager)
+        db_manager.drop_index(table=self.table, name=self.name)
 
 class FromCsvCmd(namedtuple('FromCsvCmd', 'csv_path')):
     def execute(self, db_manager):
@@ -218,9 +789,13 @@ class SchemaCmd(namedtuple('FromCsvCmd', 'table_name')):
         schema = db_manager.get_table_schema(self.table_name)
         return schema
 
-class TablesCmd(namedtuple('TablesCmd', 'db_name')):
+class TablesCmd(namedtuple('TablesCmd', 'db_name, counts', defaults=(False, ))):
     def execute(self, db_manager):
-        yield from db_manager.get_tables(db_name=self.db_name)
+        if not self.counts:
+            yield from db_manager.get_tables(db_name=self.db_name)
+            return
+        for table, count in db_manager.get_table_counts(db_name=self.db_name):
+            yield {'table': table, 'count': count}
 
 class DbCmd(namedtuple('DbCmd', '')):
     def validate(self, db_manager):
@@ -241,21 +816,30 @@ class QueryParser(object):
     re_db_create = re.compile(r'^create\s+sdb\s+(?P<name>\w+);$')
     re_db_use = re.compile(r'^use\s+sdb\s+(?P<name>\w+);$')
     re_db_delete = re.compile(r'^delete\s+sdb\s+(?P<name>\w+);$')
-    re_table_create_main = re.compile(r'^create\s+table\s+(?P<name>\w+)\s+columns\s+(?P<columns>((int|str|bool):(\w+)\s?)+);$')
+    re_table_create_main = re.compile(r'^create\s+table\s+(?P<name>\w+)(\s+storage:(?P<storage>\w+))?\s+columns\s+(?P<columns>((int|str|bool):(\w+)\s?)+);$')
     re_table_create_col = re.compile(r'(int|str|bool):(\w+)')
     re_table_delete = re.compile(r'^delete\s+table\s+(?P<name>\w+);$')
     re_table_add_column = re.compile(r'^change\s+table\s+(?P<name>\w+)\s+add\s+column\s+(?P<col_type>int|str|bool):(?P<col_name>\w+);$')
     re_table_del_column = re.compile(r'^change\s+table\s+(?P<name>\w+)\s+del\s+column\s+(?P<col_name>\w+);$')
     re_table_insert_main = re.compile(r'^insert\s+into\s+(?P<table_name>\w+)\s+values\s+(?P<values>(\w+=(True|False|\d+?|\"(\w|[\/\<\>:`~.,?!@;\'#$%\^&*\-_+=\[\{\]\}\\\|()\ ])*?\")\s?)+?);$')
+    re_table_insert_rows_main = re.compile(r'^insert\s+into\s+(?P<table_name>\w+)\s+values\s+(?P<rows>\((\w+=(True|False|\d+?|\"(\w|[\/\<\>:`~.,?!@;\'#$%\^&*\-_+=\[\{\]\}\\\|()\ ])*?\")\s?)+?\)(\s*,\s*\((\w+=(True|False|\d+?|\"(\w|[\/\<\>:`~.,?!@;\'#$%\^&*\-_+=\[\{\]\}\\\|()\ ])*?\")\s?)+?\))*);$')
+    re_table_insert_rows_row = re.compile(r'\((?P<values>(\w+=(True|False|\d+?|\"(\w|[\/\<\>:`~.,?!@;\'#$%\^&*\-_+=\[\{\]\}\\\|()\ ])*?\")\s?)+?)\)')
     re_table_values = re.compile(r'(\w+)=(True|False|(\d+)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\")')
     re_where_conditions = re.compile(r'(?P<col_name>\w+?)(?P<op>=|!=|<|>|<=|>=)(?P<value>(\d+)|(True|False)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\")')
-    re_table_scan_rows = re.compile(r'^query\s+(?P<projection>\*|(\w+\,?)+?)\s+(?P<table_name>\w+)(\s+where\s+op:(?P<op>or|and)\s+conditions\s+(?P<conditions>((\w+?)(=|!=|<|>|<=|>=)((\d+?)|(True|False)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\")(\s+)?)+))?;$')
+    re_join_conditions = re.compile(r'(?P<col_name>\w+\.\w+)(?P<op>=|!=|<|>|<=|>=)(?P<value>(\d+)|(True|False)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\")')
+    re_aggregate = re.compile(r'(?P<func>count|sum|min|max|avg)\((?P<col_name>\*|\w+)\)')
+    re_table_scan_rows = re.compile(r'^query\s+(?P<projection>\*|((count\(\*\)|(count|sum|min|max|avg)\(\w+\)|\w+)\,?)+?)\s+(?P<table_name>\w+)(\s+where\s+op:(?P<op>or|and)\s+conditions\s+(?P<conditions>((\w+?)(=|!=|<|>|<=|>=)((\d+?)|(True|False)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\")(\s+)?)+))?(\s+group\s+by\s+(?P<group_by>(\w+\,?)+?))?(\s+order\s+by\s+(?P<order_by>\w+)(\s+(?P<direction>asc|desc))?)?(\s+limit\s+(?P<limit>\d+))?(\s+offset\s+(?P<offset>\d+))?;$')
+    re_table_join = re.compile(r'^query\s+(?P<projection>\*|(\w+\.\w+\,?)+?)\s+(?P<left>\w+)\s+join\s+(?P<right>\w+)\s+on\s+(?P<on_left>\w+\.\w+)=(?P<on_right>\w+\.\w+)(\s+where\s+op:(?P<op>or|and)\s+conditions\s+(?P<conditions>((\w+\.\w+)(=|!=|<|>|<=|>=)((\d+?)|(True|False)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\")(\s+)?)+))?(\s+limit\s+(?P<limit>\d+))?(\s+offset\s+(?P<offset>\d+))?;$')
     re_table_update_rows = re.compile(r'^update\s+(?P<table_name>\w+)\s+set\s+(?P<setters>(((\w+)=(True|False|(\d+)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\"))\s?)+)(\s+where\s+op:(?P<op>or|and)\s+conditions\s+(?P<conditions>((\w+?)(=|!=|<|>|<=|>=)((\d+?)|(True|False)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\")(\s+)?)+))?;$')
     re_table_delete_rows = re.compile(r'^delete\s+in\s+(?P<table_name>\w+)(\s+where\s+op:(?P<op>or|and)\s+conditions\s+(?P<conditions>((\w+?)(=|!=|<|>|<=|>=)((\d+?)|(True|False)|\"([A-Za-z0-9\/\<\>\:\`\~\.\,\?\!\@\;\'\#\$\%\^\&\*\-\_\+\=\[\{\]\}\\\|\(\)\ ])*?\")(\s+)?)+))?;$')
+    re_index_create = re.compile(r'^create\s+index\s+(?P<name>\w+)\s+on\s+(?P<table_name>\w+)\s*\(\s*(?P<col_name>\w+)\s*\)(\s+using\s+(?P<kind>\w+))?;$')
+    re_index_drop = re.compile(r'^drop\s+index\s+(?P<name>\w+)\s+on\s+(?P<table_name>\w+);$')
+    re_explain = re.compile(r'^explain\s+(?P<analyze>analyze\s+)?(?P<query>.+)$')
+    re_vacuum = re.compile(r'^vacuum\s+(?P<table_name>\w+)(\s+storage:(?P<storage>\w+))?(\s+(?P<renumber>renumber))?;$')
     re_from_csv = re.compile(r'^from\s+csv\s+(?P<csv_path>[^ ]+?\.csv)\s*?;$')
     re_to_csv = re.compile(r'^to\s+csv\s+(?P<csv_path>[^ ]+?\.csv)\s*?;$')
     re_schema = re.compile(r'^schema\s+(?P<table_name>\w+)\s*?;$')
-    re_tables = re.compile(r'^tables\s+(?P<db_name>\w+)\s*?;$')
+    re_tables = re.compile(r'^tables\s+(?P<db_name>\w+)(?P<counts>\s+with\s+counts)?\s*?;$')
     re_db = re.compile(r'^db\s*?;$')
 
     def __init__(self):
@@ -308,7 +892,8 @@ class QueryParser(object):
             return
         schema = {col_name:col_type for col_type, col_name in result_cols}
 
-        return CreateTableCmd(name=name, schema=schema)
+        return CreateTableCmd(name=name, schema=schema,
+                              storage=result_main.group('storage'))
 
     def _parse_table_delete(self, query):
         result = self.re_table_delete.fullmatch(query)
@@ -351,6 +936,21 @@ class QueryParser(object):
 
         return InsertCmd(table=name, row=row)
     
+    def _parse_insert_rows(self, query):
+        result_main = self.re_table_insert_rows_main.fullmatch(query)
+        if not result_main:
+            return
+        name = result_main.group('table_name')
+        rows_str = result_main.group('rows')
+
+        rows = []
+        for result_row in self.re_table_insert_rows_row.finditer(rows_str):
+            result_values = self.re_table_values.findall(result_row.group('values'))
+            rows.append({col_name:col_value
+                         for col_name, col_value, _, _ in result_values})
+
+        return InsertRowsCmd(table=name, rows=rows)
+
     def _parse_scan_rows(self, query):
         result_main = self.re_table_scan_rows.fullmatch(query)
         if not result_main:
@@ -367,8 +967,41 @@ class QueryParser(object):
                             [Comparison(Column(left), op, Literal(right))
                             for left, op, right, _, _, _ in result_conditions])
 
+        aggregates = [Aggregate(*result.groups())
+                      for result in map(self.re_aggregate.fullmatch, projection) if result]
+        limit, offset, group_by = result_main.group('limit', 'offset', 'group_by')
         return QueryCmd(table=name, projection=projection, 
-                        conditions_list=conditions)
+                        conditions_list=conditions,
+                        limit=None if limit is None else int(limit),
+                        offset=None if offset is None else int(offset),
+                        order_by=result_main.group('order_by'),
+                        descending=result_main.group('direction') == 'desc',
+                        group_by=None if group_by is None else group_by.split(','),
+                        aggregates=aggregates or None)
+
+    def _parse_join(self, query):
+        result_main = self.re_table_join.fullmatch(query)
+        if not result_main:
+            return
+        left, right = result_main.group('left', 'right')
+        on = dict(name.split('.') for name in result_main.group('on_left', 'on_right'))
+        if set(on) != {left, right}:
+            raise CommandError(f'Join columns have to be of {left} and {right}')
+
+        conditions = ConditionList('', [])
+        conditions_str = result_main.group('conditions')
+        if conditions_str:
+            result_conditions = self.re_join_conditions.findall(conditions_str)
+            conditions = ConditionList(result_main.group('op'),
+                            [Comparison(Column(col_name), op, Literal(value))
+                            for col_name, op, value, _, _, _ in result_conditions])
+
+        limit, offset = result_main.group('limit', 'offset')
+        return JoinCmd(projection=result_main.group('projection').split(','),
+                       left=left, right=right, left_col=on[left], right_col=on[right],
+                       conditions_list=conditions,
+                       limit=None if limit is None else int(limit),
+                       offset=None if offset is None else int(offset))
 
     def _parse_table_update_rows(self, query):
         result_main = self.re_table_update_rows.fullmatch(query)
@@ -414,12 +1047,50 @@ class QueryParser(object):
         
         return DeleteCmd(table=name, conditions_list=conditions)
 
+    def _parse_index_create(self, query):
+        result = self.re_index_create.fullmatch(query)
+        if not result:
+            return
+
+        return CreateIndexCmd(name=result.group('name'),
+                              table=result.group('table_name'),
+                              col_name=result.group('col_name'),
+                              kind=result.group('kind') or 'hash')
+
+    def _parse_index_drop(self, query):
+        result = self.re_index_drop.fullmatch(query)
+        if not result:
+            return
+
+        return DropIndexCmd(name=result.group('name'),
+                            table=result.group('table_name'))
+
+    def _parse_explain(self, query):
+        result = self.re_explain.fullmatch(query)
+        if not result:
+            return
+
+        cmd = self.parse(result.group('query'))
+        if not isinstance(cmd, (QueryCmd, JoinCmd, UpdateCmd, DeleteCmd)):
+            raise CommandError('Only query, update and delete commands can be explained')
+        return ExplainCmd(cmd=cmd, analyze=result.group('analyze') is not None)
+
+    def _parse_vacuum(self, query):
+        result = self.re_vacuum.fullmatch(query)
+        if not result:
+            return
+
+        return VacuumCmd(table=result.group('table_name'),
+                         storage=result.group('storage'),
+                         renumber=result.group('renumber') is not None)
+
     def _parse_tables(self, query):
         result = self.re_tables.fullmatch(query)
         if not result:
             return
 
-        return TablesCmd(db_name=result.group('db_name'))
+        return TablesCmd(db_name=result.group('db_name'),
+                         counts=result.group('counts') is not None)
 
     def _parse_db(self, query):
         result = self.re_db.fullmatch(query)
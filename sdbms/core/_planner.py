@@ -0,0 +1,801 @@
+import itertools
+import operator
+import time
+from functools import reduce
+
+from ._aggregate import hash_aggregate
+from ._index import INDEX_KINDS
+from ._sort import external_sort, top_k
+from ._storage import IO_STATS
+
+# estimated number of groups of rows, as a fraction of the rows
+GROUPS = 0.1
+
+# estimated fraction of the rows matching a comparison (by operator);
+# a comparison of a bool column matches half of them
+SELECTIVITY = {
+    '=': 0.1,
+    '!=': 0.9,
+    '<': 1 / 3,
+    '<=': 1 / 3,
+    '>': 1 / 3,
+    '>=': 1 / 3,
+}
+
+
+def scan_cost(storage, n_columns, rows):
+    """ Estimates the cost (roughly, in files opened) of reading rows
+    of a table sequentially
+
+    :param str storage: The storage of the table (e.g. 'packed')
+    :param int n_columns: Number of columns read
+    :param float rows: Number of rows read
+    :rtype: float
+    """
+    if storage == 'dirs':
+        # a file per cell
+        return 1 + rows * n_columns
+    if storage == 'columns':
+        # the files of the columns, read in batches
+        return 1 + n_columns + rows * 0.02 * n_columns
+    # the segments, read record after record
+    return 1 + rows * 0.05
+
+
+def fetch_cost(storage, n_columns, rows, contiguous=False):
+    """ Estimates the cost (roughly, in files opened) of reading rows
+    of a table one by one by rowid
+
+    :param str storage: The storage of the table (e.g. 'packed')
+    :param int n_columns: Number of columns read
+    :param float rows: Number of rows read
+    :param bool contiguous: Whether the rowids are a range
+    :rtype: float
+    """
+    if storage == 'dirs':
+        # a stat of the row dir and a file per cell
+        return rows * (n_columns + 0.1)
+    if storage == 'columns':
+        # a range of positions is read with a single scan
+        if contiguous:
+            return scan_cost(storage, n_columns, rows)
+        return rows * (n_columns + 1)
+    # a positioned read in a segment
+    return rows
+
+
+def comparison_selectivity(schema, comparison):
+    """ Estimates the fraction of the rows of a table matching a comparison
+
+    :param dict[str,str] schema: The schema of the table
+    :param Comparison comparison: The comparison
+    :rtype: float
+    """
+    if schema.get(comparison.left.name) == 'bool':
+        return 0.5
+    return SELECTIVITY[comparison.op]
+
+
+def estimate_selectivity(schema, conditions_list):
+    """ Estimates the fraction of the rows of a table matching conditions
+
+    :param dict[str,str] schema: The schema of the table
+    :param ConditionList conditions_list: The conditions
+    :rtype: float
+    """
+    if not conditions_list.comp_type:
+        return 1.0
+
+    fractions = [comparison_selectivity(schema, comparison)
+                 for comparison in conditions_list.comparisons]
+    if conditions_list.comp_type == 'and':
+        return reduce(operator.mul, fractions, 1.0)
+    return 1 - reduce(operator.mul, (1 - fraction for fraction in fractions), 1.0)
+
+
+def condition_columns(conditions_list):
+    """ Returns the columns read by conditions (`_rowid` is not a column)
+
+    :param ConditionList conditions_list: The conditions
+    :rtype: list[str]
+    """
+    columns = []
+    for comparison in conditions_list.comparisons:
+        if comparison.left.name not in columns and comparison.left.name != '_rowid':
+            columns.append(comparison.left.name)
+    return columns
+
+
+class NodeStats(object):
+    """ What executing a plan node took, including its children:
+    the rows it produced, the files opened and bytes read by the
+    storages and the wall time (in seconds)
+    """
+    __slots__ = ('rows', 'files_opened', 'bytes_read', 'time')
+
+    def __init__(self):
+        self.rows = 0
+        self.files_opened = 0
+        self.bytes_read = 0
+        self.time = 0.0
+
+
+class PlanNode(object):
+    """ Node of a plan: produces rows by pulling the rows of its children
+
+    A node carries the planner's estimates of the number of rows it
+    produces and of their cost (roughly, in files opened) including
+    the cost of its children. Once :meth:`analyze` is called, executing
+    the plan also measures every node (see :class:`NodeStats`)
+    """
+    label = None
+
+    def __init__(self, rows, cost, children=()):
+        """
+        :param float rows: Estimated number of rows produced
+        :param float cost: Estimated cost of producing them
+        :param list[PlanNode] children: The nodes the rows are pulled from
+        """
+        self.rows = rows
+        self.cost = cost
+        self.children = list(children)
+        self.stats = None
+
+    def detail(self):
+        """ Describes what the node works on (e.g. the table)
+
+        :rtype: str
+        """
+        return ''
+
+    def scan(self):
+        """ Returns the node reading the rows from the table
+
+        :rtype: PlanNode
+        """
+        return self.children[0].scan() if self.children else self
+
+    def _execute(self, db_manager):
+        """ Iterates over the rows produced by the node """
+        raise NotImplementedError
+
+    def execute(self, db_manager):
+        """ Iterates over the rows produced by the node (measuring it
+        if the plan is analyzed)
+
+        :param DbManager db_manager: The manager of the current database
+        :rtype: Iterator[dict]
+        """
+        rows = self._execute(db_manager)
+        if self.stats is None:
+            return rows
+        return self._measure(rows)
+
+    def _measure(self, rows):
+        stats = self.stats
+        while True:
+            start = time.perf_counter()
+            files_opened, bytes_read = IO_STATS.files_opened, IO_STATS.bytes_read
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            finally:
+                stats.time += time.perf_counter() - start
+                stats.files_opened += IO_STATS.files_opened - files_opened
+                stats.bytes_read += IO_STATS.bytes_read - bytes_read
+            stats.rows += 1
+            yield row
+
+    def analyze(self):
+        """ Makes the execution of the plan measure its nodes """
+        self.stats = NodeStats()
+        for child in self.children:
+            child.analyze()
+
+    def explain(self, depth=0):
+        """ Describes the plan, one node per line (depth first)
+
+        :param int depth: Depth of the node in the plan
+        :return: the label and the estimates of every node (and, for an
+            analyzed plan, what executing it took)
+        :rtype: list[dict]
+        """
+        label = ' '.join(part for part in (self.label, self.detail()) if part)
+        line = {'plan': '  ' * depth + ('-> ' if depth else '') + label,
+                'rows': round(self.rows), 'cost': round(self.cost, 2)}
+        if self.stats is not None:
+            line.update(actual_rows=self.stats.rows,
+                        files_opened=self.stats.files_opened,
+                        bytes_read=self.stats.bytes_read,
+                        time_ms=round(self.stats.time * 1000, 3))
+        return [line] + [child_line for child in self.children
+                         for child_line in child.explain(depth + 1)]
+
+
+class Scan(PlanNode):
+    """ Base class of the nodes reading rows from a table
+
+    The conditions are pushed down into the read (see
+    :meth:`DbManager.scan_rows`): only the matching rows are produced
+    and their other columns are only read for them
+    """
+
+    def __init__(self, table, storage, columns, rows, cost, lazy=True,
+                 rowid_range=None, rowids=None, typed=False,
+                 conditions_list=None, predicate=None, readahead=None, order=None):
+        """
+        :param str table: Name of the table
+        :param str storage: The storage of the table
+        :param list[str] columns: Names of the columns read (None for all)
+        :param float rows: Estimated number of (matching) rows produced
+        :param bool lazy: Whether to read lazily decoded records
+        :param range rowid_range: Only the rows whose rowid is in this range
+        :param list[int]|range rowids: Only the rows with these rowids
+        :param bool typed: Whether to decode the cells into values
+        :param ConditionList conditions_list: The conditions the rows
+            have to match (None for all the rows)
+        :param predicate: The conditions compiled for the table
+            (see :meth:`ConditionList.compile`)
+        :param int readahead: Maximum number of rows read ahead by a
+            parallel scan (defaults to the manager's `scan_readahead`)
+        :param tuple order: The column and the direction (whether
+            descending) the rowids are sorted by, if they are
+        """
+        super().__init__(rows, cost)
+        self.table = table
+        self.storage = storage
+        self.columns = columns
+        self.lazy = lazy
+        self.rowid_range = rowid_range
+        self.rowids = rowids
+        self.typed = typed
+        self.conditions_list = conditions_list
+        self.predicate = predicate
+        if conditions_list is not None and predicate is None:
+            self.predicate = conditions_list.match
+        self.readahead = readahead
+        self.order = order
+
+    def source(self):
+        """ Describes the rows read (e.g. the table)
+
+        :rtype: str
+        """
+        return f'on {self.table} ({self.storage})'
+
+    def detail(self):
+        detail = self.source()
+        if self.order is not None:
+            col_name, descending = self.order
+            detail += f' order by {col_name} {"desc" if descending else "asc"}'
+        if self.conditions_list is not None:
+            comparisons = ' '.join(f'{comparison.left.name}{comparison.op}{comparison.right.value!r}'
+                                   for comparison in self.conditions_list.comparisons)
+            detail += f' filter op:{self.conditions_list.comp_type} {comparisons}'
+        return detail
+
+    def _execute(self, db_manager):
+        options = {}
+        if self.conditions_list is not None:
+            options.update(predicate=self.predicate,
+                           predicate_columns=condition_columns(self.conditions_list))
+        if self.readahead is not None:
+            options.update(readahead=self.readahead)
+        return db_manager.scan_rows(table=self.table, columns=self.columns, lazy=self.lazy,
+                                    rowid_range=self.rowid_range, rowids=self.rowids,
+                                    typed=self.typed, **options)
+
+
+class SeqScan(Scan):
+    """ Reads all the rows of a table (or of a range of rowids) """
+    label = 'Seq Scan'
+
+    def source(self):
+        source = super().source()
+        if self.rowid_range is not None:
+            source += f' rowids {self.rowid_range.start}..{self.rowid_range.stop - 1}'
+        return source
+
+
+class RowidScan(Scan):
+    """ Reads the rows of a table whose rowids match `_rowid` comparisons """
+    label = 'Rowid Scan'
+
+    def source(self):
+        if isinstance(self.rowids, range):
+            return f'{super().source()} rowids {self.rowids.start}..{self.rowids.stop - 1}'
+        return f'{super().source()} {len(self.rowids)} rowids'
+
+
+class IndexScan(Scan):
+    """ Reads the rows of a table found with its indexes """
+    label = 'Index Scan'
+
+    def __init__(self, *args, using=(), **kwargs):
+        """
+        :param list[str] using: Names of the indexes used
+        """
+        super().__init__(*args, **kwargs)
+        self.using = list(using)
+
+    def source(self):
+        return f'{super().source()} using {", ".join(self.using)}'
+
+
+class Project(PlanNode):
+    """ Turns the rows into query results (with the projected columns) """
+    label = 'Project'
+
+    def __init__(self, projection, child, project):
+        """
+        :param list[str] projection: The projected columns (or '*')
+        :param PlanNode child: The node producing the rows
+        :param project: Turns a row into a result
+        """
+        super().__init__(child.rows, child.cost, [child])
+        self.projection = projection
+        self.project = project
+
+    def detail(self):
+        return ','.join(self.projection)
+
+    def _execute(self, db_manager):
+        return (self.project(row) for row in self.children[0].execute(db_manager))
+
+
+class Gather(PlanNode):
+    """ Executes a plan with a pool of processes, each one on a partition
+    (range of rowids) of the table, and gathers their results
+
+    The child is the plan every process executes; it is executed (and
+    measured) by the processes, so it is never analyzed
+    """
+    label = 'Gather'
+
+    def __init__(self, partitions, processes, child, run):
+        """
+        :param list[range] partitions: The rowids of the partitions
+        :param int processes: Number of processes
+        :param PlanNode child: The plan executed on every partition
+        :param run: Executes the plan on the partitions and iterates
+            over the results, given the manager and the partitions
+        """
+        super().__init__(child.rows, child.cost / max(min(processes, len(partitions)), 1),
+                         [child])
+        self.partitions = partitions
+        self.processes = processes
+        self.run = run
+
+    def detail(self):
+        return f'{len(self.partitions)} partitions on {self.processes} processes'
+
+    def analyze(self):
+        self.stats = NodeStats()
+
+    def _execute(self, db_manager):
+        return self.run(db_manager, self.partitions)
+
+
+class Sort(PlanNode):
+    """ Sorts the rows by a column (see :func:`external_sort`), spilling
+    sorted runs to the database dir beyond the manager's `sort_memory`
+    """
+    label = 'Sort'
+
+    def __init__(self, col_name, descending, child):
+        """
+        :param str col_name: Name of the column
+        :param bool descending: Whether to sort in descending order
+        :param PlanNode child: The node producing the rows
+        """
+        super().__init__(child.rows, child.cost, [child])
+        self.col_name = col_name
+        self.descending = descending
+
+    def detail(self):
+        return f'by {self.col_name} {"desc" if self.descending else "asc"}'
+
+    def _execute(self, db_manager):
+        # the (lazily decoded) records are decoded to be kept
+        rows = (dict(row) for row in self.children[0].execute(db_manager))
+        return external_sort(rows, key=operator.itemgetter(self.col_name),
+                             reverse=self.descending, memory=db_manager.sort_memory,
+                             spill_path=db_manager.db_path)
+
+
+class TopK(PlanNode):
+    """ Sorts the rows by a column, only keeping the first `k` of them
+    (see :func:`top_k`), e.g. for ``order by age limit 10``
+    """
+    label = 'Top-K Sort'
+
+    def __init__(self, col_name, descending, k, child):
+        """
+        :param str col_name: Name of the column
+        :param bool descending: Whether to sort in descending order
+        :param int k: Number of rows kept
+        :param PlanNode child: The node producing the rows
+        """
+        super().__init__(min(child.rows, k), child.cost, [child])
+        self.col_name = col_name
+        self.descending = descending
+        self.k = k
+
+    def detail(self):
+        return f'{self.k} by {self.col_name} {"desc" if self.descending else "asc"}'
+
+    def _execute(self, db_manager):
+        return iter(top_k(self.children[0].execute(db_manager),
+                          operator.itemgetter(self.col_name), self.k, reverse=self.descending))
+
+
+class HashAggregate(PlanNode):
+    """ Groups the rows by columns and computes aggregates of every group
+    (see :func:`hash_aggregate`), spilling groups to the database dir
+    beyond the manager's `aggregate_memory`
+    """
+    label = 'Hash Aggregate'
+
+    def __init__(self, group_by, aggregates, child):
+        """
+        :param list[str] group_by: Names of the group columns
+        :param list[Aggregate] aggregates: The aggregates
+        :param PlanNode child: The node producing the rows
+        """
+        rows = max(child.rows * GROUPS, 1) if group_by else 1
+        super().__init__(rows, child.cost, [child])
+        self.group_by = group_by
+        self.aggregates = aggregates
+
+    def detail(self):
+        detail = ','.join(aggregate.name for aggregate in self.aggregates)
+        if self.group_by:
+            detail += f' by {",".join(self.group_by)}'
+        return detail
+
+    def _execute(self, db_manager):
+        return hash_aggregate(self.children[0].execute(db_manager), self.group_by,
+                              self.aggregates, memory=db_manager.aggregate_memory,
+                              spill_path=db_manager.db_path)
+
+
+class Count(PlanNode):
+    """ Counts the rows (e.g. for ``count(*)`` without groups), pulling
+    them through without keeping or decoding them
+    """
+    label = 'Count'
+
+    def __init__(self, names, child):
+        """
+        :param list[str] names: Names of the counts in the result
+        :param PlanNode child: The node producing the rows
+        """
+        super().__init__(1, child.cost, [child])
+        self.names = names
+
+    def detail(self):
+        return ','.join(self.names)
+
+    def _execute(self, db_manager):
+        count = sum(1 for _ in self.children[0].execute(db_manager))
+        yield dict.fromkeys(self.names, count)
+
+
+class MetaCount(PlanNode):
+    """ Counts the rows of a table from its metadata, without reading them """
+    label = 'Meta Count'
+
+    def __init__(self, table, names):
+        """
+        :param str table: Name of the table
+        :param list[str] names: Names of the counts in the result
+        """
+        super().__init__(1, 1)
+        self.table = table
+        self.names = names
+
+    def detail(self):
+        return f'{",".join(self.names)} on {self.table}'
+
+    def _execute(self, db_manager):
+        yield dict.fromkeys(self.names, db_manager.get_table_meta(self.table).count)
+
+
+def qualify(table, row):
+    """ Turns a row of a table into a row of a join, whose keys are
+    qualified by the table (e.g. ``users.name``)
+
+    :param str table: Name of the table
+    :param Mapping row: The row
+    :rtype: dict
+    """
+    return {f'{table}.{key}': value for key, value in row.items()}
+
+
+class HashJoin(PlanNode):
+    """ Joins the rows of two tables whose columns are equal: the rows of
+    the build side (the smaller one) are kept in a hash table by their
+    column, which the rows of the probe side are streamed through
+    """
+    label = 'Hash Join'
+
+    def __init__(self, build, build_col, probe, probe_col, rows):
+        """
+        :param PlanNode build: The node producing the rows kept in memory
+        :param str build_col: The joined column of the build side
+        :param PlanNode probe: The node producing the streamed rows
+        :param str probe_col: The joined column of the probe side
+        :param float rows: Estimated number of joined rows
+        """
+        super().__init__(rows, build.cost + probe.cost, [build, probe])
+        self.build_col = build_col
+        self.probe_col = probe_col
+
+    def detail(self):
+        build, probe = self.children
+        return (f'on {build.scan().table}.{self.build_col}={probe.scan().table}.{self.probe_col}'
+                f' build {build.scan().table}')
+
+    def _execute(self, db_manager):
+        build, probe = self.children
+        build_table, probe_table = build.scan().table, probe.scan().table
+
+        hashed = {}
+        for row in build.execute(db_manager):
+            hashed.setdefault(row[self.build_col], []).append(qualify(build_table, row))
+        if not hashed:
+            return
+
+        for row in probe.execute(db_manager):
+            matches = hashed.get(row[self.probe_col])
+            if matches:
+                probe_row = qualify(probe_table, row)
+                for match in matches:
+                    yield {**match, **probe_row}
+
+
+class IndexJoin(PlanNode):
+    """ Joins the rows of two tables whose columns are equal by looking
+    up, for every row of the outer side, the rows of the inner table in
+    an index of its column (or by rowid, when it is `_rowid`)
+
+    The inner node is a scan which is executed once per outer row, with
+    the rowids found (so, once analyzed, it measures all the lookups)
+    """
+    label = 'Index Nested Loop Join'
+
+    def __init__(self, outer, outer_col, inner, inner_col):
+        """
+        :param PlanNode outer: The node producing the outer rows
+        :param str outer_col: The joined column of the outer side
+        :param Scan inner: The scan fetching the rows of the inner table
+        :param str inner_col: The joined column of the inner table
+        """
+        super().__init__(outer.rows * inner.rows, outer.cost + outer.rows * inner.cost,
+                         [outer, inner])
+        self.outer_col = outer_col
+        self.inner_col = inner_col
+
+    def detail(self):
+        outer, inner = self.children
+        return f'on {outer.scan().table}.{self.outer_col}={inner.table}.{self.inner_col}'
+
+    def _lookup(self, db_manager, value):
+        if self.inner_col == '_rowid':
+            return [value]
+        return sorted(db_manager.index_lookup(self.children[1].table, self.inner_col,
+                                              [('=', value)]))
+
+    def _execute(self, db_manager):
+        outer, inner = self.children
+        for row in outer.execute(db_manager):
+            rowids = self._lookup(db_manager, row[self.outer_col])
+            if not rowids:
+                continue
+            outer_row = qualify(outer.scan().table, row)
+            inner.rowids = rowids
+            for match in inner.execute(db_manager):
+                yield {**outer_row, **qualify(inner.table, match)}
+
+
+class Limit(PlanNode):
+    """ Skips the first `offset` rows and stops after `limit` rows:
+    once it is done, no more rows are pulled from its child (so, e.g.,
+    no more row dirs are read)
+    """
+    label = 'Limit'
+
+    def __init__(self, limit, offset, child):
+        """
+        :param int limit: Maximum number of rows produced (None for all)
+        :param int offset: Number of rows skipped
+        :param PlanNode child: The node producing the rows
+        """
+        rows = max(child.rows - offset, 0)
+        if limit is not None:
+            rows = min(rows, limit)
+        # only the rows pulled from the child are read
+        pulled = 1.0 if limit is None or not child.rows else min((offset + limit) / child.rows, 1.0)
+        super().__init__(rows, child.cost * pulled, [child])
+        self.limit = limit
+        self.offset = offset
+
+    def detail(self):
+        parts = []
+        if self.limit is not None:
+            parts.append(str(self.limit))
+        if self.offset:
+            parts.append(f'offset {self.offset}')
+        return ' '.join(parts)
+
+    def _execute(self, db_manager):
+        rows = self.children[0].execute(db_manager)
+        stop = None if self.limit is None else self.offset + self.limit
+        try:
+            yield from itertools.islice(rows, self.offset, stop)
+        finally:
+            # stops the scans (e.g. the reads ahead of a parallel scan)
+            if hasattr(rows, 'close'):
+                rows.close()
+
+
+class Update(PlanNode):
+    """ Updates the rows (and produces them) """
+    label = 'Update'
+
+    def __init__(self, table, values, child):
+        """
+        :param str table: Name of the table
+        :param dict[str,str] values: The new cells of the rows
+        :param PlanNode child: The node producing the rows
+        """
+        super().__init__(child.rows, child.cost + child.rows * len(values), [child])
+        self.table = table
+        self.values = values
+
+    def detail(self):
+        return f'{self.table} set {" ".join(f"{key}={value}" for key, value in self.values.items())}'
+
+    def _execute(self, db_manager):
+        for row in self.children[0].execute(db_manager):
+            db_manager.update_row(table=self.table, rowid=row['_rowid'], new_row=self.values)
+            yield row
+
+
+class Delete(PlanNode):
+    """ Deletes the rows (and produces them) """
+    label = 'Delete'
+
+    def __init__(self, table, child):
+        """
+        :param str table: Name of the table
+        :param PlanNode child: The node producing the rows
+        """
+        super().__init__(child.rows, child.cost + child.rows, [child])
+        self.table = table
+
+    def detail(self):
+        return f'in {self.table}'
+
+    def _execute(self, db_manager):
+        for row in self.children[0].execute(db_manager):
+            db_manager.delete_row(table=self.table, rowid=row['_rowid'])
+            yield row
+
+
+def plan_scan(db_manager, table, columns, conditions_list, candidates=None, using=(),
+              lazy=True, rowid_range=None, typed=False, order=None):
+    """ Plans how the rows of a table matching conditions are read
+
+    The candidate rows (found by `_rowid` comparisons or indexes) are
+    fetched by rowid if that is estimated to be cheaper than a sequential
+    scan, which depends on the storage (e.g. reading a record of a
+    segment by offset costs as much as scanning 20 records); the
+    conditions are pushed down into the read, which only reads the
+    other columns of the matching rows (see :meth:`DbManager.scan_rows`)
+
+    :param DbManager db_manager: The manager of the current database
+    :param str table: Name of the table
+    :param list[str] columns: Names of the columns read (None for all)
+    :param ConditionList conditions_list: The conditions
+    :param list[int]|range candidates: Rowids of the rows which may match
+        (None if they are not known)
+    :param list[str] using: Names of the indexes which found the candidates
+    :param bool lazy: Whether to read lazily decoded records
+    :param range rowid_range: Only the rows whose rowid is in this range
+        are scanned (e.g. a partition)
+    :param bool typed: Whether to read records decoded into values
+    :param tuple order: The column and the direction (whether descending)
+        the candidates are sorted by (with an ordered index); they are
+        then fetched (in that order) whatever the cost
+    :rtype: PlanNode
+    """
+    schema = db_manager.get_table_schema(table_name=table)
+    meta = db_manager.get_table_meta(table)
+    storage = db_manager.get_table_storage(table)
+    # the fraction of the rowids which are live
+    density = meta.count / max(meta.next_rowid, 1)
+
+    filtered = {}
+    n_filter_columns = 0
+    n_columns = len(schema if columns is None else columns)
+    selectivity = 1.0
+    if conditions_list.comp_type:
+        filtered = dict(conditions_list=conditions_list,
+                        predicate=conditions_list.compile(schema, typed))
+        filter_columns = condition_columns(conditions_list)
+        n_filter_columns = len(filter_columns)
+        n_columns = len(set(schema if columns is None else columns) - set(filter_columns))
+        selectivity = estimate_selectivity(schema, conditions_list)
+
+    def read_cost(cost, rows, **kwargs):
+        # the other columns are only read for the matching rows, unless
+        # the records are read whole
+        if not filtered or storage == 'packed':
+            return cost(storage, n_filter_columns + n_columns, rows, **kwargs)
+        matched = min(rows, meta.count * selectivity)
+        return (cost(storage, n_filter_columns, rows, **kwargs)
+                + cost(storage, n_columns, matched, **kwargs))
+
+    rows = meta.count if rowid_range is None else len(rowid_range) * density
+    node = SeqScan(table, storage, columns, min(rows, meta.count * selectivity),
+                   read_cost(scan_cost, rows), lazy=lazy, rowid_range=rowid_range,
+                   typed=typed, **filtered)
+    if candidates is not None:
+        contiguous = isinstance(candidates, range)
+        rows = len(candidates) * density if contiguous else len(candidates)
+        cost = read_cost(fetch_cost, rows, contiguous=contiguous)
+        if cost < node.cost or order is not None:
+            if using:
+                node = IndexScan(table, storage, columns, min(rows, meta.count * selectivity),
+                                 cost, lazy=lazy, rowids=candidates, typed=typed,
+                                 using=using, order=order, **filtered)
+            else:
+                node = RowidScan(table, storage, columns, min(rows, meta.count * selectivity),
+                                 cost, lazy=lazy, rowids=candidates, typed=typed, **filtered)
+    return node
+
+
+def plan_join(db_manager, left, left_col, right, right_col):
+    """ Plans how the rows of two tables whose columns are equal are
+    joined, given how the rows of each table are read
+
+    The smaller side (by estimated rows) is the build side of a hash join
+    (see :class:`HashJoin`), unless the column of the larger side is
+    `_rowid` or has an index answering `=`: the rows of the smaller side
+    then look up the matching rows of the larger one (see
+    :class:`IndexJoin`), which are fetched with its conditions
+
+    :param DbManager db_manager: The manager of the current database
+    :param Scan left: The scan of the left table
+    :param str left_col: The joined column of the left table
+    :param Scan right: The scan of the right table
+    :param str right_col: The joined column of the right table
+    :rtype: PlanNode
+    """
+    small, small_col, large, large_col = left, left_col, right, right_col
+    if right.rows < left.rows:
+        small, small_col, large, large_col = right, right_col, left, left_col
+
+    # every row of the larger side is assumed to match a row of the
+    # smaller table (e.g. by a foreign key)
+    matches = large.rows / max(db_manager.get_table_meta(small.table).count, 1)
+
+    using = [name for name, info in db_manager.get_table_indexes(large.table).items()
+             if info.column == large_col and '=' in INDEX_KINDS[info.kind].ops]
+    if large_col != '_rowid' and not using:
+        return HashJoin(small, small_col, large, large_col, small.rows * matches)
+
+    rows = min(matches, 1) if large_col == '_rowid' else matches
+    n_columns = len(db_manager.get_table_schema(table_name=large.table)
+                    if large.columns is None else large.columns)
+    options = dict(lazy=large.lazy, rowids=[], typed=large.typed,
+                   conditions_list=large.conditions_list, predicate=large.predicate)
+    if using:
+        inner = IndexScan(large.table, large.storage, large.columns, rows,
+                          fetch_cost(large.storage, n_columns, rows), using=using, **options)
+    else:
+        inner = RowidScan(large.table, large.storage, large.columns, rows,
+                          fetch_cost(large.storage, n_columns, rows), **options)
+    return IndexJoin(small, small_col, inner, large_col)
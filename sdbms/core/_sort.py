@@ -0,0 +1,112 @@
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+from ._storage import IO_STATS
+
+SPILL_PREFIX = '.sort-'
+
+
+def row_size(row):
+    """ Estimates the memory (in bytes) taken by a row
+
+    :param dict row: The row
+    :rtype: int
+    """
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+
+
+def _spill(rows, spill_dir):
+    """ Writes a sorted run of rows to a new file of the spill dir
+
+    :return: the path of the file
+    :rtype: str
+    """
+    fd, path = tempfile.mkstemp(dir=spill_dir)
+    with open(fd, 'wb') as run:
+        for row in rows:
+            pickle.dump(row, run, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def read_run(path):
+    """ Iterates over the rows of a spilled run """
+    with open(path, 'rb') as run:
+        IO_STATS.read(os.fstat(run.fileno()).st_size, files=1)
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                return
+
+
+def external_sort(rows, key, reverse=False, memory=32 * 2 ** 20, spill_path=None,
+                  fan_in=64):
+    """ Sorts rows which may not fit in memory (external merge sort)
+
+    The rows are sorted in memory in runs of about `memory` bytes; the
+    runs are spilled (pickled) to the files of a temporary dir under
+    `spill_path` and then merged, at most `fan_in` at a time. The dir
+    is removed once the sorted rows are consumed (or the iteration is
+    stopped). The sort is stable, like `sorted`
+
+    :param Iterable[dict] rows: The rows
+    :param key: Function returning the sort key of a row
+    :param bool reverse: Whether to sort in descending order
+    :param int memory: Memory budget (in bytes, roughly) of a run
+    :param str spill_path: The dir where runs are spilled
+        (e.g. the database dir)
+    :param int fan_in: Maximum number of runs merged at once
+    :rtype: Iterator[dict]
+    """
+    assert fan_in > 1
+
+    spill_dir = None
+    try:
+        runs = []
+        run, size = [], 0
+        for row in rows:
+            run.append(row)
+            size += row_size(row)
+            if size >= memory:
+                if spill_dir is None:
+                    spill_dir = tempfile.mkdtemp(prefix=SPILL_PREFIX, dir=spill_path)
+                run.sort(key=key, reverse=reverse)
+                runs.append(_spill(run, spill_dir))
+                run, size = [], 0
+        run.sort(key=key, reverse=reverse)
+
+        # the (earlier) runs of a merge come first, so it stays stable
+        while len(runs) + 1 > fan_in:
+            merged = []
+            for start in range(0, len(runs), fan_in):
+                group = runs[start:start + fan_in]
+                merged.append(_spill(heapq.merge(*map(read_run, group), key=key,
+                                                 reverse=reverse), spill_dir))
+                for path in group:
+                    os.remove(path)
+            runs = merged
+
+        yield from heapq.merge(*map(read_run, runs), run, key=key, reverse=reverse)
+    finally:
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def top_k(rows, key, k, reverse=False):
+    """ Returns the first `k` rows in sorted order, keeping at most `k`
+    rows in memory (in a bounded heap, so in O(n log k) time). Like
+    `sorted`, it is stable
+
+    :param Iterable[Mapping] rows: The rows
+    :param key: Function returning the sort key of a row
+    :param int k: Number of rows returned
+    :param bool reverse: Whether to sort in descending order
+    :rtype: list[Mapping]
+    """
+    if reverse:
+        return heapq.nlargest(k, rows, key=key)
+    return heapq.nsmallest(k, rows, key=key)
@@ -0,0 +1,1108 @@
+import mmap
+import os
+import shutil
+import struct
+import threading
+from collections import deque, namedtuple
+from collections.abc import Mapping
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+STORAGE = '.storage'
+DEFAULT_STORAGE = 'dirs'
+
+
+class IOStats(object):
+    """ Counters of the files opened and the bytes read by the storages
+    while reading rows (a memory-mapped file counts as read whole)
+
+    The counters are process-wide: a reader (e.g. `explain analyze`)
+    computes the differences before and after reading
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files_opened = 0
+        self.bytes_read = 0
+
+    def read(self, size, files=0):
+        """ Counts some bytes read and files opened
+
+        :param int size: Number of bytes read
+        :param int files: Number of files opened
+        """
+        with self._lock:
+            self.files_opened += files
+            self.bytes_read += size
+
+
+IO_STATS = IOStats()
+
+
+def map_file(path, size=None):
+    """ Memory-maps (read only) the first size bytes of a file
+
+    :param str path: Path of the file
+    :param int size: How many bytes to map (defaults to the file size)
+    :return: a view over the mapped bytes
+    :rtype: memoryview
+    """
+    with open(path, 'rb') as fd:
+        size = os.fstat(fd.fileno()).st_size if size is None else size
+        IO_STATS.read(size, files=1)
+        if not size:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(fd.fileno(), size, access=mmap.ACCESS_READ))
+
+
+def fsync_path(path):
+    """ Flushes a file or a dir (i.e. its entries) to disk
+
+    :param str path: Path of the file or dir
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class LazyRecord(Mapping):
+    """ Read-only record whose cells are decoded only when accessed
+
+    Cells can be given as `memoryview` slices of the table's (mapped)
+    files; such a cell is decoded into a `str` the first time it is
+    accessed, so the cells nobody reads are never turned into strings
+    """
+    __slots__ = ('_cells', )
+
+    def __init__(self, cells):
+        """
+        :param dict[str,str|memoryview] cells: The cells of the record
+        """
+        self._cells = cells
+
+    def __getitem__(self, key):
+        value = self._cells[key]
+        if type(value) is memoryview:
+            value = self._cells[key] = str(value, 'utf-8')
+        return value
+
+    def __contains__(self, key):
+        return key in self._cells
+
+    def __iter__(self):
+        return iter(self._cells)
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self)})'
+
+
+class RowFilter(namedtuple('RowFilter', 'columns, match')):
+    """ Predicate pushed down into a scan: the columns it reads and the
+    function matching a record holding (at least) those columns and
+    the '_rowid'; the other columns are only read for the matching rows
+    """
+
+    def read_columns(self, schema, columns=None):
+        """ Returns the columns read for a scan filtered by the predicate:
+        the ones of the predicate first, then the other ones requested
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param list[str] columns: Names of the columns requested (defaults
+            to all the columns of the schema)
+        :rtype: list[str]
+        """
+        columns = schema if columns is None else columns
+        return list(self.columns) + [col_name for col_name in columns
+                                     if col_name not in self.columns]
+
+
+class TableStorage(object):
+    """ Base class for the ways a table's rows are laid out on disk
+
+    A storage object is bound to a table dir and knows how to create,
+    read, update and delete the rows found inside it; the `.schema` file
+    is still managed by :class:`DbManager` and passed in on every call
+
+    Cell values are handled as plaintext strings, exactly as they
+    are written by the commands (e.g. ``'"John"'``, ``'23'``, ``'False'``)
+    """
+    name = None
+
+    LOAD_BATCH_SIZE = 4096
+
+    def __init__(self, table_path):
+        """
+        :param str table_path: Absolute path of a table dir
+        """
+        self.table_path = table_path
+
+    def create(self, schema):
+        """ Creates the (empty) data files needed by the layout
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        """
+
+    def next_rowid(self):
+        """ Returns the rowid the next inserted row should get
+
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def insert(self, schema, rowid, row):
+        """ Stores a new row identified by rowid
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param int rowid: Unique identifier of the new row
+        :param dict[str,str] row: Row to be inserted
+        """
+        raise NotImplementedError
+
+    def insert_many(self, schema, first_rowid, rows):
+        """ Stores new rows identified by consecutive rowids
+
+        Storages override this to write the rows with fewer syscalls;
+        the rows are not guaranteed to be durable until :meth:`sync`
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param int first_rowid: Unique identifier of the first new row
+        :param list[dict[str,str]] rows: Rows to be inserted
+        """
+        for rowid, row in enumerate(rows, first_rowid):
+            self.insert(schema, rowid, row)
+
+    def load(self, schema, records):
+        """ Stores records (in rowid order) into the new, empty storage
+        keeping their rowids (e.g. when a table is compacted)
+
+        Runs of consecutive rowids are written with :meth:`insert_many`
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param Iterable[dict[str,str]] records: Records containing the '_rowid' key
+        """
+        run = []
+        for record in records:
+            record = dict(record)
+            rowid = record.pop('_rowid')
+            if run and (rowid != run_start + len(run) or len(run) >= self.LOAD_BATCH_SIZE):
+                self.insert_many(schema, run_start, run)
+                run = []
+            if not run:
+                run_start = rowid
+            run.append(record)
+        if run:
+            self.insert_many(schema, run_start, run)
+
+    def sync(self):
+        """ Makes the rows written so far durable (flushes them to disk) """
+
+    def scan(self, schema, columns=None, lazy=False, rowid_range=None, row_filter=None):
+        """ Iterates over all the live records of the table
+
+        In lazy mode, storages keeping the rows in contiguous files
+        memory-map them and yield :class:`LazyRecord` objects whose cells
+        are decoded on access; the other storages yield plain dicts
+
+        With a row filter only the matching records are yielded (with
+        the filter's columns too); storages reading the cells of a row
+        separately read the filter's columns first and the others only
+        if the row matches
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param list[str] columns: Names of the columns to be read
+            (defaults to all the columns of the schema)
+        :param bool lazy: Whether to yield lazily decoded records
+        :param range rowid_range: Only the rows whose rowid is
+            in this range are read (defaults to all of them)
+        :param RowFilter row_filter: The predicate the records have to match
+        :return: record containing the '_rowid' key
+        :rtype: Iterator[dict[str, str]]
+        """
+        raise NotImplementedError
+
+    def fetch(self, schema, rowids, columns=None, lazy=False, row_filter=None):
+        """ Iterates over the live records of some rows (e.g. found
+        with an index) reading only those rows
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param Iterable[int] rowids: Unique identifiers of the rows
+            (the ones of missing rows are skipped)
+        :param list[str] columns: Names of the columns to be read
+        :param bool lazy: Whether to yield lazily decoded records
+        :param RowFilter row_filter: The predicate the records have to match
+        :return: record containing the '_rowid' key
+        :rtype: Iterator[dict[str, str]]
+        """
+        for rowid in rowids:
+            yield from self.scan(schema, columns, lazy, range(rowid, rowid + 1), row_filter)
+
+    def scan_parallel(self, schema, columns=None, lazy=False, rowid_range=None,
+                      workers=4, ordered=True, readahead=None, row_filter=None):
+        """ Iterates over all the live records of the table reading
+        several rows at once with a pool of threads
+
+        Storages keeping the rows in contiguous files are read
+        sequentially anyway, so by default this is just :meth:`scan`
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param list[str] columns: Names of the columns to be read
+        :param bool lazy: Whether to yield lazily decoded records
+        :param range rowid_range: Only the rows whose rowid is
+            in this range are read
+        :param int workers: Number of threads reading rows
+        :param bool ordered: Whether to yield the records in the order
+            of a serial scan or as soon as they are read
+        :param int readahead: Maximum number of rows being read
+            ahead of the consumer (defaults to 4 per worker)
+        :param RowFilter row_filter: The predicate the records have to match
+        :return: record containing the '_rowid' key
+        :rtype: Iterator[dict[str, str]]
+        """
+        yield from self.scan(schema, columns, lazy, rowid_range, row_filter)
+
+    def exists(self, schema, rowid):
+        """ Checks whether a live row is identified by rowid
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param int rowid: Unique identifier of the row
+        :rtype: bool
+        """
+        rows = self.scan(schema, columns=[], rowid_range=range(rowid, rowid + 1))
+        return next(rows, None) is not None
+
+    def update(self, schema, rowid, new_row):
+        """ Overwrites some (or all) of the cells of a row
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param int rowid: Unique identifier of the row
+        :param dict[str,str] new_row: The new row data
+        """
+        raise NotImplementedError
+
+    def delete(self, rowid):
+        """ Deletes a row identified by rowid
+
+        :param int rowid: Unique identifier of the row
+        """
+        raise NotImplementedError
+
+    def add_column(self, schema, col_name, col_type):
+        """ Adds an empty column to every row
+
+        :param dict[str,str] schema: Schema before adding the column
+        :param str col_name: Name of the column to be added
+        :param str col_type: Type of the column to be added
+        """
+        raise NotImplementedError
+
+    def del_column(self, schema, col_name):
+        """ Removes a column from every row
+
+        :param dict[str,str] schema: Schema before deleting the column
+        :param str col_name: Name of the column
+        """
+        raise NotImplementedError
+
+
+class DirStorage(TableStorage):
+    """ Directory-per-row layout
+
+    Each row is an autoincremented named dir from 0 to n and each
+    value for a cell is saved in a plaintext column file named
+    `<col_name>.<col_type>` inside it
+    """
+    name = 'dirs'
+
+    def __init__(self, table_path):
+        super().__init__(table_path)
+        # rowids of the rows written since the last sync
+        self._unsynced = set()
+
+    @staticmethod
+    def row_dirs(table_path):
+        """ Iterates over the row directories (abs path) of a table dir
+
+        :param str table_path: Absolute path of a table dir
+        :return: row directory absolute path
+        :rtype: Iterator[str]
+        """
+        for row_dirname in os.listdir(table_path):
+            row_dir = os.path.join(table_path, row_dirname)
+            if os.path.isdir(row_dir):
+                yield row_dir
+
+    def next_rowid(self):
+        row_dirs = list(self.row_dirs(self.table_path))
+        try:
+            return max([int(os.path.basename(row_dir))
+                        for row_dir in row_dirs]) + 1
+        except Exception:
+            return 0
+
+    def insert(self, schema, rowid, row):
+        new_row_dir = os.path.join(self.table_path, str(rowid))
+        os.mkdir(new_row_dir)
+
+        for col_name, col_type in schema.items():
+            col_filename = f'{col_name}.{col_type}'
+            col_file = os.path.join(new_row_dir, col_filename)
+            with open(col_file, 'w') as fd:
+                fd.write(row[col_name])
+        self._unsynced.add(rowid)
+
+        assert os.path.isdir(new_row_dir)
+
+    def sync(self):
+        rowids, self._unsynced = self._unsynced, set()
+        for rowid in sorted(rowids):
+            row_dir = os.path.join(self.table_path, str(rowid))
+            if not os.path.isdir(row_dir):
+                continue
+            for filename in os.listdir(row_dir):
+                fsync_path(os.path.join(row_dir, filename))
+            fsync_path(row_dir)
+        fsync_path(self.table_path)
+
+    def _read_cells(self, schema, columns, row_dir, record):
+        """ Reads the column files of a row dir into a record """
+        for col_name in columns:
+            col_type = schema[col_name]
+            col_filename = f'{col_name}.{col_type}'
+            col_file = os.path.join(row_dir, col_filename)
+            with open(col_file) as fd:
+                record[col_name] = fd.read()
+            IO_STATS.read(len(record[col_name]), files=1)
+
+    def _read_row(self, schema, columns, row_dir, row_filter=None):
+        """ Reads the column files of a row dir into a record (the ones
+        of the row filter first: None is returned if the row does not
+        match and the other files are not read) """
+        record = {'_rowid': int(os.path.basename(row_dir))}
+        if row_filter is not None:
+            self._read_cells(schema, row_filter.columns, row_dir, record)
+            if not row_filter.match(record):
+                return None
+            columns = [col_name for col_name in columns if col_name not in record]
+        self._read_cells(schema, columns, row_dir, record)
+        return record
+
+    def _scan_row_dirs(self, rowid_range):
+        """ Iterates over the row dirs whose rowid is in rowid_range
+        (or all of them) """
+        for row_dir in self.row_dirs(self.table_path):
+            if rowid_range is None or int(os.path.basename(row_dir)) in rowid_range:
+                yield row_dir
+
+    def scan(self, schema, columns=None, lazy=False, rowid_range=None, row_filter=None):
+        columns = schema if columns is None else columns
+        for row_dir in self._scan_row_dirs(rowid_range):
+            record = self._read_row(schema, columns, row_dir, row_filter)
+            if record is not None:
+                yield record
+
+    def fetch(self, schema, rowids, columns=None, lazy=False, row_filter=None):
+        columns = schema if columns is None else columns
+        for rowid in rowids:
+            row_dir = os.path.join(self.table_path, str(rowid))
+            if os.path.isdir(row_dir):
+                record = self._read_row(schema, columns, row_dir, row_filter)
+                if record is not None:
+                    yield record
+
+    def scan_parallel(self, schema, columns=None, lazy=False, rowid_range=None,
+                      workers=4, ordered=True, readahead=None, row_filter=None):
+        # reading a row is a few small open()/read() calls which are
+        # latency bound, so they are fanned out to a pool of threads
+        columns = schema if columns is None else columns
+        readahead = max(readahead or 4 * workers, 1)
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for row_dir in self._scan_row_dirs(rowid_range):
+                    pending.append(executor.submit(self._read_row, schema,
+                                                   columns, row_dir, row_filter))
+                    if len(pending) >= readahead:
+                        yield from self._drain(pending, ordered)
+                while pending:
+                    yield from self._drain(pending, ordered)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _drain(pending, ordered):
+        """ Yields the result of the oldest pending read (ordered)
+        or of every read finished so far (unordered) """
+        # the reads of rows not matching a row filter return None
+        if ordered:
+            record = pending.popleft().result()
+            if record is not None:
+                yield record
+            return
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in [future for future in pending if future in done]:
+            pending.remove(future)
+            record = future.result()
+            if record is not None:
+                yield record
+
+    def exists(self, schema, rowid):
+        return os.path.isdir(os.path.join(self.table_path, str(rowid)))
+
+    def update(self, schema, rowid, new_row):
+        row_dir = os.path.join(self.table_path, str(rowid))
+
+        for col_name, col_value in new_row.items():
+            col_type = schema[col_name]
+            col_filename = f'{col_name}.{col_type}'
+            col_file = os.path.join(row_dir, col_filename)
+
+            with open(col_file, 'w') as fd:
+                fd.write(col_value)
+        self._unsynced.add(rowid)
+
+        assert os.path.isfile(col_file)
+
+    def delete(self, rowid):
+        row_dir = os.path.join(self.table_path, str(rowid))
+        shutil.rmtree(row_dir)
+        assert not os.path.exists(row_dir)
+
+    def add_column(self, schema, col_name, col_type):
+        col_filename = f'{col_name}.{col_type}'
+        for row_dir in self.row_dirs(self.table_path):
+            col_file = os.path.join(row_dir, col_filename)
+            open(col_file, 'w').close()
+            assert os.path.exists(col_file)
+
+    def del_column(self, schema, col_name):
+        col_type = schema[col_name]
+        col_filename = f'{col_name}.{col_type}'
+        for row_dir in self.row_dirs(self.table_path):
+            col_file = os.path.join(row_dir, col_filename)
+            os.remove(col_file)
+            assert not os.path.exists(col_file)
+
+
+class SegmentStorage(TableStorage):
+    """ Packed append-only segment layout
+
+    All the rows of a table live in a few segment files
+    (`000000.seg`, `000001.seg`, ...) which are only ever appended to::
+
+        users/
+            .schema
+            .storage
+            000000.seg
+
+    Each record is a header ``<kind:u8><rowid:u64><length:u32>``
+    followed by `length` bytes of payload; the payload of a `put` record
+    is every cell (in schema order) prefixed by its u32 length,
+    while a `del` record (tombstone) has no payload
+
+    Updates append a new `put` record for the same rowid and deletes
+    append a tombstone; the latest record of a rowid wins. The offset of
+    the live record of each rowid is kept in memory and caught up
+    incrementally by reading only the headers appended since the last call
+    """
+    name = 'packed'
+
+    SEGMENT_EXT = '.seg'
+    SEGMENT_MAX_SIZE = 64 * 1024 * 1024
+    READ_BUFFER_SIZE = 1024 * 1024
+
+    KIND_PUT = 0
+    KIND_DEL = 1
+
+    header = struct.Struct('<BQI')
+    length = struct.Struct('<I')
+
+    def __init__(self, table_path):
+        super().__init__(table_path)
+        self._offsets = {}
+        self._scanned = {}
+        self._max_rowid = -1
+
+    def _segments(self):
+        """ Returns the sorted names of the segment files of the table
+
+        :rtype: list[str]
+        """
+        return sorted(filename for filename in os.listdir(self.table_path)
+                      if filename.endswith(self.SEGMENT_EXT))
+
+    def _segment_path(self, segment):
+        return os.path.join(self.table_path, segment)
+
+    def _next_segment(self, segments):
+        """ Returns the name of the segment following the last one
+
+        :param list[str] segments: The sorted names of the segments
+        :rtype: str
+        """
+        number = int(segments[-1][:-len(self.SEGMENT_EXT)]) + 1 if segments else 0
+        return f'{number:06d}{self.SEGMENT_EXT}'
+
+    def _reset(self):
+        self._offsets = {}
+        self._scanned = {}
+        self._max_rowid = -1
+
+    def _catch_up(self):
+        """ Reads the record headers appended since the last call and
+        updates the in-memory rowid -> (segment, offset) map
+
+        If a segment disappeared or shrank (i.e. the table was rewritten)
+        the map is rebuilt from scratch
+        """
+        segments = self._segments()
+        sizes = {segment: os.path.getsize(self._segment_path(segment))
+                 for segment in segments}
+        if any(segment not in sizes or sizes[segment] < scanned
+               for segment, scanned in self._scanned.items()):
+            self._reset()
+
+        for segment in segments:
+            offset = self._scanned.get(segment, 0)
+            if offset == sizes[segment]:
+                continue
+            with open(self._segment_path(segment), 'rb') as fd:
+                IO_STATS.read(0, files=1)
+                fd.seek(offset)
+                while offset < sizes[segment]:
+                    kind, rowid, length = self.header.unpack(
+                        fd.read(self.header.size))
+                    IO_STATS.read(self.header.size)
+                    if kind == self.KIND_PUT:
+                        self._offsets[rowid] = (segment, offset)
+                    else:
+                        self._offsets.pop(rowid, None)
+                    self._max_rowid = max(self._max_rowid, rowid)
+                    offset += self.header.size + length
+                    fd.seek(offset)
+            self._scanned[segment] = offset
+
+    def _encode(self, schema, kind, rowid, row):
+        """ Encodes a row as a length-prefixed record
+
+        :rtype: bytes
+        """
+        payload = bytearray()
+        if kind == self.KIND_PUT:
+            for col_name in schema:
+                value = row[col_name].encode('utf-8')
+                payload += self.length.pack(len(value))
+                payload += value
+        return self.header.pack(kind, rowid, len(payload)) + bytes(payload)
+
+    def _split(self, schema, payload, columns=None):
+        """ Splits the payload of a `put` record into its cells
+        (slices of the payload) without decoding them
+
+        Cells missing from older records (written before `add_column`)
+        are returned as empty strings; only the cells of `columns`
+        (if given) are returned
+
+        :rtype: dict[str,bytes|memoryview|str]
+        """
+        values = []
+        offset = 0
+        while offset < len(payload):
+            (length, ) = self.length.unpack_from(payload, offset)
+            offset += self.length.size
+            values.append((offset, length))
+            offset += length
+
+        cells = {}
+        for i, col_name in enumerate(schema):
+            if columns is not None and col_name not in columns:
+                continue
+            if i < len(values):
+                offset, length = values[i]
+                cells[col_name] = payload[offset:offset + length]
+            else:
+                cells[col_name] = ''
+        return cells
+
+    def _decode(self, schema, payload, columns=None):
+        """ Decodes the payload of a `put` record into a record dict
+
+        :rtype: dict[str,str]
+        """
+        return {col_name: cell if isinstance(cell, str) else str(cell, 'utf-8')
+                for col_name, cell in self._split(schema, payload, columns).items()}
+
+    def _append(self, data):
+        """ Appends encoded records to the last segment (or a new one
+        if the last segment is full)
+        """
+        segments = self._segments()
+        if not segments or os.path.getsize(
+                self._segment_path(segments[-1])) >= self.SEGMENT_MAX_SIZE:
+            segment = self._next_segment(segments)
+            if segments:
+                # the full segment will not be written (and synced) anymore
+                self.sync()
+        else:
+            segment = segments[-1]
+
+        with open(self._segment_path(segment), 'ab') as fd:
+            fd.write(data)
+
+    def _read_record(self, schema, rowid, columns=None):
+        """ Reads the live record of a rowid with a single positioned read
+
+        :rtype: dict[str,str]
+        """
+        segment, offset = self._offsets[rowid]
+        with open(self._segment_path(segment), 'rb') as fd:
+            fd.seek(offset)
+            _, _, length = self.header.unpack(fd.read(self.header.size))
+            IO_STATS.read(self.header.size + length, files=1)
+            return self._decode(schema, fd.read(length), columns)
+
+    def create(self, schema):
+        open(self._segment_path(f'{0:06d}{self.SEGMENT_EXT}'), 'wb').close()
+
+    def next_rowid(self):
+        self._catch_up()
+        return self._max_rowid + 1
+
+    def insert(self, schema, rowid, row):
+        self._append(self._encode(schema, self.KIND_PUT, rowid, row))
+
+    def insert_many(self, schema, first_rowid, rows):
+        self._append(b''.join(self._encode(schema, self.KIND_PUT, rowid, row)
+                              for rowid, row in enumerate(rows, first_rowid)))
+
+    def sync(self):
+        segments = self._segments()
+        if segments:
+            with open(self._segment_path(segments[-1]), 'ab') as fd:
+                os.fsync(fd.fileno())
+
+    def _scan_mapped(self, schema, columns, live, ends):
+        """ Iterates over the live records of memory-mapped segments
+        yielding records whose cells are slices of the mapped segments
+        """
+        segments = {segment for segment, _ in live.values()}
+        for segment in sorted(segments):
+            data = map_file(self._segment_path(segment), ends[segment])
+            offset = 0
+            while offset < ends[segment]:
+                kind, rowid, length = self.header.unpack_from(data, offset)
+                start = offset + self.header.size
+                if kind == self.KIND_PUT and live.get(rowid) == (segment, offset):
+                    cells = self._split(schema, data[start:start + length], columns)
+                    cells['_rowid'] = rowid
+                    yield LazyRecord(cells)
+                offset = start + length
+
+    def scan(self, schema, columns=None, lazy=False, rowid_range=None, row_filter=None):
+        # a record is read whole, so a row filter is matched after reading it
+        if row_filter is not None:
+            columns = row_filter.read_columns(schema, columns)
+            records = self.scan(schema, columns, lazy, rowid_range)
+            yield from filter(row_filter.match, records)
+            return
+
+        self._catch_up()
+        if rowid_range is None:
+            live = dict(self._offsets)
+        else:
+            live = {rowid: offset for rowid, offset in self._offsets.items()
+                    if rowid in rowid_range}
+        ends = dict(self._scanned)
+
+        if lazy:
+            yield from self._scan_mapped(schema, columns, live, ends)
+            return
+
+        for segment in sorted({segment for segment, _ in live.values()}):
+            offset = 0
+            with open(self._segment_path(segment), 'rb',
+                      buffering=self.READ_BUFFER_SIZE) as fd:
+                IO_STATS.read(0, files=1)
+                while offset < ends[segment]:
+                    kind, rowid, length = self.header.unpack(
+                        fd.read(self.header.size))
+                    payload = fd.read(length)
+                    IO_STATS.read(self.header.size + length)
+                    if kind == self.KIND_PUT and live.get(rowid) == (segment, offset):
+                        record = self._decode(schema, payload, columns)
+                        record['_rowid'] = rowid
+                        yield record
+                    offset += self.header.size + length
+
+    def fetch(self, schema, rowids, columns=None, lazy=False, row_filter=None):
+        if row_filter is not None:
+            columns = row_filter.read_columns(schema, columns)
+            records = self.fetch(schema, rowids, columns, lazy)
+            yield from filter(row_filter.match, records)
+            return
+
+        self._catch_up()
+        offsets = dict(self._offsets)
+        for rowid in rowids:
+            if rowid in offsets:
+                record = self._read_record(schema, rowid, columns)
+                record['_rowid'] = rowid
+                yield record
+
+    def update(self, schema, rowid, new_row):
+        self._catch_up()
+        row = self._read_record(schema, rowid)
+        row.update(new_row)
+        self._append(self._encode(schema, self.KIND_PUT, rowid, row))
+
+    def delete(self, rowid):
+        self._catch_up()
+        assert rowid in self._offsets
+        self._append(self._encode(None, self.KIND_DEL, rowid, None))
+
+    def add_column(self, schema, col_name, col_type):
+        # older records are shorter than the new schema and decode the
+        # missing cells as empty, so there is nothing to rewrite
+        pass
+
+    def del_column(self, schema, col_name):
+        # the live rows are rewritten into a new segment following the
+        # old ones (so its records win over theirs) which is swapped in
+        # before the old segments are removed
+        new_schema = {name: col_type for name, col_type in schema.items()
+                      if name != col_name}
+        old_segments = self._segments()
+        new_segment = self._segment_path(self._next_segment(old_segments))
+        rewritten = f'{new_segment}.tmp'
+
+        with open(rewritten, 'wb') as fd:
+            for record in self.scan(schema):
+                rowid = record.pop('_rowid')
+                fd.write(self._encode(new_schema, self.KIND_PUT, rowid, record))
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(rewritten, new_segment)
+        fsync_path(self.table_path)
+
+        for segment in old_segments:
+            os.remove(self._segment_path(segment))
+        fsync_path(self.table_path)
+        self._reset()
+
+
+class ColumnStorage(TableStorage):
+    """ Columnar layout
+
+    Each column of the table is one contiguous file and the rowid of a
+    row is its position inside the column files::
+
+        users/
+            .schema
+            .storage
+            .live            (1 byte per row: 1 = live, 0 = deleted)
+            age.int.col      (8 bytes per row: signed little-endian int)
+            employed.bool.col (1 byte per row)
+            name.str.col     (the cells' bytes, appended)
+            name.str.off     (12 bytes per row: u64 offset, u32 length)
+
+    Empty cells (e.g. created by `add_column`) are stored as
+    `INT_NULL` for ints and `BOOL_NULL` for bools; fixed-width cells are
+    overwritten in place on update while `str` cells are appended to the
+    data file and their offsets entry is overwritten
+
+    Reading a subset of the columns only opens the files of those columns
+    """
+    name = 'columns'
+
+    LIVE = '.live'
+    COLUMN_EXT = '.col'
+    OFFSETS_EXT = '.off'
+    BATCH_SIZE = 4096
+
+    INT_NULL = -2 ** 63
+    BOOL_NULL = 2
+
+    fixed = {
+        'int': struct.Struct('<q'),
+        'bool': struct.Struct('<B'),
+    }
+    offsets = struct.Struct('<QI')
+
+    def _column_path(self, col_name, col_type, ext=COLUMN_EXT):
+        return os.path.join(self.table_path, f'{col_name}.{col_type}{ext}')
+
+    def _live_path(self):
+        return os.path.join(self.table_path, self.LIVE)
+
+    def _encode_fixed(self, col_type, value):
+        """ Encodes a plaintext cell of a fixed-width column
+
+        :rtype: bytes
+        """
+        if col_type == 'int':
+            return self.fixed[col_type].pack(
+                self.INT_NULL if value == '' else int(value))
+        if value == '':
+            return self.fixed[col_type].pack(self.BOOL_NULL)
+        return self.fixed[col_type].pack(value == 'True')
+
+    def _decode_fixed(self, col_type, data):
+        """ Decodes a fixed-width cell back into its plaintext form
+
+        :rtype: str
+        """
+        (value, ) = self.fixed[col_type].unpack(data)
+        if col_type == 'int':
+            return '' if value == self.INT_NULL else str(value)
+        return '' if value == self.BOOL_NULL else str(bool(value))
+
+    def _write_cells(self, schema, position, row):
+        """ Writes the cells of row at a position in the column files
+
+        Writing at the position right after the last row appends the cells
+        """
+        for col_name, value in row.items():
+            col_type = schema[col_name]
+            if col_type in self.fixed:
+                width = self.fixed[col_type].size
+                with open(self._column_path(col_name, col_type), 'r+b') as fd:
+                    fd.seek(position * width)
+                    fd.write(self._encode_fixed(col_type, value))
+            else:
+                data = value.encode('utf-8')
+                with open(self._column_path(col_name, col_type), 'ab') as fd:
+                    start = fd.tell()
+                    fd.write(data)
+                off_path = self._column_path(col_name, col_type, self.OFFSETS_EXT)
+                with open(off_path, 'r+b') as fd:
+                    fd.seek(position * self.offsets.size)
+                    fd.write(self.offsets.pack(start, len(data)))
+
+    def _open_column(self, col_name, col_type, stop, lazy, files):
+        """ Opens the files of a column once for a scan, returning
+        a function reading the cells of a batch of rows
+
+        In lazy mode the `str` cells are memory-mapped (once) and
+        returned as `memoryview` slices
+
+        :param int stop: The rowid after the last one read
+        :param contextlib.ExitStack files: Closes the opened files
+        :return: a function of the first rowid and the number of rows
+            returning the list of plaintext cells
+        :rtype: Callable[[int,int],list[str|memoryview]]
+        """
+        if lazy and col_type not in self.fixed:
+            off_path = self._column_path(col_name, col_type, self.OFFSETS_EXT)
+            offsets = map_file(off_path, stop * self.offsets.size)
+            data = map_file(self._column_path(col_name, col_type))
+
+            def read(start, size):
+                batch = offsets[start * self.offsets.size:(start + size) * self.offsets.size]
+                return [data[offset:offset + length]
+                        for offset, length in self.offsets.iter_unpack(batch)]
+        elif col_type in self.fixed:
+            width = self.fixed[col_type].size
+            fd = files.enter_context(open(self._column_path(col_name, col_type), 'rb'))
+            IO_STATS.read(0, files=1)
+
+            def read(start, size):
+                fd.seek(start * width)
+                data = fd.read(size * width)
+                IO_STATS.read(len(data))
+                return [self._decode_fixed(col_type, data[i:i + width])
+                        for i in range(0, size * width, width)]
+        else:
+            off_path = self._column_path(col_name, col_type, self.OFFSETS_EXT)
+            off_fd = files.enter_context(open(off_path, 'rb'))
+            fd = files.enter_context(open(self._column_path(col_name, col_type), 'rb'))
+            IO_STATS.read(0, files=2)
+
+            def read(start, size):
+                off_fd.seek(start * self.offsets.size)
+                data = off_fd.read(size * self.offsets.size)
+                cells = []
+                for offset, length in self.offsets.iter_unpack(data):
+                    fd.seek(offset)
+                    cells.append(fd.read(length).decode('utf-8'))
+                IO_STATS.read(len(data) + sum(map(len, cells)))
+                return cells
+        return read
+
+    def _create_column(self, col_name, col_type, count):
+        """ Creates the files of a column holding count empty cells """
+        if col_type in self.fixed:
+            with open(self._column_path(col_name, col_type), 'wb') as fd:
+                fd.write(self._encode_fixed(col_type, '') * count)
+        else:
+            open(self._column_path(col_name, col_type), 'wb').close()
+            off_path = self._column_path(col_name, col_type, self.OFFSETS_EXT)
+            with open(off_path, 'wb') as fd:
+                fd.write(self.offsets.pack(0, 0) * count)
+
+    def create(self, schema):
+        open(self._live_path(), 'wb').close()
+        for col_name, col_type in schema.items():
+            self._create_column(col_name, col_type, 0)
+
+    def next_rowid(self):
+        return os.path.getsize(self._live_path())
+
+    def insert(self, schema, rowid, row):
+        assert rowid >= self.next_rowid()
+        if rowid > self.next_rowid():
+            # the skipped rowids (e.g. of a table compacted meanwhile)
+            # are stored as deleted rows
+            self.load(schema, [dict(row, _rowid=rowid)])
+            return
+
+        self._write_cells(schema, rowid, {col_name: row[col_name]
+                                          for col_name in schema})
+        with open(self._live_path(), 'ab') as fd:
+            fd.write(b'\x01')
+
+    def insert_many(self, schema, first_rowid, rows):
+        assert first_rowid == self.next_rowid()
+        self._append_rows(schema, rows, b'\x01' * len(rows))
+
+    def load(self, schema, records):
+        # rowids are positions, so the gaps between them are filled
+        # with deleted (empty) rows
+        empty = {col_name: '' for col_name in schema}
+        rows, live = [], bytearray()
+        for record in records:
+            rowid = record['_rowid']
+            gap = rowid - self.next_rowid() - len(rows)
+            rows.extend([empty] * gap)
+            live += b'\x00' * gap
+            rows.append({col_name: record[col_name] for col_name in schema})
+            live.append(1)
+            if len(rows) >= self.LOAD_BATCH_SIZE:
+                self._append_rows(schema, rows, bytes(live))
+                rows, live = [], bytearray()
+        if rows:
+            self._append_rows(schema, rows, bytes(live))
+
+    def _append_rows(self, schema, rows, live):
+        """ Appends rows after the last row of the column files
+
+        :param dict[str,str] schema: Key-value schema `[column_name, column_type]`
+        :param list[dict[str,str]] rows: The rows to append
+        :param bytes live: The live flag of each row
+        """
+        for col_name, col_type in schema.items():
+            if col_type in self.fixed:
+                with open(self._column_path(col_name, col_type), 'ab') as fd:
+                    fd.write(b''.join(self._encode_fixed(col_type, row[col_name])
+                                      for row in rows))
+                continue
+
+            offsets = []
+            with open(self._column_path(col_name, col_type), 'ab') as fd:
+                start = fd.tell()
+                cells = [row[col_name].encode('utf-8') for row in rows]
+                for cell in cells:
+                    offsets.append(self.offsets.pack(start, len(cell)))
+                    start += len(cell)
+                fd.write(b''.join(cells))
+            off_path = self._column_path(col_name, col_type, self.OFFSETS_EXT)
+            with open(off_path, 'ab') as fd:
+                fd.write(b''.join(offsets))
+
+        with open(self._live_path(), 'ab') as fd:
+            fd.write(live)
+
+    def sync(self):
+        for filename in os.listdir(self.table_path):
+            if filename == self.LIVE or filename.endswith(
+                    (self.COLUMN_EXT, self.OFFSETS_EXT)):
+                with open(os.path.join(self.table_path, filename), 'ab') as fd:
+                    os.fsync(fd.fileno())
+
+    def scan(self, schema, columns=None, lazy=False, rowid_range=None, row_filter=None):
+        columns = list(schema if columns is None else columns)
+        rowids = range(self.next_rowid())
+        if rowid_range is not None:
+            # positions are rowids, so a range is read by seeking to it
+            rowids = rowids[rowid_range.start:rowid_range.stop]
+
+        # with a row filter its columns are read for every batch of rows
+        # and the other columns only for the batches having matching rows
+        other_columns = []
+        if row_filter is not None:
+            other_columns = [col_name for col_name in columns
+                             if col_name not in row_filter.columns]
+            columns = list(row_filter.columns)
+
+        # the files of the other columns are opened for the first batch
+        # having matching rows, and kept open for the next ones
+        with ExitStack() as files, open(self._live_path(), 'rb') as fd:
+            readers = [self._open_column(col_name, schema[col_name], rowids.stop, lazy, files)
+                       for col_name in columns]
+            other_readers = None
+            IO_STATS.read(0, files=1)
+            fd.seek(rowids.start)
+            for start in range(rowids.start, rowids.stop, self.BATCH_SIZE):
+                live = fd.read(min(self.BATCH_SIZE, rowids.stop - start))
+                IO_STATS.read(len(live))
+                batches = [read(start, len(live)) for read in readers]
+                matches = []
+                for i, flag in enumerate(live):
+                    if not flag:
+                        continue
+                    cells = {col_name: batch[i]
+                             for col_name, batch in zip(columns, batches)}
+                    cells['_rowid'] = start + i
+                    record = LazyRecord(cells) if lazy else cells
+                    if row_filter is None or row_filter.match(record):
+                        matches.append((i, cells, record))
+
+                if matches and other_columns:
+                    if other_readers is None:
+                        other_readers = [self._open_column(col_name, schema[col_name],
+                                                           rowids.stop, lazy, files)
+                                         for col_name in other_columns]
+                    other_batches = [read(start, len(live)) for read in other_readers]
+                    for i, cells, _ in matches:
+                        cells.update((col_name, batch[i])
+                                     for col_name, batch in zip(other_columns, other_batches))
+                for _, _, record in matches:
+                    yield record
+
+    def fetch(self, schema, rowids, columns=None, lazy=False, row_filter=None):
+        if isinstance(rowids, range) and rowids.step == 1:
+            # a run of rowids is a run of positions, read with one scan
+            yield from self.scan(schema, columns, lazy, rowids, row_filter)
+            return
+        yield from super().fetch(schema, rowids, columns, lazy, row_filter)
+
+    def update(self, schema, rowid, new_row):
+        assert rowid < self.next_rowid()
+        self._write_cells(schema, rowid, new_row)
+
+    def delete(self, rowid):
+        assert rowid < self.next_rowid()
+        with open(self._live_path(), 'r+b') as fd:
+            fd.seek(rowid)
+            fd.write(b'\x00')
+
+    def add_column(self, schema, col_name, col_type):
+        self._create_column(col_name, col_type, self.next_rowid())
+
+    def del_column(self, schema, col_name):
+        col_type = schema[col_name]
+        os.remove(self._column_path(col_name, col_type))
+        if col_type not in self.fixed:
+            os.remove(self._column_path(col_name, col_type, self.OFFSETS_EXT))
+
+
+STORAGES = {
+    DirStorage.name: DirStorage,
+    SegmentStorage.name: SegmentStorage,
+    ColumnStorage.name: ColumnStorage,
+}
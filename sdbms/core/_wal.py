@@ -0,0 +1,336 @@
+import fcntl
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import deque, namedtuple
+
+WAL = '.wal'
+
+
+class WalRecord(namedtuple('WalRecord', 'lsn, op, table, rowid, row')):
+    """ A mutation of a table's rows written to the write-ahead log
+
+    * `lsn`: log sequence number, increased by every logged mutation
+    * `op`: 'insert', 'update' or 'delete'
+    * `table`: name of the changed table
+    * `rowid`: the inserted, updated or deleted row
+    * `row`: the cells of the inserted row or the new cells
+      of the updated one (None for a delete)
+    """
+
+
+class WalInfo(namedtuple('WalInfo', 'commits, syncs, applied_lsn')):
+    """ Statistics of a write-ahead log
+
+    * `commits`: number of mutations logged
+    * `syncs`: number of fsyncs of the log (one per group commit)
+    * `applied_lsn`: lsn of the last mutation applied to the tables
+    """
+
+
+class WalLockedError(ValueError):
+    """ Raised when opening a write-ahead log already opened
+    (and locked) by another owner """
+
+
+class WriteAheadLog(object):
+    """ Write-ahead log of the mutations of a database
+
+    The log is a '.wal' file in the database dir holding the lsn of its
+    first record followed by the records, each one being a JSON payload
+    prefixed by its length and crc32::
+
+        <first_lsn:Q> (<length:I><crc32:I><payload>)*
+
+    A writer appends its record and waits for it to be on disk; the first
+    waiting writer finding no fsync in progress syncs the log for all the
+    records appended so far (group commit), so concurrent writers share
+    a single fsync. Durable records are then applied to the tables,
+    in lsn order, by a background thread (the applier)
+
+    When opened, the records left in the log (e.g. by a crash) are
+    applied again, so applying a record must be idempotent. Once every
+    record is applied and the log has grown past `checkpoint_size`,
+    the tables are flushed to disk and the log is emptied (checkpoint)
+
+    The log has a single owner: an exclusive lock of the '.wal' file is
+    held from its opening to its closing, so another log (in this process
+    or in another one) cannot be opened on the same database meanwhile
+    """
+    header = struct.Struct('<Q')
+    record_header = struct.Struct('<II')
+    CHECKPOINT_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, db_path, apply, checkpoint, first_lsn=1, commit_delay=0,
+                 checkpoint_size=CHECKPOINT_SIZE):
+        """
+        :param str db_path: Absolute path of the database dir
+        :param apply: Applies a :class:`WalRecord` to the tables
+        :param checkpoint: Flushes the applied records to disk
+        :param int first_lsn: The lsn of the first record
+            if the log does not exist yet
+        :param float commit_delay: How many seconds a syncing writer waits
+            for other writers to append their records to the same group
+        :param int checkpoint_size: Size (in bytes) of the log
+            above which it is emptied
+        :raises WalLockedError: if the log is already open (i.e. locked)
+        """
+        self.path = os.path.join(db_path, WAL)
+        self._apply = apply
+        self._checkpoint = checkpoint
+        self.commit_delay = commit_delay
+        self.checkpoint_size = checkpoint_size
+
+        self._cond = threading.Condition()
+        self._unsynced = []
+        self._pending = deque()
+        self._syncing = False
+        self._closed = False
+        self._error = None
+        self._commits = 0
+        self._syncs = 0
+
+        self._fd = open(self.path, 'ab')
+        try:
+            fcntl.flock(self._fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._fd.close()
+            raise WalLockedError(f'The write-ahead log {self.path} is used by another owner')
+
+        try:
+            records = self._recover(first_lsn)
+            self._next_lsn = records[-1].lsn + 1 if records else self._first_lsn
+            self._durable_lsn = self._applied_lsn = self._next_lsn - 1
+            for record in records:
+                self._apply(record)
+            self._size = self._fd.seek(0, os.SEEK_END)
+            if records:
+                self._checkpoint()
+                with self._cond:
+                    self._truncate()
+        except BaseException:
+            self._fd.close()
+            raise
+
+        self._applier = threading.Thread(target=self._run, name=f'wal-applier-{db_path}',
+                                         daemon=True)
+        self._applier.start()
+
+    def _recover(self, first_lsn):
+        """ Reads the records of the log, cutting off a torn tail
+        (a record partially written by a crash)
+
+        :param int first_lsn: The lsn of the first record
+            if the log does not exist yet
+        :return: the records of the log
+        :rtype: list[WalRecord]
+        """
+        self._first_lsn = first_lsn
+        records = []
+        with open(self.path, 'r+b') as fd:
+            data = fd.read()
+            size = len(data)
+            if size < self.header.size:
+                # a new log (or one whose header was torn)
+                data = self.header.pack(self._first_lsn)
+            self._first_lsn, = self.header.unpack_from(data)
+
+            position = self.header.size
+            while position + self.record_header.size <= len(data):
+                length, crc = self.record_header.unpack_from(data, position)
+                start = position + self.record_header.size
+                payload = data[start:start + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                records.append(WalRecord(*json.loads(payload)))
+                position = start + length
+
+            if position != size:
+                fd.seek(0)
+                fd.write(data[:position])
+                fd.truncate(position)
+                os.fsync(fd.fileno())
+        return records
+
+    def _truncate(self):
+        """ Empties the log (called with the lock held, once every
+        record is applied and flushed by the checkpoint) """
+        self._fd.seek(0)
+        self._fd.truncate(0)
+        self._fd.write(self.header.pack(self._next_lsn))
+        self._fd.flush()
+        os.fsync(self._fd.fileno())
+        self._size = self.header.size
+
+    def append(self, op, table, rowid, row=None):
+        """ Appends a mutation to the log without waiting for it
+        to be durable (see :meth:`wait`)
+
+        :param str op: 'insert', 'update' or 'delete'
+        :param str table: Name of the table
+        :param int rowid: Unique identifier of the row
+        :param dict[str,str] row: The cells of the row
+        :return: the lsn of the logged mutation
+        :rtype: int
+        :raises Exception: the error raised while applying a previous
+            mutation, until it is reported by :meth:`drain`
+        """
+        with self._cond:
+            if self._closed:
+                raise ValueError('The write-ahead log is closed')
+            if self._error is not None:
+                raise self._error
+            record = WalRecord(self._next_lsn, op, table, rowid, row)
+            payload = json.dumps(record).encode('utf-8')
+            self._fd.write(self.record_header.pack(len(payload), zlib.crc32(payload)))
+            self._fd.write(payload)
+            self._size += self.record_header.size + len(payload)
+            self._unsynced.append(record)
+            self._next_lsn += 1
+            self._commits += 1
+            return record.lsn
+
+    def wait(self, lsn):
+        """ Waits for a logged mutation to be durable, syncing the log
+        if no other writer is doing it
+
+        :param int lsn: The lsn of the logged mutation
+        """
+        with self._cond:
+            while self._durable_lsn < lsn:
+                if self._syncing:
+                    self._cond.wait()
+                else:
+                    self._sync()
+
+    def commit(self, op, table, rowid, row=None):
+        """ Logs a mutation and waits for it to be durable
+
+        :param str op: 'insert', 'update' or 'delete'
+        :param str table: Name of the table
+        :param int rowid: Unique identifier of the row
+        :param dict[str,str] row: The cells of the row
+        :return: the lsn of the logged mutation
+        :rtype: int
+        """
+        lsn = self.append(op, table, rowid, row)
+        self.wait(lsn)
+        return lsn
+
+    def _sync(self):
+        """ Makes every appended record durable and hands them to the
+        applier (called with the lock held, which is released while
+        waiting for other writers and during the fsync) """
+        self._syncing = True
+        try:
+            if self.commit_delay:
+                self._cond.wait(self.commit_delay)
+            records, self._unsynced = self._unsynced, []
+            self._fd.flush()
+            self._cond.release()
+            try:
+                os.fsync(self._fd.fileno())
+            finally:
+                self._cond.acquire()
+        finally:
+            self._syncing = False
+
+        self._syncs += 1
+        self._durable_lsn = records[-1].lsn
+        self._pending.extend(records)
+        self._cond.notify_all()
+
+    def _run(self):
+        """ Applier loop: applies the durable records in lsn order
+
+        A record failing to be applied stops the applier on it: the record
+        and the following ones are kept (in the log and pending) until
+        :meth:`drain` reports the error, after which they are retried
+        """
+        with self._cond:
+            while True:
+                while (not self._pending or self._error is not None) and not self._closed:
+                    self._cond.wait()
+                if not self._pending or self._error is not None:
+                    return
+
+                records = list(self._pending)
+                self._pending.clear()
+                applied, error = 0, None
+                self._cond.release()
+                try:
+                    for record in records:
+                        self._apply(record)
+                        applied += 1
+                except Exception as exc:
+                    error = exc
+                finally:
+                    self._cond.acquire()
+
+                if applied:
+                    self._applied_lsn = records[applied - 1].lsn
+                if error is not None:
+                    self._error = error
+                    self._pending.extendleft(reversed(records[applied:]))
+                elif (self._size > self.checkpoint_size and not self._syncing
+                        and self._applied_lsn == self._next_lsn - 1):
+                    self._checkpoint()
+                    self._truncate()
+                self._cond.notify_all()
+
+    def drain(self):
+        """ Waits for every durable mutation to be applied to the tables
+
+        :raises Exception: the error raised while applying a mutation;
+            the mutation (and the following ones) are kept in the log
+            and retried after this call
+        """
+        with self._cond:
+            while self._applied_lsn < self._durable_lsn and self._error is None:
+                self._cond.wait()
+            error, self._error = self._error, None
+            self._cond.notify_all()
+        if error is not None:
+            raise error
+
+    def is_applied(self):
+        """ Checks whether every logged mutation is applied to the tables
+
+        :rtype: bool
+        """
+        with self._cond:
+            return self._applied_lsn == self._next_lsn - 1
+
+    def info(self):
+        """ Returns the statistics of the log
+
+        :rtype: WalInfo
+        """
+        with self._cond:
+            return WalInfo(self._commits, self._syncs, self._applied_lsn)
+
+    def close(self):
+        """ Applies every logged mutation, checkpoints and closes the log
+
+        If a mutation cannot be applied, the log is closed without being
+        emptied, so its records are applied again when it is reopened
+        """
+        with self._cond:
+            if self._closed:
+                return
+            if self._unsynced:
+                self._sync()
+            self._closed = True
+            self._cond.notify_all()
+        self._applier.join()
+
+        with self._cond:
+            error, self._error = self._error, None
+            if error is None:
+                self._checkpoint()
+                self._truncate()
+            self._fd.close()
+        if error is not None:
+            raise error
@@ -31,28 +31,74 @@ class SimpleDb(object):
 
         tables my_database;
 
+    6. Show tables of from a database with their number of rows::
+
+        tables my_database with counts;
+
     **Tables queries**:
 
     1. Create a table::
 
         create table users columns str:name int:age bool:employeed;
 
-    2. Query a table::
+    2. Create a table (with the packed segments or columnar storage)::
+
+        create table users storage:packed columns str:name int:age bool:employeed;
+        create table users storage:columns columns str:name int:age bool:employeed;
+
+    3. Query a table::
 
         query * users;
 
-    3. Query a table (with projection)::
+    4. Query a table (with projection)::
 
         query name,age users;
 
-    4. Query a table (with 1 condition)::
+    5. Query a table (with 1 condition)::
 
         query name users where op:or conditions age>18;
 
-    5. Query a table (with multiple conditions)::
+    6. Query a table (with multiple conditions)::
 
         query name users where op:or conditions age>18 isdead!=True;
 
+    7. Query rows by rowid (read directly, without scanning the table)::
+
+        query * users where op:and conditions _rowid>=10 _rowid<20;
+
+    8. Show the plan of a query, update or delete (with `analyze`, also run
+    it and measure every node of the plan)::
+
+        explain query name users where op:and conditions age>18;
+        explain analyze delete in users where op:or conditions isdead=True;
+
+    9. Query a page of rows (at most `limit` rows, after skipping `offset` rows)::
+
+        query name users where op:and conditions age>18 limit 10 offset 20;
+
+    10. Query rows sorted by a column (`asc` by default)::
+
+        query name,age users where op:and conditions age>18 order by age desc limit 10;
+
+    11. Query aggregates (`count`, `sum`, `min`, `max`, `avg`) of the rows, or of groups of rows::
+
+        query count(*),avg(age) users;
+        query age,count(*) users where op:and conditions employeed=True group by age order by age;
+
+    12. Query the rows of two tables whose columns are equal (a join, with qualified columns)::
+
+        query users.name,things.title users join things on things.owner=users._rowid where op:and conditions users.age>18;
+
+    **Table insert queries**:
+
+    1. Insert a row::
+
+        insert into users values name="John" age=23 employeed=True;
+
+    2. Insert many rows::
+
+        insert into users values (name="John" age=23 employeed=True), (name="Jane" age=21 employeed=False);
+
     **Table update queries**:
 
     1. Update columns (single)::
@@ -67,6 +113,33 @@ class SimpleDb(object):
 
         update users set isdead=True where op:and conditions isdead=False name="John";
 
+    **Index queries**:
+
+    1. Create a (hash) index, used by the conditions with `=`::
+
+        create index name_idx on users(name);
+
+    2. Create an ordered index of an int column, used by the conditions
+    with `=`, `<`, `<=`, `>` and `>=`::
+
+        create index age_idx on users(age) using btree;
+
+    3. Create a bitmap index of a bool column, whose `=` comparisons
+    are combined bitwise::
+
+        create index isdead_idx on users(isdead) using bitmap;
+
+    4. Delete an index::
+
+        drop index name_idx on users;
+
+    **Table maintenance queries**:
+
+    1. Compact a table (optionally converting its storage or renumbering its rows)::
+
+        vacuum users;
+        vacuum users storage:columns renumber;
+
     **Table delete queries**:
 
     1. Delete rows (all)::
@@ -78,14 +151,24 @@ class SimpleDb(object):
         delete in users where op:or conditions isdead=True;
 
     """
-    def __init__(self, db_root_path=None):
+    def __init__(self, db_root_path=None, **manager_options):
+        """
+        :param str db_root_path: The root dir where the databases are managed
+        :param manager_options: Other options of the :class:`DbManager`
+            (e.g. ``scan_workers=8``, or ``result_cache=ResultCache()``
+            to cache the results of the queries)
+        """
         self._parser = QueryParser()
-        self._manager = DbManager(root_path=db_root_path)
+        self._manager = DbManager(root_path=db_root_path, **manager_options)
     
     def execute(self, query):
         cmd = self._parser.parse(query)
         return cmd.execute(self._manager)
 
+    def close(self):
+        """ Closes the manager (its write-ahead log and pool of processes) """
+        self._manager.close()
+
 
 #     """create sdb my_db;""",
 #     """delete sdb my_db;""",
@@ -16,3 +16,11 @@ def test_db_execute():
 
     sd._parser.parse.assert_called_once_with('create table foo;')
 
+
+def test_db_close():
+    sd = SimpleDb()
+    sd._manager = unittest.mock.create_autospec(DbManager, spec_set=True)()
+
+    sd.close()
+
+    sd._manager.close.assert_called_once_with()
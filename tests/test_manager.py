@@ -1,9 +1,20 @@
-from sdbms.core._manager import DbManager
+from sdbms.core._manager import DbManager, TableMeta, SchemaCache, CacheInfo, ResultCache
+from sdbms.core._storage import LazyRecord, DirStorage, IO_STATS
+from sdbms.core._codec import TypedRecord
+from sdbms.core._wal import WriteAheadLog, WalInfo
+from sdbms.core._index import IndexInfo, HashIndex, BtreeIndex, BitmapIndex, bitmap_rowids
+from sdbms.core._parser import QueryParser
+from sdbms.core._sort import external_sort, top_k
 
 import pytest
 
 import os
+import zlib
 import shutil
+import tempfile
+from operator import itemgetter
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 
 
 def test_create_db(tmpdir):
@@ -505,3 +516,1487 @@ def test_scan_rows(tmpdir):
         del record['_rowid']
         assert record in test_records
 
+
+def test_create_table_storage(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    test_schema = {'name':'str','age':'int','employed':'bool'}
+    dbm.create_table('dirs_table', test_schema)
+    dbm.create_table('packed_table', test_schema, storage='packed')
+
+    assert dbm.get_table_storage('dirs_table') == 'dirs'
+    assert dbm.get_table_storage('packed_table') == 'packed'
+    assert dbm.get_table_schema('packed_table') == test_schema
+
+    # tables created before the '.storage' file existed are 'dirs' tables
+    os.remove(os.path.join(tmpdir, 'test_db', 'dirs_table', '.storage'))
+    dbm = DbManager(tmpdir)
+    dbm.use_db('test_db')
+    assert dbm.get_table_storage('dirs_table') == 'dirs'
+
+def test_packed_insert_scan(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    test_schema = {'name':'str','age':'int','employed':'bool'}
+    dbm.create_table('user', test_schema, storage='packed')
+
+    row1 = {'name':'"Cristea"','age':'24','employed':'False'}
+    row2 = {'name':'"Cernescu"','age':'23','employed':'True'}
+    row3 = {'name':'"Ceva, cu ; caractere"','age':'24','employed':'False'}
+    dbm.insert_row('user', row1)
+    dbm.insert_row('user', row2)
+    dbm.insert_row('user', row3)
+
+    table_path = os.path.join(tmpdir, 'test_db', 'user')
+    assert not any(os.path.isdir(os.path.join(table_path, f))
+                   for f in os.listdir(table_path))
+
+    records = list(dbm.scan_rows('user'))
+    assert records == [dict(row1, _rowid=0), dict(row2, _rowid=1),
+                       dict(row3, _rowid=2)]
+
+    # a new manager rebuilds the rowid offsets from the segment files
+    dbm = DbManager(tmpdir)
+    dbm.use_db('test_db')
+    assert list(dbm.scan_rows('user')) == records
+
+def test_packed_update_delete_row(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    test_schema = {'name':'str','age':'int','employed':'bool'}
+    dbm.create_table('user', test_schema, storage='packed')
+    for i in range(4):
+        dbm.insert_row('user', {'name':f'"User{i}"','age':str(20 + i),'employed':'False'})
+
+    dbm.update_row('user', 1, {'employed': 'True'})
+    dbm.delete_row('user', 2)
+
+    records = {record['_rowid']: record for record in dbm.scan_rows('user')}
+    assert set(records) == {0, 1, 3}
+    assert records[1] == {'_rowid': 1, 'name': '"User1"', 'age': '21', 'employed': 'True'}
+
+    dbm.insert_row('user', {'name':'"User4"','age':'24','employed':'False'})
+    assert max(record['_rowid'] for record in dbm.scan_rows('user')) == 4
+
+def test_packed_add_del_column(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    test_schema = {'name':'str','age':'int','employed':'bool'}
+    dbm.create_table('user', test_schema, storage='packed')
+    dbm.insert_row('user', {'name':'"A"','age':'1','employed':'False'})
+    dbm.insert_row('user', {'name':'"B"','age':'2','employed':'True'})
+
+    dbm.add_column('user', 'about', 'str')
+    for record in dbm.scan_rows('user'):
+        assert record['about'] == ''
+
+    dbm.del_column('user', 'age')
+    records = list(dbm.scan_rows('user'))
+    assert records == [{'_rowid': 0, 'name': '"A"', 'employed': 'False', 'about': ''},
+                       {'_rowid': 1, 'name': '"B"', 'employed': 'True', 'about': ''}]
+
+def test_packed_segment_rollover(tmpdir, monkeypatch):
+    from sdbms.core._storage import SegmentStorage
+    monkeypatch.setattr(SegmentStorage, 'SEGMENT_MAX_SIZE', 64)
+
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'}, storage='packed')
+    for i in range(10):
+        dbm.insert_row('user', {'name':f'"User{i}"'})
+    dbm.delete_row('user', 0)
+
+    table_path = os.path.join(tmpdir, 'test_db', 'user')
+    assert len([f for f in os.listdir(table_path) if f.endswith('.seg')]) > 1
+    assert [r['_rowid'] for r in dbm.scan_rows('user')] == list(range(1, 10))
+
+def test_packed_del_column_interrupted(tmpdir, monkeypatch):
+    from sdbms.core._storage import SegmentStorage
+    monkeypatch.setattr(SegmentStorage, 'SEGMENT_MAX_SIZE', 64)
+    table_path = str(tmpdir)
+    schema = {'name':'str','age':'int'}
+    storage = SegmentStorage(table_path)
+    storage.create(schema)
+    for i in range(10):
+        storage.insert(schema, i, {'name':f'"User{i}"','age':str(i)})
+    storage.delete(3)
+    storage.update(schema, 5, {'age':'50'})
+    segments = sorted(f for f in os.listdir(table_path) if f.endswith('.seg'))
+    assert len(segments) > 1
+
+    # a crash while the old segments are removed: the rewritten
+    # segment is already swapped in and its records win over theirs
+    remove = os.remove
+    def crash(path):
+        if not os.path.exists(os.path.join(table_path, segments[0])):
+            raise OSError('crash')
+        remove(path)
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'remove', crash)
+        with pytest.raises(OSError):
+            storage.del_column(schema, 'age')
+    expected = [{'_rowid': i, 'name': f'"User{i}"'} for i in range(10) if i != 3]
+    records = SegmentStorage(table_path).scan({'name':'str'})
+    assert sorted(records, key=itemgetter('_rowid')) == expected
+
+    # the next segments follow the rewritten one
+    storage = SegmentStorage(table_path)
+    storage.insert({'name':'str'}, 10, {'name':'"User10"'})
+    storage.delete(0)
+    rowids = [rowid for rowid in range(1, 11) if rowid != 3]
+    assert sorted(r['_rowid'] for r in SegmentStorage(table_path).scan({'name':'str'})) == rowids
+
+def test_columns_insert_scan(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    test_schema = {'name':'str','age':'int','employed':'bool'}
+    dbm.create_table('user', test_schema, storage='columns')
+
+    row1 = {'name':'"Cristea"','age':'24','employed':'False'}
+    row2 = {'name':'"Cernescu"','age':'-23','employed':'True'}
+    dbm.insert_row('user', row1)
+    dbm.insert_row('user', row2)
+
+    table_path = os.path.join(tmpdir, 'test_db', 'user')
+    assert os.path.getsize(os.path.join(table_path, 'age.int.col')) == 16
+    assert os.path.getsize(os.path.join(table_path, 'employed.bool.col')) == 2
+    assert os.path.getsize(os.path.join(table_path, 'name.str.off')) == 24
+
+    assert list(dbm.scan_rows('user')) == [dict(row1, _rowid=0), dict(row2, _rowid=1)]
+
+def test_columns_projection_reads(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    test_schema = {'name':'str','age':'int','employed':'bool'}
+    dbm.create_table('user', test_schema, storage='columns')
+    dbm.insert_row('user', {'name':'"A"','age':'1','employed':'False'})
+
+    # the files of the columns which are not asked for are never opened
+    table_path = os.path.join(tmpdir, 'test_db', 'user')
+    os.remove(os.path.join(table_path, 'name.str.col'))
+    os.remove(os.path.join(table_path, 'name.str.off'))
+
+    assert list(dbm.scan_rows('user', columns=['age'])) == [{'_rowid': 0, 'age': '1'}]
+
+def test_columns_update_delete_row(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    test_schema = {'name':'str','age':'int','employed':'bool'}
+    dbm.create_table('user', test_schema, storage='columns')
+    for i in range(3):
+        dbm.insert_row('user', {'name':f'"User{i}"','age':str(20 + i),'employed':'False'})
+
+    dbm.update_row('user', 0, {'name': '"A much longer name"', 'age': '99'})
+    dbm.delete_row('user', 1)
+
+    assert list(dbm.scan_rows('user')) == [
+        {'_rowid': 0, 'name': '"A much longer name"', 'age': '99', 'employed': 'False'},
+        {'_rowid': 2, 'name': '"User2"', 'age': '22', 'employed': 'False'},
+    ]
+
+def test_columns_add_del_column(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage='columns')
+    dbm.insert_row('user', {'name':'"A"','age':'1'})
+
+    dbm.add_column('user', 'employed', 'bool')
+    dbm.add_column('user', 'score', 'int')
+    dbm.add_column('user', 'about', 'str')
+    assert list(dbm.scan_rows('user')) == [
+        {'_rowid': 0, 'name': '"A"', 'age': '1', 'employed': '', 'score': '', 'about': ''}]
+
+    dbm.update_row('user', 0, {'employed': 'True', 'about': '""'})
+    dbm.del_column('user', 'name')
+    assert list(dbm.scan_rows('user')) == [
+        {'_rowid': 0, 'age': '1', 'employed': 'True', 'score': '', 'about': '""'}]
+
+    table_path = os.path.join(tmpdir, 'test_db', 'user')
+    assert not os.path.exists(os.path.join(table_path, 'name.str.col'))
+    assert not os.path.exists(os.path.join(table_path, 'name.str.off'))
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_table_meta(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    version = dbm.get_table_meta('user').version
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=0, count=0, version=version)
+
+    assert dbm.insert_row('user', {'name':'"A"','age':'1'}) == 0
+    assert dbm.insert_row('user', {'name':'"B"','age':'2'}) == 1
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=2, count=2, version=version + 2)
+
+    dbm.update_row('user', 0, {'age': '3'})
+    dbm.delete_row('user', 1)
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=2, count=1, version=version + 4)
+
+    # rowids of deleted rows are never reused
+    assert dbm.insert_row('user', {'name':'"C"','age':'4'}) == 2
+
+    dbm.add_column('user', 'employed', 'bool')
+    dbm.del_column('user', 'employed')
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=3, count=2, version=version + 7)
+
+    with open(os.path.join(tmpdir, 'test_db', 'user', '.meta')) as fd:
+        assert fd.read() == f'next_rowid,3\ncount,2\nversion,{version + 7}\nlsn,0\n'
+
+def test_table_meta_missing(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str'})
+    for name in ('"A"', '"B"', '"C"'):
+        dbm.insert_row('user', {'name': name})
+    dbm.delete_row('user', 1)
+
+    # tables created before '.meta' existed get it built from their rows
+    version = dbm.get_table_meta('user').version
+    os.remove(os.path.join(tmpdir, 'test_db', 'user', '.meta'))
+    meta = dbm.get_table_meta('user')
+    assert meta[:2] == (3, 2) and meta.version > version
+    assert dbm.insert_row('user', {'name': '"D"'}) == 3
+
+def test_schema_cache(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    test_schema = {'name':'str','age':'int'}
+    dbm.create_table('user', test_schema)
+    assert dbm.schema_cache_info() == CacheInfo(hits=0, misses=0, currsize=0)
+
+    assert dbm.get_table_schema('user') == test_schema
+    assert dbm.get_table_schema('user') == test_schema
+    dbm.insert_row('user', {'name':'"A"','age':'1'})
+    assert dbm.schema_cache_info() == CacheInfo(hits=2, misses=1, currsize=1)
+
+    # returned schemas are copies
+    dbm.get_table_schema('user')['foo'] = 'str'
+    assert dbm.get_table_schema('user') == test_schema
+
+    dbm.add_column('user', 'employed', 'bool')
+    assert dbm.get_table_schema('user') == {'name':'str','age':'int','employed':'bool'}
+
+    dbm.delete_table('user')
+    assert dbm.schema_cache_info().currsize == 0
+
+def test_schema_cache_file_changed(tmpdir):
+    schema_cache = SchemaCache()
+    dbm = DbManager(tmpdir, schema_cache=schema_cache)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'})
+    assert dbm.get_table_schema('user') == {'name':'str'}
+
+    # another process (or manager sharing the cache) changing the file
+    other_dbm = DbManager(tmpdir, schema_cache=schema_cache)
+    schema_path = os.path.join(tmpdir, 'test_db', 'user', '.schema')
+    other_dbm._put_schema(schema_path, {'name':'str','age':'int'})
+
+    assert dbm.get_table_schema('user') == {'name':'str','age':'int'}
+    assert schema_cache.info() == CacheInfo(hits=0, misses=2, currsize=1)
+
+def test_result_cache(tmpdir):
+    result_cache = ResultCache()
+    dbm = DbManager(tmpdir, result_cache=result_cache)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int'})
+    dbm.create_table('thing', {'owner':'int'})
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(10)])
+    dbm.insert_row('thing', {'owner':'1'})
+
+    qp = QueryParser()
+    def query(query):
+        files_opened = IO_STATS.files_opened
+        rows = list(qp.parse(query).execute(dbm))
+        return rows, IO_STATS.files_opened - files_opened
+
+    rows, files_opened = query('query name user where op:and conditions age>=5;')
+    assert len(rows) == 5 and files_opened > 0
+    # a cached result (of the same parsed query) reads no row
+    assert query('query  name user where op:and   conditions age>=5;') == (rows, 0)
+    assert dbm.result_cache_info() == CacheInfo(hits=1, misses=1, currsize=1)
+    # returned rows are copies
+    next(qp.parse('query name user where op:and conditions age>=5;').execute(dbm))['name'] = 'X'
+    assert query('query name user where op:and conditions age>=5;') == (rows, 0)
+
+    # every change of the table invalidates its results
+    query('query name user;')
+    changes = [lambda: dbm.insert_row('user', {'name':'"User10"','age':'10'}),
+               lambda: dbm.update_row('user', 10, {'name':'"User11"'}),
+               lambda: dbm.delete_row('user', 10),
+               lambda: dbm.add_column('user', 'employed', 'bool'),
+               lambda: dbm.del_column('user', 'employed')]
+    for change in changes:
+        misses = dbm.result_cache_info().misses
+        change()
+        assert query('query name user;')[1] > 0
+        assert dbm.result_cache_info().misses == misses + 1
+
+    # as do the changes made by a manager sharing the cache
+    join = 'query user.name thing join user on thing.owner=user._rowid;'
+    assert query(join)[0] == [{'user.name': 'User1'}]
+    other_dbm = DbManager(tmpdir, result_cache=result_cache)
+    other_dbm.use_db('test_db')
+    other_dbm.update_row('thing', 0, {'owner':'2'})
+    assert query(join)[0] == [{'user.name': 'User2'}]
+
+    # the rows of a query which is not iterated over to the end are not cached
+    misses = dbm.result_cache_info().misses
+    next(qp.parse('query age user;').execute(dbm))
+    next(qp.parse('query age user;').execute(dbm))
+    assert dbm.result_cache_info().misses == misses + 2
+
+    dbm.delete_table('thing')
+    dbm.create_table('thing', {'owner':'int'})
+    assert query(join) == ([], 0)
+
+    # a table created again by a manager not sharing the cache (e.g. in
+    # another process) does not get the versions of the deleted one
+    dbm.insert_row('thing', {'owner':'3'})
+    assert query(join)[0] == [{'user.name': 'User3'}]
+    other_dbm = DbManager(tmpdir)
+    other_dbm.use_db('test_db')
+    other_dbm.delete_table('thing')
+    other_dbm.create_table('thing', {'owner':'int'})
+    other_dbm.insert_row('thing', {'owner':'4'})
+    assert query(join)[0] == [{'user.name': 'User4'}]
+    dbm.close()
+
+def test_result_cache_lru():
+    result_cache = ResultCache(max_bytes=2000)
+    rows = [{'_rowid': i, 'name': f'User{i}'} for i in range(3)]
+    for key in range(10):
+        result_cache.put(key, (('user', 1), ), rows)
+        assert result_cache.get(0, (('user', 1), )) == rows
+    # the least recently used entries are evicted
+    assert result_cache.get(1, (('user', 1), )) is None
+    assert result_cache.get(9, (('user', 1), )) == rows
+    assert 1 < result_cache.info().currsize < 10
+    # stale entries are dropped
+    assert result_cache.get(9, (('user', 2), )) is None
+    assert result_cache.get(9, (('user', 1), )) is None
+    # too large results are not cached
+    result_cache.put('large', (), rows * 100)
+    assert result_cache.get('large', ()) is None
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_insert_rows(tmpdir, monkeypatch, storage):
+    monkeypatch.setattr(DbManager, 'INSERT_BATCH_SIZE', 3)
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    version = dbm.get_table_meta('user').version
+    dbm.insert_row('user', {'name':'"First"','age':'0'})
+
+    rows = ({'name':f'"User{i}"','age':str(i)} for i in range(1, 8))
+    assert dbm.insert_rows('user', rows) == range(1, 8)
+    assert dbm.insert_rows('user', []) == range(8, 8)
+
+    records = sorted(dbm.scan_rows('user'), key=lambda record: record['_rowid'])
+    assert [record['_rowid'] for record in records] == list(range(8))
+    assert records[5] == {'_rowid': 5, 'name': '"User5"', 'age': '5'}
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=8, count=8, version=version + 4)
+
+def test_dir_storage_sync(tmpdir, monkeypatch):
+    synced = []
+    monkeypatch.setattr('sdbms.core._storage.fsync_path', synced.append)
+    table_path = str(tmpdir)
+    storage = DirStorage(table_path)
+    schema = {'name': 'str'}
+    storage.insert_many(schema, 0, [{'name': '"A"'}, {'name': '"B"'}])
+    storage.update(schema, 0, {'name': '"C"'})
+    storage.delete(1)
+
+    # only the written files and dirs are flushed (and the table dir)
+    storage.sync()
+    assert synced == [os.path.join(table_path, '0', 'name.str'),
+                      os.path.join(table_path, '0'), table_path]
+    synced.clear()
+    storage.sync()
+    assert synced == [table_path]
+
+@pytest.mark.parametrize('storage', ['packed', 'columns'])
+def test_scan_rows_lazy(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    dbm.insert_row('user', {'name':'"Ană"','age':'1'})
+    dbm.insert_row('user', {'name':'"B"','age':'2'})
+    dbm.update_row('user', 0, {'name': '"Ana"'})
+    dbm.delete_row('user', 1)
+    dbm.insert_row('user', {'name':'""','age':'3'})
+
+    records = list(dbm.scan_rows('user', lazy=True))
+    assert all(isinstance(record, LazyRecord) for record in records)
+    assert all(isinstance(record._cells['name'], memoryview) for record in records)
+
+    assert records[0]['name'] == '"Ana"'
+    assert isinstance(records[0]._cells['name'], str)
+    assert isinstance(records[1]._cells['name'], memoryview)
+
+    assert records == [{'_rowid': 0, 'name': '"Ana"', 'age': '1'},
+                       {'_rowid': 2, 'name': '""', 'age': '3'}]
+    assert [dict(record) for record in dbm.scan_rows('user', columns=['name'], lazy=True)] == \
+        [{'_rowid': 0, 'name': '"Ana"'}, {'_rowid': 2, 'name': '""'}]
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_scan_rows_typed(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int','employed':'bool'}, storage=storage)
+    dbm.insert_row('user', {'name':'"Ana"','age':'1','employed':'True'})
+    dbm.insert_row('user', {'name':'"B\\"o\\"b"','age':'-2','employed':'False'})
+    dbm.insert_row('user', {'name':'""','age':'3','employed':''})
+
+    expected = [{'_rowid': 0, 'name': 'Ana', 'age': 1, 'employed': True},
+                {'_rowid': 1, 'name': 'B"o"b', 'age': -2, 'employed': False}]
+    records = sorted(dbm.scan_rows('user', lazy=True, typed=True),
+                     key=lambda record: record['_rowid'])
+    assert all(isinstance(record, TypedRecord) for record in records)
+    assert records[:2] == expected
+    assert records[2]['name'] == '' and records[2]['age'] == 3
+    # an empty cell has no value
+    with pytest.raises(ValueError):
+        records[2]['employed']
+
+    records = list(dbm.scan_rows('user', columns=['age'], rowids=[0, 1], typed=True))
+    assert records == [{'_rowid': 0, 'age': 1}, {'_rowid': 1, 'age': -2}]
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+@pytest.mark.parametrize('workers', [0, 2])
+def test_scan_rows_predicate(tmpdir, storage, workers):
+    dbm = DbManager(tmpdir, scan_workers=workers)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int','about':'str'}, storage=storage)
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i),'about':'""'} for i in range(10)])
+    dbm.delete_row('user', 4)
+
+    def scan(**kwargs):
+        files_opened = IO_STATS.files_opened
+        records = sorted(dbm.scan_rows('user', **kwargs), key=lambda record: record['_rowid'])
+        return [dict(record) for record in records], IO_STATS.files_opened - files_opened
+
+    records, files_opened = scan(columns=['name'], predicate=lambda record: record['age'] > 6,
+                                 predicate_columns=['age'], typed=True)
+    assert records == [{'_rowid': i, 'name': f'User{i}', 'age': i} for i in (7, 8, 9)]
+    if storage == 'dirs':
+        # the name of the rows not matching is not read
+        assert files_opened == 9 + 3
+
+    records, _ = scan(columns=[], predicate=lambda record: record['age'] in ('3', '4', '5'),
+                      predicate_columns=['age'], lazy=True)
+    assert records == [{'_rowid': 3, 'age': '3'}, {'_rowid': 5, 'age': '5'}]
+    records, _ = scan(rowids=[2, 3, 4], predicate=lambda record: record['_rowid'] != 3,
+                      predicate_columns=[])
+    assert records == [{'_rowid': 2, 'name': '"User2"', 'age': '2', 'about': '""'}]
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_scan_rows_predicate_columns_batches(tmpdir, monkeypatch, lazy):
+    monkeypatch.setattr('sdbms.core._storage.ColumnStorage.BATCH_SIZE', 4)
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int'}, storage='columns')
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(20)])
+
+    # the files of a column are opened once per scan, not once per batch
+    files_opened = IO_STATS.files_opened
+    records = list(dbm.scan_rows('user', lazy=lazy, predicate=lambda record: record['age'] != '5',
+                                 predicate_columns=['age']))
+    assert [record['name'] for record in records] == [f'"User{i}"' for i in range(20) if i != 5]
+    # .live, age.int.col, name.str.off and name.str.col
+    assert IO_STATS.files_opened - files_opened == 4
+
+def test_scan_rows_lazy_dirs(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str'})
+    dbm.insert_row('user', {'name':'"A"'})
+    assert list(dbm.scan_rows('user', lazy=True)) == [{'_rowid': 0, 'name': '"A"'}]
+
+@pytest.mark.parametrize('readahead', [None, 1, 3])
+def test_scan_rows_parallel(tmpdir, readahead):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'})
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(20)])
+
+    serial = list(dbm.scan_rows('user'))
+    assert list(dbm.scan_rows('user', workers=4, readahead=readahead)) == serial
+
+    unordered = list(dbm.scan_rows('user', workers=4, ordered=False, readahead=readahead))
+    assert sorted(unordered, key=lambda r: r['_rowid']) == \
+        sorted(serial, key=lambda r: r['_rowid'])
+
+    assert list(dbm.scan_rows('user', columns=['age'], workers=2, readahead=readahead)) == \
+        [{'_rowid': r['_rowid'], 'age': r['age']} for r in serial]
+
+def test_scan_rows_parallel_default(tmpdir):
+    dbm = DbManager(tmpdir, scan_workers=4, scan_ordered=False, scan_readahead=2)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'})
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(10)])
+
+    # the commands use the manager's defaults transparently
+    parser = QueryParser()
+    parser.parse('delete in user where op:or conditions age<5;').execute(dbm)
+    parser.parse('update user set name="Old" where op:and conditions age>7;').execute(dbm)
+
+    rows = sorted(parser.parse('query * user;').execute(dbm), key=lambda r: r['_rowid'])
+    assert [row['_rowid'] for row in rows] == [5, 6, 7, 8, 9]
+    assert [row['name'] for row in rows] == ['User5', 'User6', 'User7', 'Old', 'Old']
+
+    # stopping early does not wait for the whole table to be read
+    scan = dbm.scan_rows('user')
+    next(scan)
+    scan.close()
+
+def test_get_scan_partitions(tmpdir):
+    dbm = DbManager(tmpdir, query_processes=2)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str'})
+    assert dbm.get_scan_partitions('user') == []
+
+    dbm.insert_rows('user', [{'name':f'"User{i}"'} for i in range(20)])
+    partitions = dbm.get_scan_partitions('user')
+    assert len(partitions) == 7
+    assert [rowid for partition in partitions for rowid in partition] == list(range(20))
+
+    dbm.query_processes = 1
+    assert dbm.get_scan_partitions('user') == []
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_scan_rows_rowid_range(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str'}, storage=storage)
+    dbm.insert_rows('user', [{'name':f'"User{i}"'} for i in range(10)])
+    dbm.delete_row('user', 4)
+
+    rowids = sorted(r['_rowid'] for r in dbm.scan_rows('user', rowid_range=range(3, 7)))
+    assert rowids == [3, 5, 6]
+    assert list(dbm.scan_rows('user', rowid_range=range(20, 30), lazy=True)) == []
+
+@pytest.mark.parametrize('ordered', [True, False])
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_query_partitioned(tmpdir, storage, ordered):
+    dbm = DbManager(tmpdir, query_processes=2, query_ordered=ordered)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i % 7)} for i in range(50)])
+
+    query = 'query name user where op:or conditions age>4;'
+    rows = list(QueryParser().parse(query).execute(dbm))
+    expected = [{'_rowid': i, 'name': f'User{i}'} for i in range(50) if i % 7 > 4]
+    if ordered:
+        assert rows == expected
+    else:
+        assert sorted(rows, key=lambda r: r['_rowid']) == expected
+
+def test_query_partitioned_worker_manager(tmpdir):
+    dbm = DbManager(tmpdir, query_processes=2)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'}, storage='packed')
+    dbm.insert_rows('user', [{'name':f'"User{i}"'} for i in range(20)])
+
+    query = QueryParser().parse('query name user;')
+    assert len(list(query.execute(dbm))) == 20
+
+    # the managers kept by the processes see the table replaced
+    dbm.compact_table('user', storage='columns', renumber=True)
+    dbm.delete_row('user', 0)
+    dbm.insert_rows('user', [{'name':'"New"'}])
+    rows = list(query.execute(dbm))
+    assert [row['_rowid'] for row in rows] == list(range(1, 21))
+    assert rows[-1]['name'] == 'New'
+
+    dbm.close()
+    assert dbm._process_pool is None
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_wal(tmpdir, monkeypatch, storage):
+    synced = []
+    monkeypatch.setattr('sdbms.core._manager.fsync_path', synced.append)
+    dbm = DbManager(tmpdir, wal=True)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    version = dbm.get_table_meta('user').version
+    assert dbm.insert_row('user', {'name':'"A"','age':'1'}) == 0
+    assert dbm.insert_row('user', {'name':'"B"','age':'2'}) == 1
+    dbm.update_row('user', 0, {'age': '3'})
+    dbm.delete_row('user', 1)
+    assert dbm.insert_row('user', {'name':'"C"','age':'4'}) == 2
+
+    # reads wait for the logged mutations to be applied
+    assert sorted(dbm.scan_rows('user'), key=lambda r: r['_rowid']) == [
+        {'_rowid': 0, 'name': '"A"', 'age': '3'},
+        {'_rowid': 2, 'name': '"C"', 'age': '4'},
+    ]
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=3, count=2, version=version + 5, lsn=5)
+    assert dbm.wal_info() == WalInfo(commits=5, syncs=5, applied_lsn=5)
+    assert list(dbm.get_tables('test_db')) == ['user']
+
+    # the checkpoint flushes the changed tables only
+    dbm.close()
+    table_path = os.path.join(tmpdir, 'test_db', 'user')
+    assert synced == [os.path.join(table_path, '.meta'), table_path]
+    assert os.path.getsize(os.path.join(tmpdir, 'test_db', '.wal')) == 8
+    assert dbm.wal_info() is None
+
+def test_wal_replay(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'})
+    version = dbm.get_table_meta('user').version
+    dbm.insert_row('user', {'name':'"A"'})
+
+    # mutations logged but never applied (e.g. a crash)
+    db_path = os.path.join(tmpdir, 'test_db')
+    wal = WriteAheadLog(db_path, apply=lambda record: None, checkpoint=lambda: None)
+    wal.commit('insert', 'user', 1, {'name': '"B"'})
+    wal.commit('update', 'user', 0, {'name': '"C"'})
+    wal.commit('delete', 'user', 5)
+    wal._fd.close()  # the lock of the log is released by the crash
+    with open(os.path.join(db_path, '.wal'), 'ab') as fd:
+        fd.write(b'\x10\x00\x00\x00torn')
+
+    # the first insert reached the storage but not the metadata
+    DirStorage(os.path.join(db_path, 'user')).insert({'name': 'str'}, 1, {'name': '"B"'})
+
+    dbm = DbManager(tmpdir, wal=True)
+    dbm.use_db('test_db')
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=2, count=2, version=version + 4, lsn=3)
+    assert sorted(r['name'] for r in dbm.scan_rows('user')) == ['"B"', '"C"']
+    assert dbm.insert_row('user', {'name':'"D"'}) == 2
+    dbm.close()
+
+    # the log keeps numbering the mutations after it is emptied
+    dbm.use_db('test_db')
+    assert dbm.get_table_meta('user').lsn == 4
+    dbm.delete_row('user', 2)
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=3, count=2, version=version + 6, lsn=5)
+    dbm.close()
+
+    # the mutations left in the log are applied even without using it
+    wal = WriteAheadLog(db_path, apply=lambda record: None, checkpoint=lambda: None,
+                        first_lsn=6)
+    wal.commit('insert', 'user', 3, {'name': '"E"'})
+    wal._fd.close()
+    dbm = DbManager(tmpdir)
+    dbm.use_db('test_db')
+    assert os.path.getsize(os.path.join(db_path, '.wal')) == 8
+    assert dbm.insert_row('user', {'name':'"F"'}) == 4
+    assert sorted(r['name'] for r in dbm.scan_rows('user')) == ['"B"', '"C"', '"E"', '"F"']
+
+def test_wal_owner(tmpdir):
+    dbm = DbManager(tmpdir, wal=True)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'})
+    wal_path = os.path.join(tmpdir, 'test_db', '.wal')
+
+    # a second log cannot be opened on the database
+    other = DbManager(tmpdir, wal=True)
+    with pytest.raises(ValueError):
+        other.use_db('test_db')
+    assert other._db_name is None
+
+    # the records of the log are left to their owner
+    dbm._wal.append('insert', 'user', 0, {'name': '"A"'})
+    dbm._wal._fd.flush()
+    size = os.path.getsize(wal_path)
+    for wal_recovery in (True, False):
+        DbManager(tmpdir, wal_recovery=wal_recovery).use_db('test_db')
+        assert os.path.getsize(wal_path) == size
+    dbm.close()
+
+    other.use_db('test_db')
+    assert [r['name'] for r in other.scan_rows('user')] == ['"A"']
+    other.close()
+
+def test_wal_apply_error(tmpdir):
+    applied, failures = [], [OSError('disk full'), OSError('disk full')]
+    def apply(record):
+        if record.lsn in (2, 5) and failures:
+            raise failures.pop()
+        applied.append(record.lsn)
+
+    wal = WriteAheadLog(str(tmpdir), apply=apply, checkpoint=lambda: None)
+    wal.commit('insert', 'user', 0, {'name': '"A"'})
+    wal.commit('insert', 'user', 1, {'name': '"B"'})
+
+    # the failed record is not applied, it is retried once the error is reported
+    with pytest.raises(OSError):
+        wal.drain()
+    with pytest.raises(OSError):
+        wal.drain()
+    assert wal.info().applied_lsn == 1
+    wal.drain()
+    assert applied == [1, 2] and wal.info().applied_lsn == 2
+    wal.close()
+
+    # a record still failing when the log is closed is applied when reopened
+    wal = WriteAheadLog(str(tmpdir), apply=apply, checkpoint=lambda: None)
+    wal.commit('insert', 'user', 2, {'name': '"C"'})
+    wal.commit('insert', 'user', 3, {'name': '"D"'})
+    wal.drain()
+    applied.clear()
+    failures.append(OSError('disk full'))
+    wal.commit('insert', 'user', 4, {'name': '"E"'})
+    with pytest.raises(OSError):
+        wal.close()
+    assert applied == []
+    wal = WriteAheadLog(str(tmpdir), apply=apply, checkpoint=lambda: None)
+    assert applied == [3, 4, 5] and os.path.getsize(wal.path) == 8
+    wal.close()
+
+def test_wal_group_commit(tmpdir):
+    dbm = DbManager(tmpdir, wal=True, wal_commit_delay=0.01)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'}, storage='packed')
+
+    def insert(i):
+        return [dbm.insert_row('user', {'name': f'"User{i}-{j}"'}) for j in range(5)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        rowids = sorted(rowid for result in executor.map(insert, range(8)) for rowid in result)
+
+    assert rowids == list(range(40))
+    assert sorted(r['_rowid'] for r in dbm.scan_rows('user')) == rowids
+    info = dbm.wal_info()
+    assert info.commits == 40 and info.syncs < 40
+    dbm.close()
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+@pytest.mark.parametrize('new_storage', [None, 'dirs', 'packed', 'columns'])
+def test_compact_table(tmpdir, storage, new_storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(10)])
+    for rowid in (0, 3, 4, 9):
+        dbm.delete_row('user', rowid)
+    dbm.update_row('user', 5, {'name': '"Five"'})
+    rows = sorted(dbm.scan_rows('user'), key=lambda r: r['_rowid'])
+    meta = dbm.get_table_meta('user')
+
+    result = dbm.compact_table('user', storage=new_storage)
+    assert result.rows == 6
+    assert result.storage == (new_storage or storage)
+    assert result.rowids is None
+    assert dbm.get_table_storage('user') == result.storage
+    assert sorted(dbm.scan_rows('user'), key=lambda r: r['_rowid']) == rows
+    assert dbm.get_table_meta('user') == TableMeta(next_rowid=10, count=6,
+                                                   version=meta.version + 1)
+    assert list(dbm.get_tables('test_db')) == ['user']
+    assert dbm.insert_row('user', {'name':'"New"','age':'1'}) == 10
+
+def test_compact_table_renumber(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str'})
+    dbm.insert_rows('user', [{'name':f'"User{i}"'} for i in range(6)])
+    for rowid in (0, 2, 3):
+        dbm.delete_row('user', rowid)
+
+    result = dbm.compact_table('user', storage='packed', renumber=True)
+    assert result.rowids == {1: 0, 4: 1, 5: 2}
+    # the row dirs (and their column files) are packed into one segment
+    assert result.inodes_before == 10 and result.inodes_after == 5
+    assert result.inodes_reclaimed == 5 and result.bytes_reclaimed > 0
+    assert sorted(dbm.scan_rows('user'), key=lambda r: r['_rowid']) == [
+        {'_rowid': 0, 'name': '"User1"'},
+        {'_rowid': 1, 'name': '"User4"'},
+        {'_rowid': 2, 'name': '"User5"'},
+    ]
+    assert dbm.get_table_meta('user').next_rowid == 3
+
+def test_compact_table_concurrent(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'})
+    dbm.insert_rows('user', [{'name':f'"User{i}"'} for i in range(5)])
+
+    # a running scan keeps reading the old table, the swap waits for it
+    scan = dbm.scan_rows('user')
+    first = next(scan)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(dbm.compact_table, 'user', 'columns')
+        rest = list(scan)
+        result = future.result()
+    assert len([first] + rest) == 5
+    assert result.storage == 'columns'
+
+    # rows changed during the rewrite are not lost
+    original = DbManager._write_compacted
+    def write_compacted(self, *args):
+        rv = original(self, *args)
+        if not getattr(self, 'changed', False):
+            self.changed = True
+            self.delete_row('user', 1)
+        return rv
+    DbManager._write_compacted = write_compacted
+    try:
+        result = dbm.compact_table('user', renumber=True)
+    finally:
+        DbManager._write_compacted = original
+    assert result.rows == 4
+    assert sorted(r['name'] for r in dbm.scan_rows('user')) == [
+        '"User0"', '"User2"', '"User3"', '"User4"']
+
+def test_compact_table_open_scan(tmpdir, monkeypatch):
+    monkeypatch.setattr(DbManager, 'LOCK_TIMEOUT', 0.1)
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'})
+    dbm.insert_rows('user', [{'name':f'"User{i}"'} for i in range(5)])
+    compact_path = os.path.join(tmpdir, 'test_db', '.user.compact')
+
+    # a scan left open by the compacting thread fails the swap (instead of a deadlock)
+    scan = dbm.scan_rows('user')
+    next(scan)
+    with pytest.raises(ValueError):
+        dbm.compact_table('user')
+    assert not os.path.exists(compact_path)
+
+    # and so does one left open by another thread, after the timeout
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(ValueError):
+            executor.submit(dbm.compact_table, 'user').result()
+    assert len(list(scan)) == 4
+    assert dbm.compact_table('user').rows == 5
+
+def test_compact_table_interrupted(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'})
+    dbm.create_table('item', {'name':'str'})
+    dbm.insert_row('user', {'name':'"A"'})
+
+    # crash between the two renames of the swap / during the rewrite
+    db_path = os.path.join(tmpdir, 'test_db')
+    os.rename(os.path.join(db_path, 'user'), os.path.join(db_path, '.user.old'))
+    os.mkdir(os.path.join(db_path, '.item.compact'))
+    assert sorted(dbm.get_tables('test_db')) == ['item']
+
+    dbm.use_db('test_db')
+    assert sorted(os.listdir(db_path)) == ['item', 'user']
+    assert [r['name'] for r in dbm.scan_rows('user')] == ['"A"']
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_hash_index(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    dbm.insert_rows('user', [{'name':f'"User{i % 3}"','age':str(i)} for i in range(6)])
+    dbm.create_index('user', 'name_idx', 'name')
+    dbm.create_index('user', 'age_idx', 'age')
+    assert dbm.get_table_indexes('user') == {'name_idx': IndexInfo('name', 'hash'),
+                                             'age_idx': IndexInfo('age', 'hash')}
+    with pytest.raises(ValueError):
+        dbm.create_index('user', 'age_idx', 'age')
+
+    assert dbm.index_lookup('user', 'name', [('=', 'User1')]) == {1, 4}
+    assert dbm.index_lookup('user', 'name', [('>', 'User1')]) is None
+    assert dbm.index_lookup('user', 'age', [('=', 5)]) == {5}
+
+    # the indexes are maintained by every change
+    dbm.update_row('user', 1, {'name': '"Bob"'})
+    dbm.delete_row('user', 4)
+    assert dbm.insert_row('user', {'name':'"User1"','age':'5'}) == 6
+    dbm.insert_rows('user', [{'name':'"Bob"','age':'7'}])
+    assert dbm.index_lookup('user', 'name', [('=', 'User1')]) == {6}
+    assert dbm.index_lookup('user', 'name', [('=', 'Bob')]) == {1, 7}
+    assert dbm.index_lookup('user', 'age', [('=', 5)]) == {5, 6}
+
+    # persisted next to the schema (and seen by other managers)
+    other = DbManager(tmpdir)
+    other.use_db('test_db')
+    assert other.index_lookup('user', 'name', [('=', 'Bob')]) == {1, 7}
+    other.delete_row('user', 7)
+    assert dbm.index_lookup('user', 'name', [('=', 'Bob')]) == {1}
+
+    rows = [r['_rowid'] for r in dbm.scan_rows('user', rowids=[6, 4, 1, 42])]
+    assert rows == [6, 1]
+
+    dbm.del_column('user', 'name')
+    assert dbm.get_table_indexes('user') == {'age_idx': IndexInfo('age', 'hash')}
+    assert dbm.index_lookup('user', 'name', [('=', 'Bob')]) is None
+    assert not os.path.exists(os.path.join(tmpdir, 'test_db', 'user', '.index.name_idx'))
+
+    result = dbm.compact_table('user', renumber=True)
+    assert dbm.index_lookup('user', 'age', [('=', 5)]) == {result.rowids[5], result.rowids[6]}
+
+    dbm.drop_index('user', 'age_idx')
+    assert dbm.get_table_indexes('user') == {}
+    with pytest.raises(ValueError):
+        dbm.drop_index('user', 'age_idx')
+
+def test_hash_index_checkpoint(tmpdir, monkeypatch):
+    monkeypatch.setattr(HashIndex, 'CHECKPOINT_SIZE', 64)
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str'}, storage='packed')
+    dbm.create_index('user', 'name_idx', 'name')
+
+    other = DbManager(tmpdir)
+    other.use_db('test_db')
+    assert other.index_lookup('user', 'name', [('=', 'A')]) == set()
+
+    for i in range(20):
+        dbm.insert_row('user', {'name': '"A"' if i % 2 else '"B"'})
+    dbm.update_row('user', 0, {'name': '"A"'})
+
+    log_path = os.path.join(tmpdir, 'test_db', 'user', '.index.name_idx.log')
+    assert os.path.getsize(log_path) <= 64 + 16
+    assert other.index_lookup('user', 'name', [('=', 'A')]) == {0} | set(range(1, 20, 2))
+    assert other.index_lookup('user', 'name', [('=', 'B')]) == set(range(2, 20, 2))
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_btree_index(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    ages = [7, 3, 9, 3, 1, 12, 7]
+    dbm.insert_rows('user', [{'name':'"A"','age':str(age)} for age in ages])
+    dbm.insert_row('user', {'name':'"B"','age':''})
+    dbm.create_index('user', 'age_idx', 'age', kind='btree')
+    dbm.create_index('user', 'name_idx', 'name')
+    assert dbm.get_table_indexes('user')['age_idx'] == IndexInfo('age', 'btree')
+    with pytest.raises(AssertionError):
+        dbm.create_index('user', 'name_btree', 'name', kind='btree')
+
+    def expected(*tests):
+        return {rowid for rowid, age in enumerate(ages) if all(test(age) for test in tests)}
+
+    assert dbm.index_lookup('user', 'age', [('=', 3)]) == {1, 3}
+    assert dbm.index_lookup('user', 'age', [('<', 7)]) == expected(lambda a: a < 7)
+    assert dbm.index_lookup('user', 'age', [('<=', 7)]) == expected(lambda a: a <= 7)
+    assert dbm.index_lookup('user', 'age', [('>', 7)]) == expected(lambda a: a > 7)
+    assert dbm.index_lookup('user', 'age', [('>=', 7)]) == expected(lambda a: a >= 7)
+    assert dbm.index_lookup('user', 'age', [('>', 1), ('<=', 9)]) == \
+        expected(lambda a: a > 1, lambda a: a <= 9)
+    assert dbm.index_lookup('user', 'age', [('>', 9), ('<', 3)]) == set()
+    assert dbm.index_lookup('user', 'name', [('>', 'A')]) is None
+    # the row with an empty cell is not indexed, so the index cannot order all the rows
+    assert dbm.index_order('user', 'age') is None
+    assert dbm.index_order('user', 'name') is None
+
+    # maintained by every change and seen by other managers
+    dbm.update_row('user', 2, {'age': '2'})
+    dbm.delete_row('user', 1)
+    dbm.update_row('user', 7, {'age': '5'})
+    other = DbManager(tmpdir)
+    other.use_db('test_db')
+    assert other.index_lookup('user', 'age', [('>=', 2), ('<', 7)]) == {2, 3, 7}
+    assert other.index_order('user', 'age') == [4, 2, 3, 7, 0, 6, 5]
+    assert dbm.index_order('user', 'age', reverse=True) == [5, 6, 0, 7, 3, 2, 4]
+
+    # the snapshot is the sorted (key, rowid) array
+    result = dbm.compact_table('user', renumber=True)
+    with open(os.path.join(tmpdir, 'test_db', 'user', '.index.age_idx'), 'rb') as fd:
+        entries = list(BtreeIndex.entry.iter_unpack(fd.read()))
+    assert entries == sorted(entries)
+    assert [rowid for _, rowid in entries] == \
+        [result.rowids[rowid] for rowid in [4, 2, 3, 7, 0, 6, 5]]
+
+def test_btree_index_pages(tmpdir, monkeypatch):
+    monkeypatch.setattr(BtreeIndex, 'PAGE_SIZE', 4)
+    index = BtreeIndex(os.path.join(tmpdir, '.index.age_idx'), 'age', 'int')
+    keys = {}
+    # keys set, changed and removed in a scrambled order split and empty pages
+    for i in range(200):
+        rowid = (i * 37) % 60
+        if i % 5 == 4:
+            index.delete([rowid])
+            keys.pop(rowid, None)
+        else:
+            index.put([{'_rowid': rowid, 'age': str(i % 23)}])
+            keys[rowid] = i % 23
+
+    assert all(len(page) <= 4 for page in index._pages)
+    assert list(index.iter_rowids()) == [rowid for _, rowid in
+                                         sorted((key, rowid) for rowid, key in keys.items())]
+    for op, test in [('=', lambda a: a == 7), ('<', lambda a: a < 7), ('>=', lambda a: a >= 7)]:
+        assert index.lookup(op, 7) == {rowid for rowid, key in keys.items() if test(key)}
+    assert index.lookup_many([('>', 3), ('<=', 12)]) == \
+        {rowid for rowid, key in keys.items() if 3 < key <= 12}
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_bitmap_index(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+
+    dbm.create_table('user', {'name':'str','isdead':'bool','employed':'bool'}, storage=storage)
+    rows = [{'name':f'"User{i}"','isdead':str(i % 3 == 0),'employed':str(i % 2 == 0)}
+            for i in range(30)]
+    dbm.insert_rows('user', rows)
+    dbm.insert_row('user', {'name':'"Nobody"','isdead':'','employed':''})
+    dbm.create_index('user', 'isdead_idx', 'isdead', kind='bitmap')
+    dbm.create_index('user', 'employed_idx', 'employed', kind='bitmap')
+    with pytest.raises(AssertionError):
+        dbm.create_index('user', 'name_idx', 'name', kind='bitmap')
+
+    dead = dbm.index_bitmap('user', 'isdead', '=', True)
+    employed = dbm.index_bitmap('user', 'employed', '=', True)
+    assert bitmap_rowids(dead) == set(range(0, 30, 3))
+    assert bitmap_rowids(dead & employed) == set(range(0, 30, 6))
+    assert bitmap_rowids(dbm.index_bitmap('user', 'isdead', '=', False)) == \
+        {i for i in range(30) if i % 3}
+    assert dbm.index_lookup('user', 'employed', [('=', False)]) == set(range(1, 30, 2))
+    assert dbm.index_bitmap('user', 'name', '=', 'User1') is None
+
+    # maintained by every change and seen by other managers
+    dbm.update_row('user', 3, {'isdead': 'False'})
+    dbm.delete_row('user', 6)
+    dbm.update_row('user', 30, {'isdead': 'True'})
+    other = DbManager(tmpdir)
+    other.use_db('test_db')
+    assert bitmap_rowids(other.index_bitmap('user', 'isdead', '=', True)) == \
+        set(range(0, 30, 3)) - {3, 6} | {30}
+
+    # stored compressed
+    path = os.path.join(tmpdir, 'test_db', 'user', '.index.isdead_idx')
+    assert zlib.decompress(open(path, 'rb').read())
+
+    # (a seq scan cannot compare empty cells)
+    dbm.update_row('user', 30, {'employed': 'True'})
+    qp = QueryParser()
+    query = 'query name user where op:{} conditions isdead=True employed=False;'
+    and_rows = list(qp.parse(query.format('and')).execute(dbm))
+    or_rows = list(qp.parse(query.format('or')).execute(dbm))
+    assert sorted(r['_rowid'] for r in and_rows) == [9, 15, 21, 27]
+    assert sorted(r['_rowid'] for r in or_rows) == \
+        sorted(set(range(1, 30, 2)) | set(range(0, 30, 3)) - {3, 6} | {30})
+
+def test_bitmap_index_keys(tmpdir):
+    path = os.path.join(tmpdir, '.index.isdead_idx')
+    index = BitmapIndex(path, 'isdead', 'bool')
+    index.build([{'_rowid': rowid, 'isdead': str(rowid % 2 == 0)} for rowid in range(100)])
+
+    # the key of every rowid is known (also when loaded from the snapshot),
+    # so a change only touches the bitmaps of the old and the new key
+    index = BitmapIndex(path, 'isdead', 'bool')
+    index.catch_up()
+    false = index._bitmaps[False]
+    index.put([{'_rowid': 4, 'isdead': 'True'}, {'_rowid': 100, 'isdead': 'True'}])
+    assert index.bitmap('=', True) == sum(1 << rowid for rowid in range(0, 101, 2))
+    assert index._bitmaps[False] is false
+    index.put([{'_rowid': 4, 'isdead': 'False'}, {'_rowid': 6, 'isdead': ''}])
+    index.delete([8])
+    assert bitmap_rowids(index.bitmap('=', True)) == set(range(0, 101, 2)) - {4, 6, 8}
+    assert bitmap_rowids(index.bitmap('=', False)) == set(range(1, 100, 2)) | {4}
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_query_by_rowid(tmpdir, storage, monkeypatch):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(10)])
+    dbm.delete_row('user', 4)
+
+    # the rows are read directly, never scanned
+    storage_class = type(dbm._table_storage(os.path.join(tmpdir, 'test_db', 'user')))
+    monkeypatch.setattr(storage_class, 'scan_parallel', None)
+    monkeypatch.setattr(storage_class, 'row_dirs', None, raising=False)
+
+    qp = QueryParser()
+    def query(conditions):
+        cmd = qp.parse(f'query age user where {conditions};')
+        return [row['_rowid'] for row in cmd.execute(dbm)]
+
+    assert query('op:and conditions _rowid=5') == [5]
+    assert query('op:and conditions _rowid=4') == []
+    assert query('op:and conditions _rowid>2 _rowid<=6') == [3, 5, 6]
+    assert query('op:and conditions _rowid>=8 age<9') == [8]
+    assert query('op:or conditions _rowid=1 _rowid>7') == [1, 8, 9]
+    assert query('op:and conditions _rowid>42') == []
+
+    qp.parse('update user set age=42 where op:and conditions _rowid=5;').execute(dbm)
+    qp.parse('delete in user where op:and conditions _rowid<2;').execute(dbm)
+    assert query('op:and conditions _rowid<6') == [2, 3, 5]
+    assert list(qp.parse('query age user where op:and conditions _rowid=5;').execute(dbm)) == \
+        [{'_rowid': 5, 'age': 42}]
+
+def test_explain(tmpdir):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    for storage in ('dirs', 'packed'):
+        dbm.create_table(storage, {'name':'str','age':'int'}, storage=storage)
+        dbm.insert_rows(storage, [{'name':f'"User{i % 10}"','age':str(i)} for i in range(200)])
+        dbm.create_index(storage, 'name_idx', 'name')
+
+    qp = QueryParser()
+    def plan(query):
+        return [line['plan'].strip(' ->') for line in qp.parse(f'explain {query};').execute(dbm)]
+
+    # fetching 10% of the rows by rowid is cheaper than scanning
+    # a row dir per row, but not than scanning segments
+    assert plan('query name dirs where op:and conditions name="User1"') == \
+        ['Project name', "Index Scan on dirs (dirs) using name_idx filter op:and name='User1'"]
+    assert plan('query name packed where op:and conditions name="User1"') == \
+        ['Project name', "Seq Scan on packed (packed) filter op:and name='User1'"]
+    assert plan('query * packed where op:and conditions _rowid=5')[-1] == \
+        'Rowid Scan on packed (packed) rowids 5..5 filter op:and _rowid=5'
+    assert plan('delete in dirs where op:or conditions age>150') == \
+        ['Delete in dirs', 'Seq Scan on dirs (dirs) filter op:or age>150']
+    assert plan('update packed set age=1') == ['Update packed set age=1', 'Seq Scan on packed (packed)']
+
+    lines = qp.parse('explain analyze update dirs set age=0 where op:and conditions age>=150;').execute(dbm)
+    assert [line['actual_rows'] for line in lines] == [50, 50]
+    assert lines[0]['rows'] == 67 and lines[1]['rows'] == 67
+    # only the file of the age cell of the scanned rows
+    assert lines[1]['files_opened'] == 200
+    assert lines[1]['bytes_read'] > 0 and lines[0]['time_ms'] >= lines[1]['time_ms'] > 0
+    assert len([r for r in dbm.scan_rows('dirs') if r['age'] == '0']) == 51
+
+    dbm.query_processes = 2
+    assert plan('query name packed where op:and conditions age>0') == \
+        ['Gather 8 partitions on 2 processes', 'Project name',
+         'Seq Scan on packed (packed) filter op:and age>0']
+    lines = qp.parse('explain analyze query name packed where op:and conditions age>0;').execute(dbm)
+    assert lines[0]['actual_rows'] == 199 and 'actual_rows' not in lines[1]
+    dbm.close()
+
+@pytest.mark.parametrize('workers', [0, 4])
+def test_query_limit(tmpdir, workers):
+    dbm = DbManager(tmpdir, scan_workers=workers, query_processes=2)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int'})
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(100)])
+
+    qp = QueryParser()
+    def query(query):
+        files_opened = IO_STATS.files_opened
+        rows = list(qp.parse(query).execute(dbm))
+        return rows, IO_STATS.files_opened - files_opened
+
+    rows, files_opened = query('query name user limit 3 offset 2;')
+    assert len(rows) == 3 and all(row['name'].startswith('User') for row in rows)
+    # the scan stops at the limit (a file per row read); a parallel
+    # scan only reads ahead as many rows as the limit needs
+    assert files_opened == 5 if not workers else 5 <= files_opened <= 10
+
+    rows, files_opened = query('query age user where op:and conditions age>=90 limit 4;')
+    assert len(rows) == 4 and all(row['age'] >= 90 for row in rows)
+    assert files_opened < 100 + 4 * 2
+    assert len(query('query age user where op:and conditions age>=90 offset 8;')[0]) == 2
+    assert query('query age user limit 0;') == ([], 0)
+
+    lines = qp.parse('explain query name user limit 3 offset 2;').execute(dbm)
+    assert [line['plan'].strip(' ->') for line in lines] == \
+        ['Limit 3 offset 2', 'Project name', 'Seq Scan on user (dirs)']
+    assert lines[0]['rows'] == 3 and lines[0]['cost'] == 5.05
+    dbm.close()
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_query_order_by(tmpdir, storage):
+    dbm = DbManager(tmpdir, sort_memory=2000)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    ages = [(i * 37) % 50 for i in range(100)]
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(age)} for i, age in enumerate(ages)])
+
+    qp = QueryParser()
+    spills = []
+    real_mkdtemp = tempfile.mkdtemp
+    def mkdtemp(*args, **kwargs):
+        spills.append(real_mkdtemp(*args, **kwargs))
+        return spills[-1]
+
+    with mock.patch('tempfile.mkdtemp', mkdtemp):
+        rows = list(qp.parse('query name,age user order by age;').execute(dbm))
+    assert [row['age'] for row in rows] == sorted(ages)
+    # the rows spill to disk, under the database dir, and are cleaned up
+    assert spills and all(os.path.dirname(spill) == dbm.db_path for spill in spills)
+    assert not any(os.path.exists(spill) for spill in spills)
+
+    rows = list(qp.parse('query age user where op:and conditions age<10 order by age desc limit 3;')
+                .execute(dbm))
+    assert [row['age'] for row in rows] == [9, 9, 8]
+
+    lines = qp.parse('explain query name user order by age desc;').execute(dbm)
+    assert [line['plan'].strip(' ->') for line in lines] == \
+        ['Project name', 'Sort by age desc', f'Seq Scan on user ({storage})']
+    # with a limit, only the first rows are kept (in a bounded heap)
+    lines = qp.parse('explain query name user order by age limit 5 offset 2;').execute(dbm)
+    assert [line['plan'].strip(' ->') for line in lines] == \
+        ['Limit 5 offset 2', 'Project name', 'Top-K Sort 7 by age asc', f'Seq Scan on user ({storage})']
+    rows = list(qp.parse('query name,age user order by age limit 5 offset 2;').execute(dbm))
+    assert [row['age'] for row in rows] == sorted(ages)[2:7]
+
+    # an ordered index reads the rows in order, without sorting them
+    qp.parse('create index age_idx on user(age) using btree;').execute(dbm)
+    assert [row['age'] for row in qp.parse('query age user order by age desc;').execute(dbm)] == \
+        sorted(ages, reverse=True)
+    lines = qp.parse('explain query name user order by age desc limit 2;').execute(dbm)
+    assert [line['plan'].strip(' ->') for line in lines] == \
+        ['Limit 2', 'Project name',
+         f'Index Scan on user ({storage}) using age_idx order by age desc']
+
+    # empty cells are not indexed, so the rows are sorted as without the index
+    dbm.add_column('user', 'score', 'int')
+    qp.parse('create index score_idx on user(score) using btree;').execute(dbm)
+    dbm.update_row('user', 0, {'score': '1'})
+    lines = qp.parse('explain query name user order by score;').execute(dbm)
+    assert [line['plan'].strip(' ->') for line in lines] == \
+        ['Project name', 'Sort by score asc', f'Seq Scan on user ({storage})']
+    with pytest.raises(ValueError):
+        list(qp.parse('query name user order by score;').execute(dbm))
+    dbm.close()
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_query_group_by(tmpdir, storage):
+    dbm = DbManager(tmpdir, aggregate_memory=2000)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int','employed':'bool'}, storage=storage)
+    users = [(f'User{i % 7}', (i * 37) % 50, i % 3 == 0) for i in range(100)]
+    dbm.insert_rows('user', [{'name':f'"{name}"','age':str(age),'employed':str(employed)}
+                             for name, age, employed in users])
+
+    qp = QueryParser()
+    spills = []
+    real_mkdtemp = tempfile.mkdtemp
+    def mkdtemp(*args, **kwargs):
+        spills.append(real_mkdtemp(*args, **kwargs))
+        return spills[-1]
+
+    with mock.patch('tempfile.mkdtemp', mkdtemp):
+        rows = list(qp.parse('query age,count(*),min(name) user where op:and conditions employed=True '
+                             'group by age;').execute(dbm))
+    expected = {}
+    for name, age, employed in users:
+        if employed:
+            count, min_name = expected.get(age, (0, name))
+            expected[age] = (count + 1, min(min_name, name))
+    assert {row['age']: (row['count(*)'], row['min(name)']) for row in rows} == expected
+    assert all(list(row) == ['age', 'count(*)', 'min(name)'] for row in rows)
+    # the groups spill to disk, under the database dir, and are cleaned up
+    assert spills and all(os.path.dirname(spill) == dbm.db_path for spill in spills)
+    assert not any(os.path.exists(spill) for spill in spills)
+
+    rows = list(qp.parse('query sum(age),avg(age),max(age),count(name) user;').execute(dbm))
+    ages = [age for _, age, _ in users]
+    assert rows == [{'sum(age)': sum(ages), 'avg(age)': sum(ages) / 100, 'max(age)': 49,
+                     'count(name)': 100}]
+    assert list(qp.parse('query count(*),avg(age) user where op:and conditions age>100;')
+                .execute(dbm)) == [{'count(*)': 0, 'avg(age)': None}]
+
+    rows = list(qp.parse('query employed,count(*) user group by employed order by employed desc;')
+                .execute(dbm))
+    assert rows == [{'employed': True, 'count(*)': 34}, {'employed': False, 'count(*)': 66}]
+
+    lines = qp.parse('explain query employed,count(*) user group by employed order by employed;') \
+        .execute(dbm)
+    assert [line['plan'].strip(' ->') for line in lines] == \
+        ['Project employed,count(*)', 'Sort by employed asc', 'Hash Aggregate count(*) by employed',
+         f'Seq Scan on user ({storage})']
+    dbm.close()
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_query_count(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    dbm.create_table('item', {'name':'str'})
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(100)])
+    dbm.delete_row('user', 0)
+    dbm.delete_row('user', 1)
+
+    qp = QueryParser()
+    def query(query):
+        files_opened = IO_STATS.files_opened
+        rows = list(qp.parse(query).execute(dbm))
+        return rows, IO_STATS.files_opened - files_opened
+
+    # without conditions, the rows are counted by the table metadata
+    # (no row is read)
+    assert query('query count(*) user;') == ([{'count(*)': 98}], 0)
+    lines = qp.parse('explain query count(*) user;').execute(dbm)
+    assert [line['plan'].strip(' ->') for line in lines] == \
+        ['Project count(*)', 'Meta Count count(*) on user']
+
+    # with conditions, only the cells they need are read
+    rows, files_opened = query('query count(*) user where op:and conditions age>=50;')
+    assert rows == [{'count(*)': 50}]
+    if storage == 'dirs':
+        assert files_opened == 98
+    lines = qp.parse('explain query count(*) user where op:and conditions age>=50;').execute(dbm)
+    assert [line['plan'].strip(' ->') for line in lines][:2] == ['Project count(*)', 'Count count(*)']
+
+    assert sorted(qp.parse('tables test_db with counts;').execute(dbm), key=lambda row: row['table']) == \
+        [{'table': 'item', 'count': 0}, {'table': 'user', 'count': 98}]
+    assert sorted(dbm.get_table_counts('test_db')) == [('item', 0), ('user', 98)]
+    dbm.close()
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_query_join(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    dbm.create_table('thing', {'title':'str','owner':'int','ownername':'str'}, storage=storage)
+    dbm.insert_rows('user', [{'name':f'"User{i}"','age':str(i)} for i in range(10)])
+    dbm.insert_rows('thing', [{'title':f'"Thing{i}"','owner':str(i % 12),'ownername':f'"User{i % 12}"'}
+                              for i in range(60)])
+
+    qp = QueryParser()
+    def join(query):
+        return sorted(qp.parse(query).execute(dbm), key=lambda row: sorted(row.items()))
+    def plan(query):
+        return [line['plan'].strip(' ->') for line in qp.parse(f'explain {query}').execute(dbm)]
+
+    expected = sorted(({'user.name': f'User{i % 12}', 'thing.title': f'Thing{i}'}
+                       for i in range(60) if i % 12 < 3 and i % 5),
+                      key=lambda row: sorted(row.items()))
+    queries = ['query user.name,thing.title user join thing on thing.owner=user._rowid '
+               'where op:and conditions user.age<3 thing.title!="Thing0" thing.title!="Thing5" '
+               'thing.title!="Thing10" thing.title!="Thing15" thing.title!="Thing20" '
+               'thing.title!="Thing25" thing.title!="Thing30" thing.title!="Thing35" '
+               'thing.title!="Thing40" thing.title!="Thing45" thing.title!="Thing50" '
+               'thing.title!="Thing55";',
+               'query user.name,thing.title thing join user on user.name=thing.ownername '
+               'where op:and conditions user.age<3 thing.title!="Thing0" thing.title!="Thing5" '
+               'thing.title!="Thing10" thing.title!="Thing15" thing.title!="Thing20" '
+               'thing.title!="Thing25" thing.title!="Thing30" thing.title!="Thing35" '
+               'thing.title!="Thing40" thing.title!="Thing45" thing.title!="Thing50" '
+               'thing.title!="Thing55";']
+    for query in queries:
+        assert join(query) == expected
+
+    # the smaller table is the build side of a hash join
+    assert plan('query * thing join user on thing.owner=user._rowid;') == \
+        ['Project thing._rowid,thing.title,thing.owner,thing.ownername,user._rowid,user.name,user.age',
+         'Hash Join on user._rowid=thing.owner build user',
+         f'Seq Scan on user ({storage})', f'Seq Scan on thing ({storage})']
+    rows = list(qp.parse('query * thing join user on thing.owner=user._rowid limit 1;').execute(dbm))
+    assert len(rows) == 1 and rows[0]['thing.owner'] == rows[0]['user._rowid'] == rows[0]['user.age']
+
+    # an index of the column of the larger table makes it looked up
+    qp.parse('create index owner_idx on thing(owner);').execute(dbm)
+    assert plan('query user.name,thing.title user join thing on thing.owner=user._rowid '
+                'where op:and conditions user.age<3;') == \
+        ['Project user.name,thing.title', 'Index Nested Loop Join on user._rowid=thing.owner',
+         f'Seq Scan on user ({storage}) filter op:and age<3',
+         f'Index Scan on thing ({storage}) using owner_idx']
+    for query in queries:
+        assert join(query) == expected
+    dbm.close()
+
+def test_top_k():
+    rows = [{'key': (i * 7) % 10, 'i': i} for i in range(100)]
+    # stable, like sorted
+    assert top_k(rows, itemgetter('key'), 15) == sorted(rows, key=itemgetter('key'))[:15]
+    assert top_k(iter(rows), itemgetter('key'), 15, reverse=True) == \
+        sorted(rows, key=itemgetter('key'), reverse=True)[:15]
+    assert top_k(rows, itemgetter('key'), 0) == []
+    assert top_k(rows, itemgetter('key'), 200) == sorted(rows, key=itemgetter('key'))
+
+def test_external_sort(tmpdir):
+    rows = [{'key': (i * 7) % 10, 'i': i} for i in range(100)]
+    result = list(external_sort(rows, itemgetter('key'), memory=500, spill_path=str(tmpdir),
+                                fan_in=2))
+    # stable, across merge passes
+    assert result == sorted(rows, key=itemgetter('key'))
+    assert list(external_sort(rows, itemgetter('key'), reverse=True, memory=500,
+                              spill_path=str(tmpdir), fan_in=3)) == \
+        sorted(rows, key=itemgetter('key'), reverse=True)
+    assert list(external_sort([], itemgetter('key'))) == []
+
+    sorted_rows = external_sort(rows, itemgetter('key'), memory=500, spill_path=str(tmpdir))
+    next(sorted_rows)
+    assert len(os.listdir(tmpdir)) == 1
+    sorted_rows.close()
+    assert os.listdir(tmpdir) == []
+
+@pytest.mark.parametrize('storage', ['dirs', 'packed', 'columns'])
+def test_query_with_index(tmpdir, storage):
+    dbm = DbManager(tmpdir)
+    dbm.create_db('test_db')
+    dbm.use_db('test_db')
+    dbm.create_table('user', {'name':'str','age':'int'}, storage=storage)
+    dbm.insert_rows('user', [{'name':f'"User{i % 4}"','age':str(i)} for i in range(20)])
+
+    qp = QueryParser()
+    queries = ['query * user where op:and conditions name="User1" age>6;',
+               'query age user where op:or conditions name="User1" name="User2";',
+               'query name user where op:and conditions age>=5 age<12 name="User3";']
+    expected = [sorted(qp.parse(query).execute(dbm), key=lambda r: r['_rowid'])
+                for query in queries]
+
+    qp.parse('create index name_idx on user(name);').execute(dbm)
+    qp.parse('create index age_idx on user(age) using btree;').execute(dbm)
+    for query, rows in zip(queries, expected):
+        assert list(qp.parse(query).execute(dbm)) == rows
+
+    qp.parse('update user set age=0 where op:and conditions name="User3";').execute(dbm)
+    qp.parse('delete in user where op:and conditions name="User2";').execute(dbm)
+    assert sorted(r['age'] for r in dbm.scan_rows('user') if r['name'] == '"User3"') == ['0'] * 5
+    assert dbm.index_lookup('user', 'name', [('=', 'User2')]) == set()
+    assert dbm.get_table_meta('user').count == 15
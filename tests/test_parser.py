@@ -1,5 +1,7 @@
 from sdbms.core import QueryParser, DbManager
 from sdbms.core._parser import *
+from sdbms.core._manager import CompactResult, TableMeta
+from sdbms.core._index import IndexInfo
 
 import pytest
 import unittest.mock
@@ -86,6 +88,9 @@ def test_literal_gibberish_exception(input_gibberish):
 
         ({'foo': '1'}, Literal('1'), '=', Column('foo'), True),
         ({'foo': '1'}, Literal('2'), '=', Column('foo'), False),
+
+        ({'_rowid': 5}, Column('_rowid'), '=', Literal('5'), True),
+        ({'_rowid': 5}, Column('_rowid'), '<', Literal('5'), False),
     ])
 def test_comparison_match_okay(row, left, op, right, res):
     comp = Comparison(left, op, right)
@@ -171,6 +176,41 @@ def test_comparison_match_val_not_okay():
 def test_condition_list_okay(row, op, comparisons, res):
     condition_list = ConditionList(op, comparisons)
     assert condition_list.match(row) == res
+    assert condition_list.compile({'foo': 'int', 'baz': 'bool', 'bar': 'str'})(row) == res
+
+
+def test_condition_list_compile():
+    schema = {'foo': 'int', 'baz': 'bool', 'bar': 'str'}
+    conditions = ConditionList('and', [Comparison(Column('bar'), '=', Literal('"Lorem"')),
+                                       Comparison(Column('foo'), '>', Literal('0')),
+                                       Comparison(Column('baz'), '=', Literal('False')),
+                                       Comparison(Column('_rowid'), '<', Literal('5'))])
+    predicate = conditions.compile(schema)
+    # the cheapest comparisons are evaluated first, so the other cells
+    # of a row are not even decoded
+    assert predicate({'_rowid': 7, 'baz': 'False'}) is False
+    assert predicate({'_rowid': 1, 'foo': '1', 'baz': 'False', 'bar': '"Lorem"'}) is True
+    assert predicate({'_rowid': 1, 'foo': '1', 'baz': 'False', 'bar': '"Ipsum"'}) is False
+    assert predicate({'_rowid': 1, 'foo': '1', 'baz': 'False', 'bar': '"a\\"Lorem"'}) is False
+
+    # the cells which cannot be decoded fail as with match
+    with pytest.raises(ValueError):
+        predicate({'_rowid': 1, 'foo': '', 'baz': 'False', 'bar': '"Lorem"'})
+    with pytest.raises(ValueError):
+        predicate({'_rowid': 1, 'foo': '1', 'baz': '', 'bar': '"Lorem"'})
+
+    conditions = ConditionList('or', [Comparison(Column('bar'), '=', Literal('"Lorem"')),
+                                      Comparison(Column('foo'), '=', Literal('1'))])
+    predicate = conditions.compile(schema)
+    assert predicate({'foo': '1'}) is True
+    assert predicate({'foo': '2', 'bar': '"Lorem"'}) is True
+    assert predicate({'foo': '2', 'bar': '"Ipsum"'}) is False
+
+    # records decoded by the schema are compared as they are
+    predicate = conditions.compile(schema, typed=True)
+    assert predicate({'foo': 1}) is True
+    assert predicate({'foo': 2, 'bar': 'Lorem'}) is True
+    assert predicate({'foo': 2, 'bar': 'Ipsum'}) is False
 
 
 def test_condition_list_comp_not_okay():
@@ -189,7 +229,13 @@ def test_condition_list_op_not_okay():
 @pytest.fixture
 def mock_dbmanager():
     mock_dbmanager_cls = unittest.mock.create_autospec(DbManager, spec_set=True)
-    return mock_dbmanager_cls()
+    mock_dbmanager = mock_dbmanager_cls()
+    # statistics of a (planned) table
+    mock_dbmanager.get_table_meta.return_value = TableMeta(next_rowid=100, count=100, version=1)
+    mock_dbmanager.get_table_storage.return_value = 'dirs'
+    # the results are not cached
+    mock_dbmanager.cached_rows.side_effect = lambda key, tables, execute: execute()
+    return mock_dbmanager
 
 @pytest.mark.parametrize(
     'cmd_class, kwargs, dbm_method',
@@ -209,7 +255,8 @@ def test_simple_cmds(mock_dbmanager, cmd_class, kwargs, dbm_method):
 
 def test_create_table_cmd_okay(mock_dbmanager):
     input_kwargs = {'name': 'test',
-                    'schema': {'foo': 'str', 'baz': 'int', 'bar': 'bool'}}
+                    'schema': {'foo': 'str', 'baz': 'int', 'bar': 'bool'},
+                    'storage': None}
     cmd = CreateTableCmd(**input_kwargs)
     cmd.execute(mock_dbmanager)
     mock_dbmanager.create_table.assert_called_once_with(**input_kwargs)
@@ -222,6 +269,41 @@ def test_create_table_cmd_not_okay(mock_dbmanager):
         cmd.execute(mock_dbmanager)
         assert 'Only schema accepted types' in str(ex)
 
+def test_create_table_cmd_storage_okay(mock_dbmanager):
+    input_kwargs = {'name': 'test',
+                    'schema': {'foo': 'str', 'baz': 'int'},
+                    'storage': 'packed'}
+    cmd = CreateTableCmd(**input_kwargs)
+    cmd.execute(mock_dbmanager)
+    mock_dbmanager.create_table.assert_called_once_with(**input_kwargs)
+
+def test_create_table_cmd_storage_not_okay(mock_dbmanager):
+    input_kwargs = {'name': 'test',
+                    'schema': {'foo': 'str', 'baz': 'int'},
+                    'storage': 'foo'}
+    cmd = CreateTableCmd(**input_kwargs)
+    with pytest.raises(CommandError) as ex:
+        cmd.execute(mock_dbmanager)
+        assert 'Only accepted storages' in str(ex)
+
+def test_vacuum_cmd_okay(mock_dbmanager):
+    mock_dbmanager.compact_table.return_value = CompactResult(
+        rows=2, storage='packed', bytes_before=9000, bytes_after=4000,
+        inodes_before=12, inodes_after=4, rowids=None)
+    cmd = VacuumCmd(table='test', storage='packed', renumber=False)
+    rv = cmd.execute(mock_dbmanager)
+    mock_dbmanager.compact_table.assert_called_once_with(name='test', storage='packed',
+                                                         renumber=False)
+    assert rv == {'rows': 2, 'storage': 'packed',
+                  'bytes_reclaimed': 5000, 'inodes_reclaimed': 8}
+
+def test_vacuum_cmd_not_okay(mock_dbmanager):
+    cmd = VacuumCmd(table='test', storage='foo', renumber=True)
+    with pytest.raises(CommandError) as ex:
+        cmd.execute(mock_dbmanager)
+    assert 'Only accepted storages' in str(ex.value)
+    mock_dbmanager.compact_table.assert_not_called()
+
 def test_add_columns_cmd_okay(mock_dbmanager):
     input_kwargs = {'name': 'test', 'col_type': 'str', 'col_name': 'foo'}
     cmd = AddColumnCmd(**input_kwargs)
@@ -258,6 +340,246 @@ def test_del_column_cmd_not_existing(mock_dbmanager):
         cmd.execute(mock_dbmanager)
         assert 'Col foo does not exist' == str(ex)
 
+def test_insert_rows_cmd_okay(mock_dbmanager):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str', 'baz': 'int'}
+    input_kwargs = {'table': 'test',
+                    'rows': [{'foo': '"a"', 'baz': '1'}, {'foo': '"b"', 'baz': '2'}]}
+    cmd = InsertRowsCmd(**input_kwargs)
+    cmd.execute(mock_dbmanager)
+
+    mock_dbmanager.get_table_schema.assert_called_once_with(table_name='test')
+    mock_dbmanager.insert_rows.assert_called_once_with(**input_kwargs)
+
+@pytest.mark.parametrize(
+    'rows',
+    [
+        [{'foo': '"a"', 'baz': '1'}, {'foo': '"b"'}],
+        [{'foo': '"a"', 'baz': '1'}, {'foo': '"b"', 'baz': '"2"'}],
+    ])
+def test_insert_rows_cmd_not_okay(mock_dbmanager, rows):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str', 'baz': 'int'}
+    cmd = InsertRowsCmd(table='test', rows=rows)
+    with pytest.raises(CommandError):
+        cmd.execute(mock_dbmanager)
+    mock_dbmanager.insert_rows.assert_not_called()
+
+def test_query_cmd_scan_columns(mock_dbmanager):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str', 'baz': 'int', 'bar': 'bool'}
+    mock_dbmanager.scan_rows.return_value = iter([{'_rowid': 0, 'foo': 'a', 'baz': 1}])
+    conditions = ConditionList('or', [Comparison(Column('baz'), '=', Literal('1'))])
+    cmd = QueryCmd(table='test', projection=['foo'], conditions_list=conditions)
+
+    assert list(cmd.execute(mock_dbmanager)) == [{'_rowid': 0, 'foo': 'a'}]
+    mock_dbmanager.scan_rows.assert_called_once_with(table='test', columns=['foo', 'baz'],
+                                                     lazy=True, rowid_range=None, rowids=None,
+                                                     typed=True, predicate=unittest.mock.ANY,
+                                                     predicate_columns=['baz'])
+
+def test_query_cmd_order_by(mock_dbmanager):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str', 'baz': 'int'}
+    mock_dbmanager.get_table_indexes.return_value = {'baz_idx': IndexInfo('baz', 'btree')}
+    mock_dbmanager.index_order.return_value = None
+    cmd = QueryCmd(table='test', projection=['foo'], conditions_list=ConditionList('', []),
+                   order_by='baz', descending=True)
+
+    # the rows are sorted when the index can not order them
+    plan = cmd.plan(mock_dbmanager)
+    assert [line['plan'].strip(' ->') for line in plan.explain()] == \
+        ['Project foo', 'Sort by baz desc', 'Seq Scan on test (dirs)']
+    mock_dbmanager.index_order.assert_called_once_with('test', 'baz', reverse=True)
+
+    mock_dbmanager.index_order.return_value = [2, 0, 1]
+    plan = cmd.plan(mock_dbmanager)
+    assert [line['plan'].strip(' ->') for line in plan.explain()] == \
+        ['Project foo', 'Index Scan on test (dirs) using baz_idx order by baz desc']
+
+    with pytest.raises(CommandError):
+        list(QueryCmd(table='test', projection=['foo'], conditions_list=ConditionList('', []),
+                      order_by='bar').execute(mock_dbmanager))
+
+@pytest.mark.parametrize(
+    'projection, group_by, aggregates',
+    [
+        (['*'], ['foo'], None),
+        (['baz', 'count(*)'], ['foo'], [Aggregate('count', '*')]),
+        (['foo'], ['bar'], None),
+        (['sum(foo)'], None, [Aggregate('sum', 'foo')]),
+        (['max(bar)'], None, [Aggregate('max', 'bar')]),
+    ])
+def test_query_cmd_group_by_not_okay(mock_dbmanager, projection, group_by, aggregates):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str', 'baz': 'int'}
+    cmd = QueryCmd(table='test', projection=projection, conditions_list=ConditionList('', []),
+                   group_by=group_by, aggregates=aggregates)
+    with pytest.raises(CommandError):
+        list(cmd.execute(mock_dbmanager))
+    mock_dbmanager.scan_rows.assert_not_called()
+
+def test_query_cmd_index(mock_dbmanager):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str', 'baz': 'int'}
+    mock_dbmanager.get_table_indexes.return_value = {'foo_idx': IndexInfo('foo', 'hash')}
+    mock_dbmanager.index_lookup.return_value = {3, 1}
+    rows = [{'_rowid': 1, 'foo': 'a', 'baz': 1}, {'_rowid': 3, 'foo': 'a', 'baz': 2}]
+    # the predicate is pushed down into the scan
+    mock_dbmanager.scan_rows.side_effect = lambda predicate, **kwargs: filter(predicate, rows)
+    conditions = ConditionList('and', [Comparison(Column('foo'), '=', Literal('"a"')),
+                                       Comparison(Column('baz'), '>', Literal('1'))])
+    cmd = QueryCmd(table='test', projection=['baz'], conditions_list=conditions)
+
+    assert list(cmd.execute(mock_dbmanager)) == [{'_rowid': 3, 'baz': 2}]
+    mock_dbmanager.index_lookup.assert_called_once_with('test', 'foo', [('=', 'a')])
+    mock_dbmanager.scan_rows.assert_called_once_with(table='test', columns=['baz', 'foo'],
+                                                     lazy=True, rowid_range=None, rowids=[1, 3],
+                                                     typed=True, predicate=unittest.mock.ANY,
+                                                     predicate_columns=['foo', 'baz'])
+    mock_dbmanager.get_scan_partitions.assert_not_called()
+
+def test_lookup_rowids(mock_dbmanager):
+    mock_dbmanager.get_table_indexes.return_value = {'foo_idx': IndexInfo('foo', 'hash')}
+    def index_lookup(table, col, conditions):
+        if any(op != '=' for op, _ in conditions):
+            return None
+        return set.intersection(*[{'a': {1, 2}, 'b': {2, 5}}[value]
+                                  for _, value in conditions])
+    mock_dbmanager.index_lookup.side_effect = index_lookup
+    foo_a = Comparison(Column('foo'), '=', Literal('"a"'))
+    foo_b = Comparison(Column('foo'), '=', Literal('"b"'))
+    baz = Comparison(Column('baz'), '=', Literal('1'))
+
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList(None, [])) is None
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [foo_a, foo_b])) == [2]
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('or', [foo_a, foo_b])) == [1, 2, 5]
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [baz, foo_b])) == [2, 5]
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('or', [baz, foo_b])) is None
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [baz])) is None
+    # comparisons the index does not support
+    foo_gt = Comparison(Column('foo'), '>', Literal('"a"'))
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [foo_gt])) is None
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [foo_gt, foo_a])) == [1, 2]
+
+def test_lookup_rowids_ranges(mock_dbmanager):
+    mock_dbmanager.get_table_indexes.return_value = {'baz_idx': IndexInfo('baz', 'btree')}
+    mock_dbmanager.index_lookup.return_value = {7}
+    conditions = ConditionList('and', [Comparison(Column('baz'), '>', Literal('1')),
+                                       Comparison(Column('foo'), '=', Literal('"a"')),
+                                       Comparison(Column('baz'), '<=', Literal('9'))])
+
+    # the ranges of a column are intersected by a single lookup
+    assert lookup_rowids(mock_dbmanager, 'test', conditions) == [7]
+    mock_dbmanager.index_lookup.assert_called_once_with('test', 'baz', [('>', 1), ('<=', 9)])
+
+def test_lookup_rowids_bitmaps(mock_dbmanager):
+    mock_dbmanager.get_table_indexes.return_value = {'dead_idx': IndexInfo('isdead', 'bitmap'),
+                                                     'job_idx': IndexInfo('employed', 'bitmap'),
+                                                     'foo_idx': IndexInfo('foo', 'hash')}
+    mock_dbmanager.index_bitmap.side_effect = lambda table, col, op, value: {
+        ('isdead', True): 0b01101, ('employed', True): 0b10100}[col, value]
+    mock_dbmanager.index_lookup.return_value = {0, 4}
+    dead = Comparison(Column('isdead'), '=', Literal('True'))
+    employed = Comparison(Column('employed'), '=', Literal('True'))
+    foo = Comparison(Column('foo'), '=', Literal('"a"'))
+
+    # the bitmaps are combined before any rowid is collected
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [dead, employed])) == [2]
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('or', [dead, employed])) == [0, 2, 3, 4]
+    mock_dbmanager.index_lookup.assert_not_called()
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [dead, foo])) == [0]
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('or', [employed, foo])) == [0, 2, 4]
+
+def test_lookup_rowids_rowid(mock_dbmanager):
+    mock_dbmanager.get_table_indexes.return_value = {'foo_idx': IndexInfo('foo', 'hash')}
+    mock_dbmanager.get_table_meta.return_value = TableMeta(next_rowid=10, count=8, version=1)
+    mock_dbmanager.index_lookup.return_value = {1, 4, 8}
+
+    def rowid(op, value):
+        return Comparison(Column('_rowid'), op, Literal(str(value)))
+    foo = Comparison(Column('foo'), '=', Literal('"a"'))
+
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [rowid('=', 5)])) == range(5, 6)
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [rowid('>', 3), rowid('<=', 6)])) == range(4, 7)
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [rowid('>=', 7)])) == range(7, 10)
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [rowid('>', 7), rowid('<', 3)])) == range(8, 3)
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [rowid('!=', 7)])) is None
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('and', [rowid('<', 5), foo])) == [1, 4]
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('or', [rowid('=', 2), rowid('>', 8)])) == [2, 9]
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('or', [rowid('=', 2), foo])) == [1, 2, 4, 8]
+    assert lookup_rowids(mock_dbmanager, 'test', ConditionList('or', [rowid('!=', 2), foo])) is None
+
+def test_query_cmd_rowid_not_okay(mock_dbmanager):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str'}
+    conditions = ConditionList('and', [Comparison(Column('_rowid'), '=', Literal('"a"'))])
+    with pytest.raises(CommandError) as ex:
+        list(QueryCmd(table='test', projection=['foo'], conditions_list=conditions).execute(mock_dbmanager))
+    assert 'has to be int' in str(ex.value)
+
+def test_delete_cmd_index(mock_dbmanager):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str'}
+    mock_dbmanager.get_table_indexes.return_value = {'foo_idx': IndexInfo('foo', 'hash')}
+    mock_dbmanager.index_lookup.return_value = {4}
+    mock_dbmanager.scan_rows.return_value = iter([{'_rowid': 4, 'foo': '"a"'}])
+    conditions = ConditionList('or', [Comparison(Column('foo'), '=', Literal('"a"'))])
+
+    DeleteCmd(table='test', conditions_list=conditions).execute(mock_dbmanager)
+    # only the predicate columns are read
+    mock_dbmanager.scan_rows.assert_called_once_with(table='test', columns=[], lazy=False,
+                                                     rowid_range=None, rowids=[4], typed=False,
+                                                     predicate=unittest.mock.ANY,
+                                                     predicate_columns=['foo'])
+    mock_dbmanager.delete_row.assert_called_once_with(table='test', rowid=4)
+
+def test_create_index_cmd(mock_dbmanager):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str'}
+    mock_dbmanager.get_table_indexes.return_value = {'foo_idx': IndexInfo('foo', 'hash')}
+
+    CreateIndexCmd(name='foo_idx2', table='test', col_name='foo', kind='hash').execute(mock_dbmanager)
+    mock_dbmanager.create_index.assert_called_once_with(table='test', name='foo_idx2',
+                                                        col_name='foo', kind='hash')
+
+    with pytest.raises(CommandError) as ex:
+        CreateIndexCmd(name='foo_idx', table='test', col_name='foo', kind='hash').execute(mock_dbmanager)
+    assert 'is already existing' in str(ex.value)
+    with pytest.raises(CommandError) as ex:
+        CreateIndexCmd(name='bar_idx', table='test', col_name='bar', kind='hash').execute(mock_dbmanager)
+    assert 'does not exist' in str(ex.value)
+    with pytest.raises(CommandError) as ex:
+        CreateIndexCmd(name='bar_idx', table='test', col_name='foo', kind='btree').execute(mock_dbmanager)
+    assert 'only accepts cols of types' in str(ex.value)
+    with pytest.raises(CommandError) as ex:
+        CreateIndexCmd(name='bar_idx', table='test', col_name='foo', kind='rtree').execute(mock_dbmanager)
+    assert 'Only accepted index kinds' in str(ex.value)
+
+def test_drop_index_cmd(mock_dbmanager):
+    mock_dbmanager.get_table_indexes.return_value = {'foo_idx': IndexInfo('foo', 'hash')}
+
+    DropIndexCmd(name='foo_idx', table='test').execute(mock_dbmanager)
+    mock_dbmanager.drop_index.assert_called_once_with(table='test', name='foo_idx')
+
+    with pytest.raises(CommandError) as ex:
+        DropIndexCmd(name='bar_idx', table='test').execute(mock_dbmanager)
+    assert 'does not exist' in str(ex.value)
+
+def test_explain_cmd(mock_dbmanager):
+    mock_dbmanager.get_table_schema.return_value = {'foo': 'str', 'baz': 'int'}
+    rows = [{'_rowid': 0, 'foo': 'a', 'baz': 1}, {'_rowid': 1, 'foo': 'b', 'baz': 2}]
+    mock_dbmanager.scan_rows.side_effect = lambda predicate, **kwargs: filter(predicate, rows)
+    conditions = ConditionList('and', [Comparison(Column('baz'), '>', Literal('1'))])
+    cmd = QueryCmd(table='test', projection=['foo'], conditions_list=conditions)
+
+    # foo is only read for the matching rows
+    lines = ExplainCmd(cmd=cmd, analyze=False).execute(mock_dbmanager)
+    assert lines == [{'plan': 'Project foo', 'rows': 33, 'cost': 135.33},
+                     {'plan': '  -> Seq Scan on test (dirs) filter op:and baz>1',
+                      'rows': 33, 'cost': 135.33}]
+    mock_dbmanager.scan_rows.assert_not_called()
+
+    lines = ExplainCmd(cmd=cmd, analyze=True).execute(mock_dbmanager)
+    assert [line['actual_rows'] for line in lines] == [1, 1]
+    assert all(line['time_ms'] >= 0 for line in lines)
+
+def test_literal_pickle():
+    import pickle
+    for literal in (Literal('"123"'), Literal('123'), Literal('True'), Literal('""')):
+        assert pickle.loads(pickle.dumps(literal)) == literal
+
 def test_schema_cmd_okay(mock_dbmanager):
     input_kwargs = {'table_name': 'test'}
     cmd = SchemaCmd(**input_kwargs)
@@ -272,9 +594,11 @@ def test_get_parse_methods():
 
     expected = {'_parse_db_create', '_parse_db_use', '_parse_db_delete',
                 '_parse_table_create', '_parse_table_delete', '_parse_add_column',
-                '_parse_del_column', '_parse_insert_row', '_parse_scan_rows', 
+                '_parse_del_column', '_parse_insert_row', '_parse_insert_rows', '_parse_scan_rows', 
                 '_parse_table_update_rows', '_parse_table_delete_rows', 
-                '_parse_tables', '_parse_db', '_parse_from_csv', '_parse_to_csv', '_parse_schema'}
+                '_parse_tables', '_parse_db', '_parse_from_csv', '_parse_to_csv', '_parse_schema',
+                '_parse_vacuum', '_parse_index_create', '_parse_index_drop', '_parse_explain',
+                '_parse_join'}
 
     assert methods_names == expected
 
@@ -332,6 +656,7 @@ def test_parse_db_delete(query, res_obj_class, internal_kwargs):
     'query, res_obj_class, internal_kwargs',
     [
         ('create table test columns str:name int:age bool:isdead;', CreateTableCmd, {'name': 'test', 'schema': {'name': 'str', 'age': 'int', 'isdead': 'bool'}}),
+        ('create table test storage:packed columns str:name int:age;', CreateTableCmd, {'name': 'test', 'schema': {'name': 'str', 'age': 'int'}, 'storage': 'packed'}),
         ('create table test columns foo:baz;', None.__class__, {}),
         ('create users foo baz;', None.__class__, {})
     ])
@@ -341,6 +666,67 @@ def test_parse_table_create(query, res_obj_class, internal_kwargs):
     assert cmd == res_obj_class(**internal_kwargs)
 
 
+@pytest.mark.parametrize(
+    'query, res_obj_class, internal_kwargs',
+    [
+        ('create index name_idx on test(name);', CreateIndexCmd, {'name': 'name_idx', 'table': 'test', 'col_name': 'name', 'kind': 'hash'}),
+        ('create index name_idx on test ( name );', CreateIndexCmd, {'name': 'name_idx', 'table': 'test', 'col_name': 'name', 'kind': 'hash'}),
+        ('create index age_idx on test(age) using btree;', CreateIndexCmd, {'name': 'age_idx', 'table': 'test', 'col_name': 'age', 'kind': 'btree'}),
+        ('create index name_idx test(name);', None.__class__, {})
+    ])
+def test_parse_index_create(query, res_obj_class, internal_kwargs):
+    qp = QueryParser()
+    cmd = qp._parse_index_create(query)
+    assert cmd == res_obj_class(**internal_kwargs)
+
+
+@pytest.mark.parametrize(
+    'query, res_obj_class, internal_kwargs',
+    [
+        ('explain query * test;', ExplainCmd, {'cmd': QueryCmd(table='test', projection=['*'], conditions_list=ConditionList('', [])), 'analyze': False}),
+        ('explain analyze delete in test;', ExplainCmd, {'cmd': DeleteCmd(table='test', conditions_list=ConditionList('', [])), 'analyze': True}),
+        ('explan query * test;', None.__class__, {}),
+    ])
+def test_parse_explain(query, res_obj_class, internal_kwargs):
+    qp = QueryParser()
+    cmd = qp._parse_explain(query)
+    assert cmd == res_obj_class(**internal_kwargs)
+
+def test_parse_explain_not_okay():
+    qp = QueryParser()
+    with pytest.raises(CommandError) as ex:
+        qp._parse_explain('explain schema test;')
+    assert 'can be explained' in str(ex.value)
+    with pytest.raises(CommandError):
+        qp._parse_explain('explain query * test')
+
+
+@pytest.mark.parametrize(
+    'query, res_obj_class, internal_kwargs',
+    [
+        ('drop index name_idx on test;', DropIndexCmd, {'name': 'name_idx', 'table': 'test'}),
+        ('drop index name_idx;', None.__class__, {})
+    ])
+def test_parse_index_drop(query, res_obj_class, internal_kwargs):
+    qp = QueryParser()
+    cmd = qp._parse_index_drop(query)
+    assert cmd == res_obj_class(**internal_kwargs)
+
+
+@pytest.mark.parametrize(
+    'query, res_obj_class, internal_kwargs',
+    [
+        ('vacuum test;', VacuumCmd, {'table': 'test', 'storage': None, 'renumber': False}),
+        ('vacuum test renumber;', VacuumCmd, {'table': 'test', 'storage': None, 'renumber': True}),
+        ('vacuum test storage:columns renumber;', VacuumCmd, {'table': 'test', 'storage': 'columns', 'renumber': True}),
+        ('vacuum test foo;', None.__class__, {})
+    ])
+def test_parse_vacuum(query, res_obj_class, internal_kwargs):
+    qp = QueryParser()
+    cmd = qp._parse_vacuum(query)
+    assert cmd == res_obj_class(**internal_kwargs)
+
+
 @pytest.mark.parametrize(
     'query, res_obj_class, internal_kwargs',
     [
@@ -403,6 +789,34 @@ def test_parse_insert_row(query, res_obj_class, internal_kwargs):
     assert cmd == res_obj_class(**internal_kwargs)
 
 
+@pytest.mark.parametrize(
+    'query, res_obj_class, internal_kwargs',
+    [
+        ('insert into test values (name="Foo" age=10 isdead=True);',
+         InsertRowsCmd,
+         {'table': 'test',
+          'rows': [{'name': '"Foo"', 'age': '10', 'isdead': 'True'}]}
+        ),
+
+        ('insert into test values (name="Foo (1), bar" age=10), (name="Baz" age=20),(name="" age=0);',
+         InsertRowsCmd,
+         {'table': 'test',
+          'rows': [{'name': '"Foo (1), bar"', 'age': '10'},
+                   {'name': '"Baz"', 'age': '20'},
+                   {'name': '""', 'age': '0'}]}
+        ),
+
+        ('insert into test values name="Foo" age=10;', None.__class__, {}),
+        ('insert into test values (name="Foo" age=10) (name="Baz" age=20);', None.__class__, {}),
+        ('insert into test values (name="Foo" age=10),;', None.__class__, {}),
+        ('insert into test values ();', None.__class__, {}),
+    ])
+def test_parse_insert_rows(query, res_obj_class, internal_kwargs):
+    qp = QueryParser()
+    cmd = qp._parse_insert_rows(query)
+    assert cmd == res_obj_class(**internal_kwargs)
+
+
 @pytest.mark.parametrize(
     'query, res_obj_class, internal_kwargs',
     [
@@ -422,7 +836,47 @@ def test_parse_insert_row(query, res_obj_class, internal_kwargs):
           }
         ),
 
+        ('query * test where op:and conditions _rowid>=3 _rowid<5;',
+         QueryCmd,
+         {'table': 'test', 'projection': ['*'],
+          'conditions_list': ConditionList('and', [Comparison(Column('_rowid'), '>=', Literal('3')), Comparison(Column('_rowid'), '<', Literal('5'))])
+          }
+        ),
+
+        ('query foo test where op:or conditions foo>1 limit 10 offset 5;',
+         QueryCmd,
+         {'table': 'test', 'projection': ['foo'],
+          'conditions_list': ConditionList('or', [Comparison(Column('foo'), '>', Literal('1')),]),
+          'limit': 10, 'offset': 5
+          }
+        ),
+        ('query * test offset 5;', QueryCmd, {'table': 'test', 'projection': ['*'], 'conditions_list': ConditionList('', []), 'offset': 5}),
+        ('query foo test order by baz;', QueryCmd, {'table': 'test', 'projection': ['foo'], 'conditions_list': ConditionList('', []), 'order_by': 'baz'}),
+        ('query foo test where op:and conditions foo>1 order by foo desc limit 3;',
+         QueryCmd,
+         {'table': 'test', 'projection': ['foo'],
+          'conditions_list': ConditionList('and', [Comparison(Column('foo'), '>', Literal('1')),]),
+          'order_by': 'foo', 'descending': True, 'limit': 3
+          }
+        ),
+
+        ('query age,count(*),avg(age) test where op:and conditions age>1 group by age order by age desc;',
+         QueryCmd,
+         {'table': 'test', 'projection': ['age', 'count(*)', 'avg(age)'],
+          'conditions_list': ConditionList('and', [Comparison(Column('age'), '>', Literal('1')),]),
+          'order_by': 'age', 'descending': True, 'group_by': ['age'],
+          'aggregates': [Aggregate('count', '*'), Aggregate('avg', 'age')]
+          }
+        ),
+        ('query count(*) test;', QueryCmd, {'table': 'test', 'projection': ['count(*)'], 'conditions_list': ConditionList('', []), 'aggregates': [Aggregate('count', '*')]}),
+
         ('query ** foo;', None.__class__, {}),
+        ('query sum(*) test;', None.__class__, {}),
+        ('query count(*) test group by;', None.__class__, {}),
+        ('query * test limit -1;', None.__class__, {}),
+        ('query * test offset 1 limit 1;', None.__class__, {}),
+        ('query * test limit 1 order by foo;', None.__class__, {}),
+        ('query * test order by foo up;', None.__class__, {}),
         ('query foo test where op:or;', None.__class__, {}),
         ('query foo test where op:and conditions foo is bar;', None.__class__, {}),
         ('query foo test where op:or 1<x<3 y!=True;', None.__class__, {}),
@@ -433,6 +887,55 @@ def test_parse_scan_rows(query, res_obj_class, internal_kwargs):
     assert cmd == res_obj_class(**internal_kwargs)
 
 
+@pytest.mark.parametrize(
+    'query, res_obj_class, internal_kwargs',
+    [
+        ('query * foo join bar on bar.foo_id=foo._rowid;',
+         JoinCmd,
+         {'projection': ['*'], 'left': 'foo', 'right': 'bar', 'left_col': '_rowid', 'right_col': 'foo_id',
+          'conditions_list': ConditionList('', [])}
+        ),
+        ('query foo.a,bar.b foo join bar on foo.a=bar.a where op:and conditions foo.a>1 bar.b="x" limit 3;',
+         JoinCmd,
+         {'projection': ['foo.a', 'bar.b'], 'left': 'foo', 'right': 'bar', 'left_col': 'a', 'right_col': 'a',
+          'conditions_list': ConditionList('and', [Comparison(Column('foo.a'), '>', Literal('1')),
+                                                   Comparison(Column('bar.b'), '=', Literal('"x"'))]),
+          'limit': 3}
+        ),
+        ('query a foo join bar on foo.a=bar.a;', None.__class__, {}),
+        ('query * foo join bar on foo.a=bar.a where op:and conditions a>1;', None.__class__, {}),
+    ])
+def test_parse_join(query, res_obj_class, internal_kwargs):
+    qp = QueryParser()
+    cmd = qp._parse_join(query)
+    assert cmd == res_obj_class(**internal_kwargs)
+
+def test_parse_join_not_okay():
+    qp = QueryParser()
+    with pytest.raises(CommandError):
+        qp._parse_join('query * foo join bar on foo.a=baz.a;')
+
+@pytest.mark.parametrize(
+    'projection, left_col, right_col, conditions_list',
+    [
+        (['*'], 'a', 'c', ConditionList('', [])),
+        (['*'], 'a', 'b', ConditionList('', [])),
+        (['foo.a', 'bar.a'], 'a', '_rowid', ConditionList('', [])),
+        (['*'], 'a', '_rowid', ConditionList('or', [Comparison(Column('foo.a'), '>', Literal('1')),
+                                                    Comparison(Column('bar.b'), '=', Literal('"x"'))])),
+        (['*'], 'a', '_rowid', ConditionList('and', [Comparison(Column('baz.a'), '>', Literal('1'))])),
+        (['*'], 'a', '_rowid', ConditionList('and', [Comparison(Column('foo.a'), '>', Literal('"x"'))])),
+    ])
+def test_join_cmd_not_okay(mock_dbmanager, projection, left_col, right_col, conditions_list):
+    mock_dbmanager.get_table_schema.side_effect = lambda table_name: \
+        {'foo': {'a': 'int'}, 'bar': {'b': 'str'}}[table_name]
+    cmd = JoinCmd(projection=projection, left='foo', right='bar', left_col=left_col,
+                  right_col=right_col, conditions_list=conditions_list)
+    with pytest.raises(CommandError):
+        list(cmd.execute(mock_dbmanager))
+    mock_dbmanager.scan_rows.assert_not_called()
+
+
 @pytest.mark.parametrize(
     'query, res_obj_class, internal_kwargs',
     [
@@ -494,6 +997,7 @@ def test_parse_table_delete_rows(query, res_obj_class, internal_kwargs):
     'query, res_obj_class, internal_kwargs',
     [
         ('tables test;', TablesCmd, {'db_name': 'test'}),
+        ('tables test with counts;', TablesCmd, {'db_name': 'test', 'counts': True}),
         ('tables;', None.__class__, {}),
         ('tables foo baz;', None.__class__, {})
     ])
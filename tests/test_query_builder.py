@@ -47,6 +47,29 @@ def test_create_select_with_label():
     test_result = 'query name  users where op:or conditions age<=99;'
     assert queryBuilder.build_select(test_parameters) == test_result
 
+def test_create_select_with_limit():
+    queryBuilder = QueryBuilder()
+    test_parameters = {'DbName':'my_db','TableName':'users','myLabel[0]':'','Limit':'10','Offset':'20','conditionType':'or','myKeys[0]':'age','myOperators[0]':'<=','myValues[0]':'99'}
+    test_result = 'query * users where op:or conditions age<=99 limit 10 offset 20;'
+    assert queryBuilder.build_select(test_parameters) == test_result
+    test_parameters.update(Offset='')
+    assert queryBuilder.build_select(test_parameters) == 'query * users where op:or conditions age<=99 limit 10;'
+
+def test_invalid_limit_offset():
+    queryBuilder = QueryBuilder()
+    test_parameters = {'DbName':'my_db','TableName':'users','myLabel[0]':'','Limit':'-1','conditionType':''}
+    with pytest.raises(ValueError):
+        queryBuilder.build_select(test_parameters)
+    with pytest.raises(ValueError):
+        queryBuilder.build_select(dict(test_parameters, Limit='', Offset='x'))
+
+    from flask import Flask
+    from sdbms.app.views import main_api
+    app = Flask(__name__)
+    app.register_blueprint(main_api)
+    response = app.test_client().post('/result', data=test_parameters)
+    assert response.status_code == 400
+
 
 def test_create_insert():
     queryBuilder = QueryBuilder()
@@ -66,8 +89,39 @@ def test_create_detelete():
     test_result = 'delete in users where op:or conditions age=76;'
     assert queryBuilder.build_delete((test_parameters)) == test_result
 
+def test_create_update_by_rowid():
+    queryBuilder = QueryBuilder()
+    test_parameters = {'DbName':'my_db','TableName':'users','myLabel[0]':'age','myLabelValue[0]':76,'Rowid':'5'}
+    test_result = 'update users set age=76  where op:and conditions _rowid=5;'
+    assert queryBuilder.build_update(test_parameters) == test_result
+
+def test_create_delete_by_rowid():
+    queryBuilder = QueryBuilder()
+    test_parameters = {'DbName':'my_db','TableName':'users','conditionType':'or','myKeys[0]':'age','myOperators[0]':'=','myValues[0]':'76','Rowid':5}
+    test_result = 'delete in users where op:and conditions _rowid=5;'
+    assert queryBuilder.build_delete((test_parameters)) == test_result
+
 def test_create_db():
     queryBuilder = QueryBuilder()
     test_parameters = {'DbName': 'my_db', 'TableName': 'users', 'conditionType': 'or', 'myKeys[0]': 'age','myOperators[0]': '=', 'myValues[0]': '76', }
     test_result = 'use sdb my_db;'
-    assert  queryBuilder.use_db((test_parameters)) == test_result
\ No newline at end of file
+    assert  queryBuilder.use_db((test_parameters)) == test_result
+def test_create_update_and_delete_by_rowid_any_position():
+    queryBuilder = QueryBuilder()
+    test_parameters = {'DbName':'my_db','TableName':'users','Rowid':'5','myLabel[0]':'age','myLabelValue[0]':76,'conditionType':'','myKeys[0]':'','myOperators[0]':'','myValues[0]':''}
+    assert queryBuilder.build_update(test_parameters) == 'update users set age=76  where op:and conditions _rowid=5;'
+    test_parameters = {'DbName':'my_db','TableName':'users','Rowid':'','conditionType':'or','myKeys[0]':'age','myOperators[0]':'=','myValues[0]':'76'}
+    assert queryBuilder.build_delete(test_parameters) == 'delete in users where op:or conditions age=76;'
+
+def test_invalid_rowid():
+    queryBuilder = QueryBuilder()
+    test_parameters = {'DbName':'my_db','TableName':'users','conditionType':'','Rowid':'-1'}
+    with pytest.raises(ValueError):
+        queryBuilder.build_delete(test_parameters)
+
+    from flask import Flask
+    from sdbms.app.views import main_api
+    app = Flask(__name__)
+    app.register_blueprint(main_api)
+    response = app.test_client().post('/deleteResult', data=test_parameters)
+    assert response.status_code == 400